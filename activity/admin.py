@@ -16,12 +16,15 @@ class ActionAdmin(admin.ModelAdmin):
                    'target_content_type',
                    'is_global',)
 
+    def get_queryset(self, request):
+        return super(ActionAdmin, self).get_queryset(request).with_objects()
+
 admin.site.register(Action, ActionAdmin)
 
 
 class StreamAdmin(admin.ModelAdmin):
     list_display = ('user', 'action', 'get_created', 'get_handler')
-    list_filter = ('action__handler',
+    list_filter = ('handler',
                    'action__is_global',
                    'action__actor_content_type',
                    'action__action_object_content_type',
@@ -29,14 +32,14 @@ class StreamAdmin(admin.ModelAdmin):
     search_fields = ('user__username',)
 
     def get_created(self, obj):
-        return obj.action.created
+        return obj.created
     get_created.short_description = 'Created'
-    get_created.admin_order_field = 'action__created'
+    get_created.admin_order_field = 'created'
 
     def get_handler(self, obj):
-        return obj.action.handler
+        return obj.handler
     get_handler.short_description = 'Handler'
-    get_handler.admin_order_field = 'action__handler'
+    get_handler.admin_order_field = 'handler'
 
 admin.site.register(Stream, StreamAdmin)
 
@@ -0,0 +1,195 @@
+"""
+Async counterparts of the feed API for ASGI deployments.
+
+``Feed`` and ``ActivitiesView`` mix these classes in. ORM calls and
+rendering go through ``sync_to_async`` of asgiref, which Django depends on,
+so they never block the event loop. Querysets are iterated with the async
+ORM on Django 4.1 and later.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from activity.conf import get_setting
+from activity.metrics import get_metrics, timed
+from activity.pagination import Page, PartialRows, encode_cursor, make_page
+
+
+def to_async(func, thread_sensitive=True):
+    """
+    Return coroutine function calling ``func`` in a worker thread. Thread
+    sensitive calls share the thread holding the request's connections.
+    """
+    return sync_to_async(func, thread_sensitive=thread_sensitive)
+
+
+async def alist(queryset):
+    """
+    Evaluate queryset, with the async ORM where Django has it
+    """
+    if hasattr(queryset, '__aiter__'):
+        return [item async for item in queryset]
+    return await to_async(list)(queryset)
+
+
+async def aprefetch_objects(actions):
+    """
+    Async ``prefetch_objects``. Queries of the content types are thread
+    sensitive, so they run one after another on the request's thread
+    """
+    from activity.managers import object_querysets, set_objects
+
+    if not actions:
+        return actions
+    querysets, keys = await to_async(object_querysets)(actions)
+    results = await asyncio.gather(*(alist(queryset) for content_type_id, queryset in querysets))
+    loaded = {}
+    for (content_type_id, queryset), objs in zip(querysets, results):
+        for obj in objs:
+            loaded[(content_type_id, obj.pk)] = obj
+    set_objects(actions, keys, loaded)
+    return actions
+
+
+async def aevaluate(queryset):
+    """
+    Evaluate queryset of actions, loading generic relations when the
+    queryset was made with ``with_objects``
+    """
+    prefetch = getattr(queryset, '_with_objects', False)
+    if prefetch:
+        queryset = queryset._clone()
+        queryset._with_objects = False
+    items = await alist(queryset)
+    if prefetch:
+        await aprefetch_objects(items)
+    return items
+
+
+async def apaginate(queryset, limit):
+    """
+    Async ``paginate`` for querysets and feeds
+    """
+    if hasattr(queryset, 'afetch'):
+        rows = await queryset.afetch(limit + 1)
+    else:
+        rows = await aevaluate(queryset[:limit + 1])
+    return make_page(rows, limit, getattr(queryset, '_ascending', False))
+
+
+class AsyncFeedMixin(object):
+    async def akeys(self, limit=None):
+        """
+        Async ``keys``. Sources are read one after another on the request's
+        thread, which holds its database connections
+        """
+        return await self._akeys(limit, self._before, self._after)
+
+    async def _akeys(self, limit, before, after):
+        results = await asyncio.gather(*(to_async(source.keys)(limit, before, after)
+                                         for source in self.sources))
+        return self.merge(results, limit)
+
+    async def _aload(self, ids):
+        if not ids:
+            return []
+        actions = dict((action.pk, action) for action in await aevaluate(self.queryset.filter(pk__in=ids)))
+        missing = [pk for pk in ids if pk not in actions]
+        if missing and self.archive is not None:
+            actions.update((action.pk, action) for action in
+                           await aevaluate(self.archive.filter(pk__in=missing)))
+        return [actions[pk] for pk in ids if pk in actions]
+
+    async def afetch(self, limit=None):
+        """
+        Async ``fetch``
+        """
+        tags = {'feed': self.name or 'feed'}
+        with timed('activity.feed', tags):
+            actions = []
+            before, after = self._before, self._after
+            batch, cursor = limit, None
+            for refill in range(get_setting('FEED_MAX_REFILLS') + 1):
+                keys = await self._akeys(batch, before, after)
+                actions.extend(await self._aload([pk for created, pk in keys]))
+                if limit is None or len(keys) < batch or len(actions) >= limit:
+                    cursor = None
+                    break
+                cursor = encode_cursor(*keys[-1])
+                if self._ascending:
+                    after = cursor
+                else:
+                    before = cursor
+                batch *= 2
+            actions = PartialRows(actions, cursor) if cursor else actions[:limit]
+            for callback in self._callbacks:
+                if actions:
+                    await to_async(callback)(actions)
+        get_metrics().incr('activity.feed.items', len(actions), tags)
+        return actions
+
+
+class AsyncActivitiesMixin(object):
+    # Templates are rendered on the thread running the request's queries,
+    # so handlers querying the database while rendering reuse its
+    # connections. Set False to render in executor threads when rendering
+    # never touches the database, as their connections are not closed.
+    render_thread_sensitive = True
+
+    async def arender(self, item):
+        """
+        Async ``render``
+        """
+        return await to_async(self.render, self.render_thread_sensitive)(item)
+
+    async def arender_page(self, items):
+        """
+        Async ``render_page``
+        """
+        return await to_async(self.render_page, self.render_thread_sensitive)(items)
+
+    async def apaginate(self, queryset, limit=10, render=True):
+        """
+        Async ``paginate``
+        """
+        page = await apaginate(queryset.with_objects(), limit)
+        if render:
+            return Page(await self.arender_page(page), page.next_cursor, page.previous_cursor)
+        return page
+
+    async def apublic(self, public=True, limit=10, render=True, before=None, after=None):
+        """
+        Async ``public``
+        """
+        from activity.models import Action
+
+        queryset = Action.objects.public() if public else Action.objects.private()
+        return await self.apaginate(queryset.replica().keyset(before, after), limit, render)
+
+    async def aprivate(self, public=False, limit=10, render=True, before=None, after=None):
+        """
+        Async ``private``
+        """
+        return await self.apublic(public, limit, render, before, after)
+
+    async def auser(self, user, limit=10, render=True, before=None, after=None, archived=False):
+        """
+        Async ``user``
+        """
+        from activity.models import Action
+
+        queryset = await to_async(Action.objects.user_feed)(user, before=before, after=after, archived=archived)
+        return await self.apaginate(queryset, limit, render)
+
+    async def astream(self, user, limit=10, render=True, before=None, after=None, mark_seen=True,
+                      archived=False):
+        """
+        Async ``stream``
+        """
+        from activity.models import Action, Stream
+
+        queryset = await to_async(Action.objects.stream_feed)(user, before=before, after=after, archived=archived)
+        page = await self.apaginate(queryset, limit, render)
+        if mark_seen and before is None:
+            await to_async(Stream.objects.mark_seen)(user)
+        return page
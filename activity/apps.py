@@ -1,9 +1,10 @@
 from django.apps import AppConfig
-from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import gettext_lazy as _
 
 
 class ActivityConfig(AppConfig):
     name = 'activity'
+    default_auto_field = 'django.db.models.AutoField'
     verbose_name = _("Activity")
 
     def ready(self):
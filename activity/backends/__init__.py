@@ -0,0 +1,24 @@
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from activity.conf import get_setting
+
+
+_backends = {}
+
+
+def get_backend():
+    """
+    Return instance of the feed backend configured by ``ACTIVITY_FEED_BACKEND``
+    """
+    path = get_setting('FEED_BACKEND')
+    if path not in _backends:
+        _backends[path] = import_string(path)(**get_setting('FEED_BACKEND_OPTIONS'))
+    return _backends[path]
+
+
+@receiver(setting_changed)
+def reset_backends(sender, setting, **kwargs):
+    if setting in ('ACTIVITY_FEED_BACKEND', 'ACTIVITY_FEED_BACKEND_OPTIONS'):
+        _backends.clear()
@@ -0,0 +1,65 @@
+class BaseFeedBackend(object):
+    """
+    Storage of per-user streams. Entries are (created, action id) pairs
+    ordered newest first; cursors are tokens from ``activity.pagination``.
+    """
+    def reading(self, using):
+        """
+        Return backend reading streams from the given database alias.
+        Backends not stored in a database return themselves.
+        """
+        return self
+
+    def add(self, action, user_ids, batch_size=500):
+        """
+        Add action to streams of the given users skipping existing entries.
+        Returns number of entries written.
+        """
+        return len(self.insert(action, user_ids, batch_size))
+
+    def insert(self, action, user_ids, batch_size=500):
+        """
+        Add action to streams of the given users skipping existing entries.
+        Returns list of users whose stream got the entry.
+        """
+        raise NotImplementedError
+
+    def add_actions(self, user_id, actions, batch_size=500):
+        """
+        Add several actions to the user's stream skipping existing entries.
+        Returns number of entries written.
+        """
+        return sum(self.add(action, [user_id], batch_size) for action in actions)
+
+    def remove(self, action_ids, user_ids=None):
+        """
+        Remove actions from streams of the given users, or from all streams
+        """
+        raise NotImplementedError
+
+    def purge(self, user_id, actions):
+        """
+        Remove actions of the given queryset from the user's stream.
+        Returns number of entries removed.
+        """
+        raise NotImplementedError
+
+    def trim(self, user_id, length, batch_size=1000):
+        """
+        Keep only the newest ``length`` entries of the user's stream.
+        Returns number of entries removed.
+        """
+        raise NotImplementedError
+
+    def lengths(self, user_ids):
+        """
+        Return dictionary of stream lengths of the given users
+        """
+        raise NotImplementedError
+
+    def range(self, user_id, limit=None, before=None, after=None):
+        """
+        Return list of (created, action id) tuples, newest first, or the
+        ones right after ``after`` oldest first
+        """
+        raise NotImplementedError
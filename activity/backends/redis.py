@@ -0,0 +1,252 @@
+import calendar
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from activity.backends.base import BaseFeedBackend
+from activity.pagination import decode_cursor
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_score(created):
+    """
+    Return datetime as microseconds since epoch
+    """
+    if timezone.is_aware(created):
+        created = timezone.make_naive(created, dt_timezone.utc)
+    return calendar.timegm(created.timetuple()) * 1000000 + created.microsecond
+
+
+def from_score(score):
+    created = EPOCH + timedelta(microseconds=int(score))
+    if settings.USE_TZ:
+        created = timezone.make_aware(created, dt_timezone.utc)
+    return created
+
+
+class RedisFeedBackend(BaseFeedBackend):
+    """
+    Streams stored as capped sorted sets, one per user. Members are action
+    IDs scored by creation time in microseconds.
+
+    Pass ``url`` to connect with redis-py, ``client`` for an existing
+    connection or ``local=True`` to keep the sets in process memory.
+    """
+    def __init__(self, url=None, client=None, local=False, prefix='activity:stream:', max_length=1000):
+        if client is None:
+            if local:
+                client = LocalSortedSets()
+            elif url is not None:
+                try:
+                    import redis
+                except ImportError:
+                    raise ImproperlyConfigured('RedisFeedBackend requires the redis package.')
+                client = redis.StrictRedis.from_url(url)
+            else:
+                raise ImproperlyConfigured('RedisFeedBackend requires url, client or local option.')
+        self.client = client
+        self.prefix = prefix
+        self.max_length = max_length
+
+    def key(self, user_id):
+        return '%s%s' % (self.prefix, user_id)
+
+    def insert(self, action, user_ids, batch_size=500):
+        score = to_score(action.created)
+        user_ids = list(user_ids)
+        added = []
+        pipe = self.client.pipeline(transaction=False)
+        for index, user_id in enumerate(user_ids, 1):
+            key = self.key(user_id)
+            pipe.zadd(key, {str(action.pk): score})
+            if self.max_length is not None:
+                pipe.zremrangebyrank(key, 0, -(self.max_length + 1))
+                pipe.zscore(key, str(action.pk))
+            if index % batch_size == 0:
+                added.extend(self._added(pipe.execute()))
+        added.extend(self._added(pipe.execute()))
+        return [user_id for user_id, count in zip(user_ids, added) if count]
+
+    def _added(self, results):
+        if self.max_length is None:
+            return results
+        # Capped streams reply to ZADD, ZREMRANGEBYRANK and ZSCORE in turn.
+        # Members trimmed right away, being older than the whole stream,
+        # don't count as added.
+        return [added and score is not None for added, score in zip(results[::3], results[2::3])]
+
+    def add_actions(self, user_id, actions, batch_size=500):
+        mapping = dict((str(action.pk), to_score(action.created)) for action in actions)
+        if not mapping:
+            return 0
+        key = self.key(user_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zadd(key, mapping)
+        if self.max_length is not None:
+            pipe.zremrangebyrank(key, 0, -(self.max_length + 1))
+        return pipe.execute()[0]
+
+    def remove(self, action_ids, user_ids=None):
+        if user_ids is None:
+            raise NotImplementedError('RedisFeedBackend can remove actions only from given users.')
+        members = [str(pk) for pk in action_ids]
+        if not members:
+            return 0
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zrem(self.key(user_id), *members)
+        return sum(pipe.execute())
+
+    def purge(self, user_id, actions):
+        # Streams are capped, so all members can be matched at once
+        members = self.client.zrevrangebyscore(self.key(user_id), '+inf', '-inf')
+        action_ids = actions.filter(pk__in=[int(member) for member in members]).values_list('pk', flat=True)
+        return self.remove(list(action_ids), [user_id])
+
+    def trim(self, user_id, length, batch_size=1000):
+        return self.client.zremrangebyrank(self.key(user_id), 0, -(length + 1))
+
+    def lengths(self, user_ids):
+        user_ids = list(user_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcard(self.key(user_id))
+        return dict(zip(user_ids, pipe.execute()))
+
+    def range(self, user_id, limit=None, before=None, after=None):
+        key = self.key(user_id)
+        high, low = '+inf', '-inf'
+        if before is not None:
+            before = decode_cursor(before)
+            high = to_score(before[0])
+        if after is not None:
+            after = decode_cursor(after)
+            low = to_score(after[0])
+
+        num = None
+        if limit is not None:
+            # Entries sharing the boundary score are filtered below
+            num = limit
+            for boundary in (high, low):
+                if boundary not in ('+inf', '-inf'):
+                    num += self.client.zcount(key, boundary, boundary)
+
+        options = {'withscores': True}
+        if num is not None:
+            options.update(start=0, num=num)
+        if after is not None:
+            # Entries right after the cursor, oldest first
+            rows = self.client.zrangebyscore(key, low, high, **options)
+        else:
+            rows = self.client.zrevrangebyscore(key, high, low, **options)
+
+        entries = []
+        for member, score in rows:
+            entry = (int(score), int(member))
+            if before is not None and entry >= (high, before[1]):
+                continue
+            if after is not None and entry <= (low, after[1]):
+                continue
+            entries.append(entry)
+        entries.sort(reverse=after is None)
+        if limit is not None:
+            entries = entries[:limit]
+        return [(from_score(score), pk) for score, pk in entries]
+
+
+class LocalSortedSets(object):
+    """
+    In-process implementation of the sorted set commands used by
+    ``RedisFeedBackend``. Meant for tests and local development.
+    """
+    def __init__(self):
+        self.sets = defaultdict(dict)
+        self.lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def _sorted(self, name):
+        # Ascending by (score, member) like Redis
+        return sorted(self.sets[name].items(), key=lambda item: (item[1], item[0]))
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            added = len(set(mapping) - set(self.sets[name]))
+            self.sets[name].update((str(member), float(score)) for member, score in mapping.items())
+            return added
+
+    def zrem(self, name, *members):
+        with self.lock:
+            return sum(1 for member in members if self.sets[name].pop(str(member), None) is not None)
+
+    def zscore(self, name, member):
+        with self.lock:
+            return self.sets[name].get(str(member))
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.sets[name])
+
+    def zcount(self, name, low, high):
+        low, high = float(low), float(high)
+        with self.lock:
+            return sum(1 for score in self.sets[name].values() if low <= score <= high)
+
+    def zremrangebyrank(self, name, start, end):
+        with self.lock:
+            items = self._sorted(name)
+            size = len(items)
+            start = start + size if start < 0 else start
+            end = end + size if end < 0 else end
+            if end < 0:
+                return 0
+            removed = items[max(start, 0):end + 1]
+            for member, score in removed:
+                del self.sets[name][member]
+            return len(removed)
+
+    def zrangebyscore(self, name, low, high, start=None, num=None, withscores=False):
+        high, low = float(high), float(low)
+        with self.lock:
+            items = [item for item in self._sorted(name) if low <= item[1] <= high]
+        if start is not None and num is not None:
+            items = items[start:start + num]
+        if withscores:
+            return items
+        return [member for member, score in items]
+
+    def zrevrangebyscore(self, name, high, low, start=None, num=None, withscores=False):
+        high, low = float(high), float(low)
+        with self.lock:
+            items = [item for item in reversed(self._sorted(name)) if low <= item[1] <= high]
+        if start is not None and num is not None:
+            items = items[start:start + num]
+        if withscores:
+            return items
+        return [member for member, score in items]
+
+
+class LocalPipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        with self.client.lock:
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
@@ -0,0 +1,310 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import connections, router, transaction
+from django.db.models import Count, F, Q
+
+from activity.backends.base import BaseFeedBackend
+from activity.db import bulk_insert_ignore, insert_from_sql
+from activity.feeds import QuerySetSource
+
+
+class SQLFeedBackend(BaseFeedBackend):
+    """
+    Streams stored in the Stream table
+    """
+    def __init__(self, using=None):
+        self.using = using
+
+    def reading(self, using):
+        # A database set in FEED_BACKEND_OPTIONS is used for reads too
+        if self.using is not None:
+            return self
+        return self.__class__(using=using)
+
+    def get_queryset(self):
+        return apps.get_model('activity', 'Stream').objects.db_manager(self.using).all()
+
+    def insert(self, action, user_ids, batch_size=500, **fields):
+        Stream = apps.get_model('activity', 'Stream')
+
+        def streams(user_ids):
+            return (Stream(user_id=user_id, action=action, created=action.created,
+                           public=action.public, handler=action.handler, **fields)
+                    for user_id in user_ids)
+
+        user_ids = list(user_ids)
+        inserted = bulk_insert_ignore(Stream, streams(user_ids), batch_size=batch_size,
+                                      using=self.using, returning='user_id')
+        if inserted is not None:
+            return inserted
+
+        # Without RETURNING, users having the entry already are looked up
+        # first. Should a concurrent task write some of the rest meanwhile,
+        # the batch is rolled back and written a user at a time to tell
+        # which entries were added here.
+        using = self.using or router.db_for_write(Stream)
+        inserted = []
+        queryset = self.get_queryset().filter(action=action)
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            existing = set(queryset.filter(user__in=batch).values_list('user', flat=True))
+            new = [user_id for user_id in batch if user_id not in existing]
+            with transaction.atomic(using=using):
+                if bulk_insert_ignore(Stream, streams(new), batch_size=batch_size, using=using) == len(new):
+                    inserted.extend(new)
+                    continue
+                transaction.set_rollback(True, using=using)
+            inserted.extend(user_id for user_id in new
+                            if bulk_insert_ignore(Stream, streams([user_id]), using=using))
+        return inserted
+
+    def aggregate(self, action, user_ids, key, window, sample_size=3, batch_size=500):
+        """
+        Merge action into the users' entries of the same group whose newest
+        action is at most ``window`` older, or add new entries. A merged
+        entry points to its newest action and keeps the newest
+        ``sample_size`` action IDs.
+
+        Entries are matched regardless of their newest action's time, so an
+        action arriving late or replayed merges like the others. An action
+        found in a sample, or older than every action of a full sample,
+        counts as merged already, and so does an action the user has an
+        entry of already. Entries are locked while merging. Returns list of
+        users whose stream changed.
+        """
+        Action = apps.get_model('activity', 'Action')
+        queryset = self.get_queryset()
+        position = (action.created, action.pk)
+        user_ids = list(user_ids)
+        changed = []
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            with transaction.atomic(using=queryset.db):
+                rows = list(queryset.select_for_update().filter(
+                    user__in=batch, group_key=key, created__gte=action.created - window,
+                ).order_by('user', 'created').values_list('pk', 'user', 'action', 'created', 'group_sample'))
+                entries = defaultdict(list)
+                for pk, user_id, head_id, created, sample in rows:
+                    entries[user_id].append((pk, (created, head_id), [int(value) for value in sample.split(',') if value]))
+                times = dict(Action.objects.using(queryset.db).filter(
+                    pk__in=set(value for found in entries.values() for pk, head, sample in found for value in sample),
+                ).values_list('pk', 'created'))
+
+                # Users having a separate entry of the action keep only that one
+                handled = set(queryset.filter(user__in=batch, action=action).values_list('user', flat=True))
+                # Entries ending up alike are updated together, usually the
+                # followers of an actor share them
+                merged = defaultdict(list)
+                for user_id, found in entries.items():
+                    if user_id in handled:
+                        continue
+                    if any(action.pk in sample for pk, head, sample in found):
+                        handled.add(user_id)
+                        continue
+                    # The oldest entry still within the window
+                    pk, head, sample = found[0]
+                    sample = sorted(((times[value], value) for value in sample if value in times), reverse=True)
+                    if len(sample) >= sample_size and position < sample[-1]:
+                        # Rolled out of the sample since it was merged
+                        handled.add(user_id)
+                        continue
+                    if len(sample) < sample_size and sample and action.created < sample[-1][0] - window:
+                        # The entry's group starts later
+                        continue
+                    sample = tuple(value for created, value in sorted(sample + [position], reverse=True)[:sample_size])
+                    merged[(sample, position > head)].append((pk, user_id))
+                    handled.add(user_id)
+
+                for (sample, newest), found in merged.items():
+                    values = {'group_size': F('group_size') + 1, 'group_sample': ','.join(map(str, sample))}
+                    if newest:
+                        values.update(action=action, created=action.created, public=action.public)
+                    queryset.filter(pk__in=[pk for pk, user_id in found]).update(**values)
+                    changed.extend(user_id for pk, user_id in found)
+
+                changed.extend(self.insert(action, [user_id for user_id in batch if user_id not in handled],
+                                           batch_size, group_key=key, group_sample=str(action.pk)))
+        return changed
+
+    def attach_aggregates(self, user_id, actions):
+        """
+        Set ``group_size`` and ``group_sample`` of actions heading merged
+        entries of the user's stream. Sample actions are loaded with their
+        generic relations in a few queries.
+        """
+        Action = apps.get_model('activity', 'Action')
+        rows = list(self.get_queryset().filter(
+            user=user_id, action__in=[action.pk for action in actions], group_size__gt=1,
+        ).values_list('action', 'group_size', 'group_sample'))
+        if not rows:
+            return
+
+        samples = dict((action_id, (size, [int(value) for value in sample.split(',') if value]))
+                       for action_id, size, sample in rows)
+        wanted = set(pk for size, sample in samples.values() for pk in sample)
+        loaded = dict((action.pk, action) for action in actions)
+        wanted.difference_update(loaded)
+        if wanted:
+            loaded.update((action.pk, action) for action in
+                          Action.objects.using(actions[0]._state.db).filter(pk__in=wanted).with_objects())
+        for action in actions:
+            if action.pk in samples:
+                size, sample = samples[action.pk]
+                action.group_size = size
+                action.group_sample = [loaded[pk] for pk in sample if pk in loaded]
+
+    def add_actions(self, user_id, actions, batch_size=500):
+        Stream = apps.get_model('activity', 'Stream')
+        streams = (Stream(user_id=user_id, action=action, created=action.created,
+                          public=action.public, handler=action.handler)
+                   for action in actions)
+        return bulk_insert_ignore(Stream, streams, batch_size=batch_size, using=self.using)
+
+    def remove(self, action_ids, user_ids=None):
+        queryset = self.get_queryset().filter(action__in=action_ids)
+        if user_ids is not None:
+            queryset = queryset.filter(user__in=user_ids)
+        return queryset.delete()[0]
+
+    def detach(self, actions, user_ids=None):
+        """
+        Point merged entries headed by actions of the given queryset to
+        their newest sampled action not in it, and take the removed actions
+        out of the entries' size and sample, so the rest of the group stays
+        in the stream. Entries without such an action are left alone.
+        Returns IDs of the changed entries.
+        """
+        Action = apps.get_model('activity', 'Action')
+        queryset = self.get_queryset()
+        entries = queryset.filter(action__in=actions.values('pk'), group_size__gt=1)
+        if user_ids is not None:
+            entries = entries.filter(user__in=user_ids)
+        groups = defaultdict(list)
+        for pk, user_id, sample in entries.values_list('pk', 'user', 'group_sample'):
+            groups[sample].append((pk, user_id))
+        if not groups:
+            return []
+
+        sampled = set(int(value) for sample in groups for value in sample.split(',') if value)
+        removed = set(actions.filter(pk__in=sampled).values_list('pk', flat=True))
+        kept = Action.objects.using(queryset.db).filter(pk__in=sampled - removed).in_bulk()
+        changed = []
+        for sample, rows in groups.items():
+            sample = [int(value) for value in sample.split(',') if value]
+            rest = [pk for pk in sample if pk in kept]
+            if not rest:
+                continue
+            head = kept[rest[0]]
+            # Users having a separate entry of that action keep only that one
+            taken = set(queryset.filter(action=head, user__in=[user_id for pk, user_id in rows])
+                        .values_list('user', flat=True))
+            pks = [pk for pk, user_id in rows if user_id not in taken]
+            queryset.filter(pk__in=pks).update(
+                action=head, created=head.created, public=head.public,
+                group_size=F('group_size') - max(len([pk for pk in sample if pk in removed]), 1),
+                group_sample=','.join(str(pk) for pk in rest))
+            changed.extend(pks)
+        return changed
+
+    def purge(self, user_id, actions):
+        # Merged entries headed by removed actions keep their other actions
+        self.detach(actions, [user_id])
+        # A single DELETE matching actions by subquery
+        queryset = self.get_queryset().filter(user=user_id, action__in=actions.values('pk'))
+        return queryset._raw_delete(queryset.db)
+
+    def trim(self, user_id, length, batch_size=1000):
+        # Rows are deleted oldest first in short batches to avoid long locks
+        queryset = self.get_queryset().filter(user=user_id)
+        cutoff = list(queryset.order_by('-created', '-action_id')
+                      .values_list('created', 'action_id')[length:length + 1])
+        if not cutoff:
+            return 0
+        created, action_id = cutoff[0]
+        expired = queryset.filter(Q(created__lt=created) | Q(action_id__lte=action_id),
+                                  created__lte=created).order_by('created')
+        removed = 0
+        while True:
+            ids = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return removed
+            removed += self.get_queryset().filter(pk__in=ids).delete()[0]
+
+    def lengths(self, user_ids):
+        return dict(self.get_queryset().filter(user__in=user_ids).order_by()
+                    .values_list('user').annotate(length=Count('pk')))
+
+    def rebuild(self, lower=None, upper=None, user_ids=None, since=None, until=None, exclude_handlers=()):
+        """
+        Write entries of public actions by actors the users follow with a
+        single INSERT ... SELECT joining actions and follows, skipping
+        existing entries. Users are limited to the ID range (lower, upper]
+        or to the given IDs, and actions to the creation time range
+        [since, until). Returns number of entries written.
+        """
+        Action = apps.get_model('activity', 'Action')
+        Follow = apps.get_model('activity', 'Follow')
+        Stream = apps.get_model('activity', 'Stream')
+        using = self.using or router.db_for_write(Stream)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+
+        def column(alias, model, name):
+            return '%s.%s' % (alias, qn(model._meta.get_field(name).column))
+
+        where = ['%s = %%s' % column('f', Follow, 'actor_only'), '%s = %%s' % column('a', Action, 'public'),
+                 '%s = %%s' % column('a', Action, 'is_global'), '%s = %%s' % column('a', Action, 'is_pulled')]
+        params = [True, True, False, False]
+        if lower is not None:
+            where.append('%s > %%s' % column('f', Follow, 'user'))
+            params.append(lower)
+        if upper is not None:
+            where.append('%s <= %%s' % column('f', Follow, 'user'))
+            params.append(upper)
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            if not user_ids:
+                return 0
+            where.append('%s IN (%s)' % (column('f', Follow, 'user'), ', '.join(['%s'] * len(user_ids))))
+            params.extend(user_ids)
+        if since is not None:
+            where.append('%s >= %%s' % column('a', Action, 'created'))
+            params.append(connection.ops.adapt_datetimefield_value(since))
+        if until is not None:
+            where.append('%s < %%s' % column('a', Action, 'created'))
+            params.append(connection.ops.adapt_datetimefield_value(until))
+        if exclude_handlers:
+            where.append('%s NOT IN (%s)' % (column('a', Action, 'handler'),
+                                             ', '.join(['%s'] * len(exclude_handlers))))
+            params.extend(exclude_handlers)
+
+        select = (
+            'SELECT %(user)s, %(id)s, %(created)s, %(public)s, %(handler)s, %%s, %%s, %%s '
+            'FROM %(actions)s a INNER JOIN %(follows)s f '
+            'ON %(content_type)s = %(actor_content_type)s AND %(object_id)s = %(actor_object_id)s '
+            'WHERE %(where)s'
+        ) % {
+            'user': column('f', Follow, 'user'),
+            'id': column('a', Action, 'id'),
+            'created': column('a', Action, 'created'),
+            'public': column('a', Action, 'public'),
+            'handler': column('a', Action, 'handler'),
+            'actions': qn(Action._meta.db_table),
+            'follows': qn(Follow._meta.db_table),
+            'content_type': column('f', Follow, 'content_type'),
+            'actor_content_type': column('a', Action, 'actor_content_type'),
+            'object_id': column('f', Follow, 'object_id'),
+            'actor_object_id': column('a', Action, 'actor_object_id'),
+            'where': ' AND '.join(where),
+        }
+        # Entries start unmerged
+        fields = [Stream._meta.get_field(name) for name in (
+            'user', 'action', 'created', 'public', 'handler', 'group_key', 'group_size', 'group_sample')]
+        return insert_from_sql(Stream, fields, select, [None, 1, ''] + params, ignore=True, using=using)
+
+    def range(self, user_id, limit=None, before=None, after=None):
+        # Reads (user, created, action) only, so the index covers them. Feeds
+        # filter out private actions when loading them.
+        source = QuerySetSource(self.get_queryset().filter(user=user_id), 'created', 'action_id')
+        return source.keys(limit, before, after)
@@ -0,0 +1,61 @@
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps
+
+
+_state = threading.local()
+
+
+def _buffers():
+    if not hasattr(_state, 'buffers'):
+        _state.buffers = []
+    return _state.buffers
+
+
+@contextmanager
+def buffered_actions():
+    """
+    Buffer ``action`` signals sent within the block and log them with
+    ``Action.objects.log_many`` when the outermost block exits without
+    errors. Buffered events are dropped if the block raises.
+    """
+    buffers = _buffers()
+    events = []
+    buffers.append(events)
+    try:
+        yield events
+    finally:
+        buffers.pop()
+    if buffers:
+        buffers[-1].extend(events)
+    elif events:
+        apps.get_model('activity', 'Action').objects.log_many(events)
+
+
+def buffer_event(event):
+    """
+    Store ``action`` signal arguments if a buffer is active.
+    Returns True when the event was buffered.
+    """
+    buffers = _buffers()
+    if buffers:
+        buffers[-1].append(event)
+        return True
+    return False
+
+
+@contextmanager
+def fanout_suppressed():
+    """
+    Don't queue fan-out for actions saved within the block
+    """
+    _state.suppressed = getattr(_state, 'suppressed', 0) + 1
+    try:
+        yield
+    finally:
+        _state.suppressed -= 1
+
+
+def is_fanout_suppressed():
+    return getattr(_state, 'suppressed', 0) > 0
@@ -0,0 +1,135 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import translation
+
+from activity.conf import get_setting
+from activity.metrics import get_metrics
+from activity.registry import activityregistry
+
+
+def is_enabled():
+    return get_setting('RENDER_CACHE')
+
+
+def get_cache():
+    return caches[get_setting('RENDER_CACHE_ALIAS')]
+
+
+def caches_fragments(handler):
+    """
+    Are fragments of the handler cached? Handlers must declare the models
+    their fragments show, or changes of them would go unnoticed.
+    """
+    return handler.cache_fragments and handler.fragment_models is not None
+
+
+def fragment_key(action_id, handler_id, version, language):
+    return 'activity:fragment:%s:%s:%s:%s' % (handler_id, version, language, action_id)
+
+
+def get_languages():
+    """
+    Return languages fragments may have been rendered in
+    """
+    languages = set([settings.LANGUAGE_CODE])
+    if settings.USE_I18N:
+        languages.update(code for code, name in settings.LANGUAGES)
+    return languages
+
+
+def render_many(items, now=None):
+    """
+    Render actions using cached fragments. All fragments are read with one
+    multi-get and the missing ones are rendered, a handler at a time, and
+    stored with one multi-set. The "since" text is filled in after reading,
+    so fragments stay valid until the action or one of its objects of the
+    handler's ``fragment_models`` change. Handlers without
+    ``fragment_models`` are rendered every time.
+    """
+    handlers = activityregistry.get_handlers()
+    language = translation.get_language() or settings.LANGUAGE_CODE
+    keys = {}
+    for item in items:
+        handler = handlers[item.handler]
+        # Merged stream entries differ between users
+        if caches_fragments(handler) and item.group_size == 1:
+            keys[item.pk] = fragment_key(item.pk, item.handler, handler.template_version, language)
+
+    cache = get_cache()
+    fragments = cache.get_many(list(keys.values())) if keys else {}
+
+    metrics = get_metrics()
+    metrics.incr('activity.render.cache_hits', len(fragments))
+    metrics.incr('activity.render.cache_misses', len(keys) - len(fragments))
+
+    uncached = [item for item in items if item.pk not in keys]
+    rendered = dict(zip((item.pk for item in uncached), activityregistry.render_many(uncached)))
+    missing = [item for item in items if item.pk in keys and keys[item.pk] not in fragments]
+    if missing:
+        fresh = dict(zip((keys[item.pk] for item in missing),
+                         activityregistry.render_many(missing, 'render_fragment_many')))
+        cache.set_many(fresh, get_setting('RENDER_CACHE_TIMEOUT'))
+        fragments.update(fresh)
+
+    output = []
+    for item in items:
+        if item.pk in rendered:
+            output.append(rendered[item.pk])
+        else:
+            output.append(handlers[item.handler].fill_fragment(fragments[keys[item.pk]], item, now))
+    return output
+
+
+def invalidate(actions):
+    """
+    Drop cached fragments of the given (action ID, handler ID) pairs in
+    every language
+    """
+    handlers = activityregistry.get_handlers()
+    languages = get_languages()
+    keys = []
+    for action_id, handler_id in actions:
+        handler = handlers.get(handler_id)
+        if handler is not None:
+            keys.extend(fragment_key(action_id, handler_id, handler.template_version, language)
+                        for language in languages)
+    if keys:
+        get_cache().delete_many(keys)
+
+
+def invalidate_object(obj, handler_ids):
+    """
+    Drop cached fragments of the newest actions of the given handlers
+    referring to the given object. Each relation is read from its
+    (content type, object ID, created) index.
+    """
+    from activity.models import Action, integer_id
+
+    querysets = [Action.objects.target(obj, handler__in=handler_ids),
+                 Action.objects.action_object(obj, handler__in=handler_ids)]
+    if integer_id(obj.pk) is not None:
+        querysets.append(Action.objects.actor(obj, handler__in=handler_ids))
+    limit = get_setting('RENDER_CACHE_INVALIDATE_LIMIT')
+    actions = set()
+    for queryset in querysets:
+        actions.update(queryset.order_by('-created').values_list('pk', 'handler')[:limit])
+    invalidate(actions)
+
+
+def watching(model):
+    """
+    Return IDs of handlers caching fragments which show instances of the
+    given model, see ``ActionHandler.fragment_models``
+    """
+    handler_ids = []
+    for handler_id, handler in activityregistry.get_handlers().items():
+        if not caches_fragments(handler):
+            continue
+        for value in handler.fragment_models:
+            if isinstance(value, str):
+                value = apps.get_model(value)
+            if value is model:
+                handler_ids.append(handler_id)
+                break
+    return handler_ids
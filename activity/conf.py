@@ -0,0 +1,54 @@
+from django.conf import settings
+
+
+DEFAULTS = {
+    # Maximum number of users handled by a single fan-out task
+    'FANOUT_CHUNK_SIZE': 1000,
+    # Number of stream rows written by a single INSERT
+    'FANOUT_BATCH_SIZE': 500,
+    # Actions by actors with more followers are not fanned out but merged
+    # into streams at read time. None fans out to every follower.
+    'FANOUT_FOLLOWER_THRESHOLD': None,
+    # Number of entries kept in a user's stream by trim_streams. None keeps all.
+    'STREAM_MAX_LENGTH': None,
+    # Number of recent actions copied to a stream when following an actor.
+    # None or 0 turns backfilling off.
+    'BACKFILL_LIMIT': 20,
+    # Number of extra reads a feed makes past keys of filtered out actions,
+    # each twice as large as the one before. A page cut short by the limit
+    # has fewer items and a cursor continuing past the keys read.
+    'FEED_MAX_REFILLS': 5,
+    # Storage of user streams and its keyword arguments
+    'FEED_BACKEND': 'activity.backends.sql.SQLFeedBackend',
+    'FEED_BACKEND_OPTIONS': {},
+    # Look up targets and action objects by their integer ID columns. Turn on
+    # once existing actions are filled in by the backfill_object_ids command.
+    'INTEGER_OBJECT_IDS': False,
+    # Sink of fan-out, feed and render metrics and its keyword arguments
+    'METRICS_BACKEND': 'activity.metrics.Metrics',
+    'METRICS_OPTIONS': {},
+    # Cache rendered action fragments in the given cache
+    'RENDER_CACHE': False,
+    'RENDER_CACHE_ALIAS': 'default',
+    'RENDER_CACHE_TIMEOUT': 60 * 60 * 24,
+    # Number of newest actions invalidated when a related object changes
+    'RENDER_CACHE_INVALIDATE_LIMIT': 1000,
+    # Database activity models are written to, and replicas feeds and
+    # follows are read from when ActivityRouter is installed
+    'WRITE_DATABASE': 'default',
+    'READ_DATABASES': (),
+    # Reads of a user who followed or acted within this many seconds go to
+    # the write database. Pins are kept in the given cache.
+    'PIN_SECONDS': 10,
+    'PIN_CACHE_ALIAS': 'default',
+    # Actions older than this many days are moved to the archive tables by
+    # the archive_activity command
+    'ARCHIVE_AFTER_DAYS': 180,
+}
+
+
+def get_setting(name):
+    """
+    Return value of ``ACTIVITY_<name>`` setting or its default
+    """
+    return getattr(settings, 'ACTIVITY_%s' % name, DEFAULTS[name])
@@ -0,0 +1,119 @@
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import AutoField
+
+
+def bulk_insert_ignore(model, objs, batch_size=500, using=None, returning=None):
+    """
+    Insert model instances in batches skipping rows which violate a unique
+    constraint. Returns number of inserted rows. Unlike ``bulk_create`` a
+    duplicate row does not roll back the rest of the batch.
+
+    With ``returning`` set to a column name, returns list of its values in
+    the inserted rows instead, or None if the database can't tell which
+    rows were inserted.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    if returning is not None and connection.vendor != 'postgresql':
+        return None
+    objs = list(objs)
+    if not objs:
+        return 0 if returning is None else []
+
+    fields = [f for f in model._meta.concrete_fields if not isinstance(f, AutoField)]
+    batch_size = max(min(batch_size, connection.ops.bulk_batch_size(fields, objs)), 1)
+
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        template = 'INSERT INTO %(table)s (%(columns)s) VALUES %(values)s ON CONFLICT DO NOTHING'
+    elif vendor == 'sqlite':
+        template = 'INSERT OR IGNORE INTO %(table)s (%(columns)s) VALUES %(values)s'
+    elif vendor == 'mysql':
+        template = 'INSERT IGNORE INTO %(table)s (%(columns)s) VALUES %(values)s'
+    else:
+        return _insert_one_by_one(model, objs, using)
+
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(f.column) for f in fields)
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    if returning is not None:
+        template += ' RETURNING %s' % qn(returning)
+
+    inserted = 0 if returning is None else []
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                params = []
+                for obj in batch:
+                    params.extend(f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+                                  for f in fields)
+                cursor.execute(template % {
+                    'table': qn(model._meta.db_table),
+                    'columns': columns,
+                    'values': ', '.join([row] * len(batch)),
+                }, params)
+                if returning is None:
+                    inserted += max(cursor.rowcount, 0)
+                else:
+                    inserted.extend(value for value, in cursor.fetchall())
+    return inserted
+
+
+def insert_select(model, fields, queryset, ignore=False, using=None):
+    """
+    Copy rows of a ``values_list`` queryset into the table of ``model``
+    with a single INSERT ... SELECT, without loading them. The queryset
+    selects values of ``fields`` in the same order. With ``ignore`` rows
+    violating a unique constraint are skipped. Returns number of inserted
+    rows.
+    """
+    using = using or queryset.db
+    select, params = queryset.order_by().query.get_compiler(using).as_sql()
+    return insert_from_sql(model, fields, select, params, ignore, using)
+
+
+def insert_from_sql(model, fields, select, params, ignore=False, using=None):
+    """
+    Insert rows of a raw SELECT into the table of ``model``, see
+    ``insert_select``
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    vendor = connection.vendor
+    qn = connection.ops.quote_name
+    template = 'INSERT INTO %(table)s (%(columns)s) %(select)s'
+    if ignore and vendor == 'postgresql':
+        template += ' ON CONFLICT DO NOTHING'
+    elif ignore and vendor == 'sqlite':
+        template = 'INSERT OR IGNORE' + template[len('INSERT'):]
+    elif ignore and vendor == 'mysql':
+        template = 'INSERT IGNORE' + template[len('INSERT'):]
+    elif ignore:
+        # Rows are loaded and inserted one by one
+        with connection.cursor() as cursor:
+            cursor.execute(select, params)
+            rows = cursor.fetchall()
+        return bulk_insert_ignore(model, [model(**dict(zip((f.attname for f in fields), row))) for row in rows],
+                                  using=using)
+
+    with connection.cursor() as cursor:
+        cursor.execute(template % {
+            'table': qn(model._meta.db_table),
+            'columns': ', '.join(qn(f.column) for f in fields),
+            'select': select,
+        }, params)
+        return max(cursor.rowcount, 0)
+
+
+def _insert_one_by_one(model, objs, using):
+    inserted = 0
+    with transaction.atomic(using=using):
+        for obj in objs:
+            try:
+                with transaction.atomic(using=using):
+                    obj.save(force_insert=True, using=using)
+            except IntegrityError:
+                continue
+            inserted += 1
+    return inserted
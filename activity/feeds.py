@@ -0,0 +1,205 @@
+from activity.aio import AsyncFeedMixin
+from activity.conf import get_setting
+from activity.metrics import get_metrics, timed
+from activity.pagination import PartialRows, decode_cursor, encode_cursor, keyset_filter
+
+
+class QuerySetSource(object):
+    """
+    Feed source reading (created, action id) keys from a queryset.
+
+    The queryset may be a queryset of actions or of any model holding the
+    creation time and id of an action, such as stream rows.
+    """
+    def __init__(self, queryset, created='created', pk='pk'):
+        self.queryset = queryset
+        self.created = created
+        self.pk = pk
+
+    def keys(self, limit=None, before=None, after=None):
+        """
+        Return list of (created, action id) tuples, newest first, or the
+        ones right after ``after`` oldest first
+        """
+        qs = self.queryset
+        order = ('-%s' % self.created, '-%s' % self.pk)
+        if before is not None:
+            qs = qs.filter(keyset_filter(before, 'lt', self.created, self.pk))
+        if after is not None:
+            qs = qs.filter(keyset_filter(after, 'gt', self.created, self.pk))
+            order = (self.created, self.pk)
+        qs = qs.order_by(*order).values_list(self.created, self.pk)
+        if limit is not None:
+            qs = qs[:limit]
+        return list(qs)
+
+
+class BackendSource(object):
+    """
+    Feed source reading keys of the user's stream from a feed backend
+    """
+    def __init__(self, backend, user_id):
+        self.backend = backend
+        self.user_id = user_id
+
+    def keys(self, limit=None, before=None, after=None):
+        return self.backend.range(self.user_id, limit, before, after)
+
+
+class Feed(AsyncFeedMixin):
+    """
+    Lazy feed merging actions from several sources, newest first.
+
+    Every source is asked for at most as many keys as requested, the keys
+    are merged by (created, id) and matching actions are then loaded with
+    a single query. Keys of filtered out actions are made up for by
+    reading further keys. Feeds support slicing, iteration and the same
+    cursor methods as ``ActionQuerySet``; feeds read after a cursor are
+    ordered oldest first.
+
+    Feeds reading archived actions too load the actions missing from
+    ``queryset`` from the ``archive`` queryset.
+    """
+    def __init__(self, queryset, sources, name=None, archive=None):
+        self.queryset = queryset
+        self.sources = list(sources)
+        self.archive = archive
+        # Reported in metrics
+        self.name = name
+        self._before = None
+        self._after = None
+        self._callbacks = []
+
+    def _clone(self):
+        clone = self.__class__(self.queryset, self.sources, self.name, self.archive)
+        clone._before = self._before
+        clone._after = self._after
+        clone._callbacks = list(self._callbacks)
+        return clone
+
+    def before(self, cursor):
+        """
+        Return feed of actions older than the given cursor
+        """
+        decode_cursor(cursor)
+        clone = self._clone()
+        clone._before = cursor
+        return clone
+
+    def after(self, cursor):
+        """
+        Return feed of actions newer than the given cursor, oldest first
+        """
+        decode_cursor(cursor)
+        clone = self._clone()
+        clone._after = cursor
+        return clone
+
+    @property
+    def _ascending(self):
+        return self._after is not None
+
+    def keyset(self, before=None, after=None):
+        """
+        Restrict feed to the given cursors
+        """
+        clone = self._clone()
+        if before is not None:
+            clone = clone.before(before)
+        if after is not None:
+            clone = clone.after(after)
+        return clone
+
+    def with_objects(self):
+        """
+        Load generic relations of the actions in bulk
+        """
+        clone = self._clone()
+        clone.queryset = clone.queryset.with_objects()
+        if clone.archive is not None:
+            clone.archive = clone.archive.with_objects()
+        return clone
+
+    def attach(self, callback):
+        """
+        Return feed calling ``callback`` with every fetched list of actions,
+        e.g. to set extra attributes on them
+        """
+        clone = self._clone()
+        clone._callbacks.append(callback)
+        return clone
+
+    def keys(self, limit=None):
+        """
+        Return merged list of (created, action id) tuples in feed order
+        """
+        return self._keys(limit, self._before, self._after)
+
+    def _keys(self, limit, before, after):
+        return self.merge([source.keys(limit, before, after) for source in self.sources], limit)
+
+    def merge(self, results, limit=None):
+        """
+        Merge key lists read from the sources
+        """
+        keys = set()
+        for result in results:
+            keys.update(result)
+        keys = sorted(keys, reverse=not self._ascending)
+        if limit is not None:
+            keys = keys[:limit]
+        return keys
+
+    def _load(self, ids):
+        if not ids:
+            return []
+        actions = dict((action.pk, action) for action in self.queryset.filter(pk__in=ids))
+        missing = [pk for pk in ids if pk not in actions]
+        if missing and self.archive is not None:
+            actions.update((action.pk, action) for action in self.archive.filter(pk__in=missing))
+        return [actions[pk] for pk in ids if pk in actions]
+
+    def fetch(self, limit=None):
+        """
+        Return list of newest actions in the feed.
+
+        Keys whose actions are filtered out, such as other handlers or
+        private, deleted and archived actions left in a stream, are made up
+        for by reading twice as many keys past them, until ``limit``
+        actions are found or the sources run out. After ``FEED_MAX_REFILLS``
+        such reads the actions found so far are returned as ``PartialRows``
+        with a cursor past the keys read.
+        """
+        tags = {'feed': self.name or 'feed'}
+        with timed('activity.feed', tags, using=self.queryset.db, count_queries=True):
+            actions = []
+            before, after = self._before, self._after
+            batch, cursor = limit, None
+            for refill in range(get_setting('FEED_MAX_REFILLS') + 1):
+                keys = self._keys(batch, before, after)
+                actions.extend(self._load([pk for created, pk in keys]))
+                if limit is None or len(keys) < batch or len(actions) >= limit:
+                    cursor = None
+                    break
+                cursor = encode_cursor(*keys[-1])
+                if self._ascending:
+                    after = cursor
+                else:
+                    before = cursor
+                batch *= 2
+            actions = PartialRows(actions, cursor) if cursor else actions[:limit]
+            for callback in self._callbacks:
+                if actions:
+                    callback(actions)
+        get_metrics().incr('activity.feed.items', len(actions), tags)
+        return actions
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step is not None or (k.start or 0) < 0 or (k.stop is not None and k.stop < 0):
+                raise ValueError('Feeds support only non-negative slicing without step.')
+            return self.fetch(k.stop)[k.start:]
+        return self.fetch(k + 1)[k]
@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from activity.conf import get_setting
+from activity.models import Action
+
+
+class Command(BaseCommand):
+    help = 'Move old actions and their stream rows to the archive tables in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Archive actions older than this, defaults to ACTIVITY_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Actions moved by a single transaction')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Stop after moving this many actions')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches')
+
+    def handle(self, **options):
+        days = options['days']
+        if days is None:
+            days = get_setting('ARCHIVE_AFTER_DAYS')
+        if days is None:
+            raise CommandError('Set ACTIVITY_ARCHIVE_AFTER_DAYS or pass --days.')
+        before = timezone.now() - timedelta(days=days)
+
+        moved = entries = 0
+        limit = options['limit']
+        while limit is None or moved < limit:
+            batch_size = options['batch_size'] if limit is None else min(options['batch_size'], limit - moved)
+            actions, rows = Action.objects.archive(before, batch_size)
+            moved += actions
+            entries += rows
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived %d actions and %d stream entries' % (moved, entries))
+            if actions < batch_size:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write('Archived %d actions and %d stream entries' % (moved, entries))
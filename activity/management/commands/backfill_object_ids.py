@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from django.db.models import Max, Q
+
+from activity.models import Action, integer_id
+
+
+# Expressions converting a numeric string column to an integer, per vendor
+NUMERIC_CAST = {
+    'postgresql': ("CASE WHEN %(column)s ~ '^[0-9]+$' THEN CAST(%(column)s AS bigint) END"),
+    'sqlite': ("CASE WHEN %(column)s <> '' AND %(column)s NOT GLOB '*[^0-9]*' "
+               "THEN CAST(%(column)s AS integer) END"),
+    'mysql': ("CASE WHEN %(column)s REGEXP '^[0-9]+$' THEN CAST(%(column)s AS SIGNED) END"),
+}
+
+
+class Command(BaseCommand):
+    help = 'Fill in integer target and action object IDs of existing actions in bounded ID ranges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Actions updated by a single UPDATE')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--start', type=int, default=0,
+                            help='Continue after this action ID')
+
+    def handle(self, **options):
+        using = router.db_for_write(Action)
+        connection = connections[using]
+        batch_size = options['batch_size']
+        last_id = Action.objects.using(using).aggregate(last_id=Max('pk'))['last_id'] or 0
+
+        updated = 0
+        lower = options['start']
+        while lower < last_id:
+            upper = lower + batch_size
+            if connection.vendor in NUMERIC_CAST:
+                updated += self.update_sql(connection, lower, upper)
+            else:
+                updated += self.update_python(using, lower, upper)
+            if options['verbosity'] > 1:
+                self.stdout.write('Filled in actions up to ID %d, %d updated' % (upper, updated))
+            lower = upper
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write('Updated %d actions' % updated)
+
+    def update_sql(self, connection, lower, upper):
+        qn = connection.ops.quote_name
+        cast = NUMERIC_CAST[connection.vendor]
+        sql = (
+            'UPDATE %(table)s SET %(action_object_int)s = %(action_object_cast)s, '
+            '%(target_int)s = %(target_cast)s '
+            'WHERE %(id)s > %%s AND %(id)s <= %%s'
+        ) % {
+            'table': qn(Action._meta.db_table),
+            'id': qn('id'),
+            'action_object_int': qn('action_object_int_id'),
+            'action_object_cast': cast % {'column': qn('action_object_object_id')},
+            'target_int': qn('target_int_id'),
+            'target_cast': cast % {'column': qn('target_object_id')},
+        }
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [lower, upper])
+                return max(cursor.rowcount, 0)
+
+    def update_python(self, using, lower, upper):
+        queryset = Action.objects.using(using).filter(pk__gt=lower, pk__lte=upper).filter(
+            Q(action_object_object_id__isnull=False) | Q(target_object_id__isnull=False))
+        updated = 0
+        with transaction.atomic(using=using):
+            for pk, action_object_id, target_id in queryset.values_list(
+                    'pk', 'action_object_object_id', 'target_object_id'):
+                updated += Action.objects.using(using).filter(pk=pk).update(
+                    action_object_int_id=integer_id(action_object_id),
+                    target_int_id=integer_id(target_id))
+        return updated
@@ -0,0 +1,175 @@
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, time as day_start
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from activity.registry import activityregistry
+from activity.tasks import iter_user_ids, rebuild_streams
+
+
+def parse_time(value):
+    """
+    Return aware datetime of an ISO 8601 date or time
+    """
+    if value is None:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError('Invalid date or time: %s' % value)
+        parsed = datetime.combine(date, day_start())
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def rebuild_partition(partition):
+    """
+    Rebuild a partition in a pool process. Returns (partition, entries, seconds).
+    """
+    start = time.time()
+    count = rebuild_streams(*partition)
+    return partition, count, time.time() - start
+
+
+class Command(BaseCommand):
+    help = ('Write missing stream entries from actions and follows, partitioned by user ID range. '
+            'Clear streams first to rebuild merged entries of aggregating handlers exactly.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None,
+                            help='Rebuild actions created at or after this ISO 8601 date or time')
+        parser.add_argument('--until', default=None,
+                            help='Rebuild actions created before this ISO 8601 date or time')
+        parser.add_argument('--users', default=None,
+                            help='Comma separated IDs of users to rebuild, all users by default')
+        parser.add_argument('--start', type=int, default=0,
+                            help='Continue after this user ID')
+        parser.add_argument('--partition-size', type=int, default=1000,
+                            help='Users rebuilt by a single worker call')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes rebuilding partitions in parallel')
+        parser.add_argument('--celery', action='store_true',
+                            help='Queue partitions as Celery tasks instead of running them')
+        parser.add_argument('--state', default=None,
+                            help='JSON file recording completed partitions, to resume an interrupted rebuild')
+
+    def handle(self, **options):
+        since = parse_time(options['since'])
+        until = parse_time(options['until'])
+        since = since and since.isoformat()
+        until = until and until.isoformat()
+        params = {
+            'since': since,
+            'until': until,
+            'users': options['users'],
+            'start': options['start'],
+            'partition_size': options['partition_size'],
+        }
+
+        completed = self.load_state(options['state'], params)
+        partitions = [partition + (since, until, False) for partition in self.partitions(options)]
+        if any(handler._overrides('fanout_extra_targets') for handler in activityregistry.get_handlers().values()):
+            # Extra targets aren't found by user, they are written once for all partitions
+            partitions.append((options['start'], None, self.user_ids(options), since, until, True))
+        partitions = [partition for partition in partitions if self.key(partition) not in completed]
+        if not partitions:
+            self.stdout.write('Nothing to rebuild')
+            return
+
+        if options['celery']:
+            for partition in partitions:
+                rebuild_streams.delay(*partition)
+            self.stdout.write('Queued %d partitions' % len(partitions))
+            return
+
+        if options['workers'] > 1:
+            # Pool processes open connections of their own
+            connections.close_all()
+            pool = multiprocessing.Pool(options['workers'])
+            results = pool.imap_unordered(rebuild_partition, partitions)
+        else:
+            pool = None
+            results = (rebuild_partition(partition) for partition in partitions)
+
+        start = time.time()
+        entries = 0
+        try:
+            for partition, count, seconds in results:
+                entries += count
+                completed.add(self.key(partition))
+                self.save_state(options['state'], params, completed)
+                if options['verbosity'] > 1 and partition[5]:
+                    self.stdout.write('Rebuilt extra targets: %d entries in %.1fs' % (count, seconds))
+                elif options['verbosity'] > 1:
+                    self.stdout.write('Rebuilt users (%s, %s]: %d entries in %.1fs' % (
+                        partition[0], partition[1], count, seconds))
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write('Rebuilt %d partitions, %d entries in %.1fs (%.0f entries/s)' % (
+            len(partitions), entries, elapsed, entries / elapsed))
+
+    def partitions(self, options):
+        """
+        Yield (lower, upper, user IDs) of user ID ranges of at most
+        ``partition_size`` users. User IDs are None when not restricted.
+        """
+        size = options['partition_size']
+        user_ids = self.user_ids(options)
+        if user_ids is not None:
+            lower = options['start']
+            for index in range(0, len(user_ids), size):
+                chunk = user_ids[index:index + size]
+                yield lower, chunk[-1], chunk
+                lower = chunk[-1]
+        else:
+            lower = options['start']
+            for user_ids in iter_user_ids(lower, chunk_size=size):
+                yield lower, user_ids[-1], None
+                lower = user_ids[-1]
+
+    def user_ids(self, options):
+        """
+        Return sorted IDs of the users to rebuild after ``start``, or None
+        when all users are rebuilt
+        """
+        if not options['users']:
+            return None
+        user_ids = sorted(set(int(value) for value in options['users'].split(',') if value.strip()))
+        return [user_id for user_id in user_ids if user_id > options['start']]
+
+    def key(self, partition):
+        if partition[5]:
+            return 'extra'
+        return '%s:%s' % partition[:2]
+
+    def load_state(self, path, params):
+        if not path or not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            state = json.load(f)
+        if state['params'] != params:
+            raise CommandError('State file %s belongs to a rebuild with other options.' % path)
+        return set(state['completed'])
+
+    def save_state(self, path, params, completed):
+        if not path:
+            return
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'params': params, 'completed': sorted(completed)}, f)
+        os.rename(path + '.tmp', path)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from activity.conf import get_setting
+from activity.models import Stream
+from activity.tasks import iter_user_ids
+
+
+class Command(BaseCommand):
+    help = 'Trim user streams to the maximum stream length in bounded chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-length', type=int, default=None,
+                            help='Entries kept per user, defaults to ACTIVITY_STREAM_MAX_LENGTH')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Users checked at a time')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows removed by a single DELETE')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between chunks')
+        parser.add_argument('--start', type=int, default=0,
+                            help='Continue after this user ID')
+
+    def handle(self, **options):
+        length = options['max_length']
+        if length is None:
+            length = get_setting('STREAM_MAX_LENGTH')
+        if length is None:
+            raise CommandError('Set ACTIVITY_STREAM_MAX_LENGTH or pass --max-length.')
+
+        removed = 0
+        for user_ids in iter_user_ids(options['start'], chunk_size=options['chunk_size']):
+            removed += Stream.objects.trim(user_ids, length, options['batch_size'])
+            if options['verbosity'] > 1:
+                self.stdout.write('Trimmed streams up to user %d, %d entries removed' % (user_ids[-1], removed))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write('Removed %d stream entries' % removed)
@@ -1,16 +1,274 @@
 from collections import defaultdict
+from functools import partial
+
 from django.apps import apps
 
-from django.db.models import Manager, Q
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import CharField, Count, Exists, F, IntegerField, Manager, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce
 from django.db.models.query import QuerySet
 
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.utils import timezone
 
+from activity.backends import get_backend
+from activity.conf import get_setting
+from activity.db import bulk_insert_ignore, insert_select
+from activity.feeds import BackendSource, Feed, QuerySetSource
+from activity.metrics import get_metrics, timed
+from activity.pagination import keyset_filter
+from activity.registry import activityregistry
+from activity.routers import pin, pin_actors, read_database
 from activity.signals import pre_fanout, post_fanout
 
 
+# (content type attribute, object id attribute, generic foreign key name)
+GENERIC_RELATIONS = (
+    ('actor_content_type_id', 'actor_object_id', 'actor'),
+    ('action_object_content_type_id', 'action_object_object_id', 'action_object'),
+    ('target_content_type_id', 'target_object_id', 'target'),
+)
+
+
+def prefetch_objects(actions):
+    """
+    Load actors, action objects and targets of the given actions with one
+    query per content type and store them into the generic relation caches.
+    """
+    actions = list(actions)
+    if not actions:
+        return actions
+
+    querysets, keys = object_querysets(actions)
+    loaded = {}
+    for content_type_id, queryset in querysets:
+        for obj in queryset:
+            loaded[(content_type_id, obj.pk)] = obj
+    set_objects(actions, keys, loaded)
+    return actions
+
+
+def object_querysets(actions):
+    """
+    Return list of (content type ID, queryset) pairs loading the generic
+    relations of the given actions, and a dictionary mapping their
+    (content type ID, object ID) pairs to primary keys
+    """
+    # Object IDs are stored as strings for action objects and targets, so
+    # convert them to the type of the related primary key before grouping.
+    wanted = defaultdict(set)
+    keys = {}
+    for item in actions:
+        for ct_attr, id_attr, name in GENERIC_RELATIONS:
+            content_type_id = getattr(item, ct_attr)
+            object_id = getattr(item, id_attr)
+            if content_type_id is None or object_id is None:
+                continue
+            if (content_type_id, object_id) not in keys:
+                model = ContentType.objects.get_for_id(content_type_id).model_class()
+                if model is None:
+                    continue
+                try:
+                    keys[(content_type_id, object_id)] = model._meta.pk.to_python(object_id)
+                except ValidationError:
+                    continue
+            wanted[content_type_id].add(keys[(content_type_id, object_id)])
+
+    using = actions[0]._state.db
+    querysets = []
+    for content_type_id, object_ids in wanted.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        querysets.append((content_type_id, model._base_manager.using(using).filter(pk__in=object_ids)))
+    return querysets, keys
+
+
+def set_objects(actions, keys, loaded):
+    """
+    Store objects loaded by ``object_querysets`` into the generic relation
+    caches of the actions
+    """
+    for item in actions:
+        for ct_attr, id_attr, name in GENERIC_RELATIONS:
+            content_type_id = getattr(item, ct_attr)
+            object_id = getattr(item, id_attr)
+            key = keys.get((content_type_id, object_id))
+            obj = loaded.get((content_type_id, key))
+            if obj is not None:
+                _set_cached_object(item, name, obj)
+
+
+def _object_id_lookup(name, pk):
+    """
+    Return filter matching the given object ID of a target or an action
+    object, using the integer column when ``ACTIVITY_INTEGER_OBJECT_IDS`` is on
+    """
+    from activity.models import integer_id
+
+    if get_setting('INTEGER_OBJECT_IDS') and integer_id(pk) is not None:
+        return {'%s_int_id' % name: integer_id(pk)}
+    return {'%s_object_id' % name: pk}
+
+
+def _set_cached_object(instance, name, obj):
+    field = instance._meta.get_field(name)
+    if hasattr(field, 'cache_attr'):
+        setattr(instance, field.cache_attr, obj)
+    else:
+        field.set_cached_value(instance, obj)
+
+
 class ActionQuerySet(QuerySet):
+    _with_objects = False
+    # Ordered oldest first by keyset, see after()
+    _ascending = False
+
+    def _clone(self, *args, **kwargs):
+        clone = super(ActionQuerySet, self)._clone(*args, **kwargs)
+        clone._with_objects = self._with_objects
+        clone._ascending = self._ascending
+        return clone
+
+    def _fetch_all(self):
+        prefetch = self._result_cache is None and self._with_objects
+        super(ActionQuerySet, self)._fetch_all()
+        if prefetch:
+            prefetch_objects(item for item in self._result_cache if isinstance(item, self.model))
+
+    def with_objects(self):
+        """
+        Load actors, action objects and targets in bulk when the queryset is
+        evaluated instead of running one query per generic relation access
+        """
+        clone = self._clone()
+        clone._with_objects = True
+        return clone
+
+    def log_many(self, events, batch_size=500):
+        """
+        Create actions in bulk from ``action`` signal arguments and queue
+        their fan-out in a few tasks. Events with unregistered handlers are
+        skipped. Returns list of created actions.
+
+        Databases which can't return IDs from bulk inserts save actions one
+        by one, but fan-out is still queued in batches.
+        """
+        from activity.bulk import fanout_suppressed
+        from activity.registry import activityregistry
+        from activity.tasks import fanout_actions
+
+        handlers = activityregistry.get_handlers()
+        actions = [self.model.from_event(**event) for event in events
+                   if event.get('handler') in handlers]
+        if not actions:
+            return actions
+
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            if getattr(connection.features, 'can_return_rows_from_bulk_insert', False):
+                actions = self.bulk_create(actions, batch_size=batch_size)
+            else:
+                with fanout_suppressed():
+                    for item in actions:
+                        item.save(using=self.db)
+
+        action_ids = [item.pk for item in actions if item.public and not item.is_global]
+        pin_actors(actions)
+
+        def queue():
+            for start in range(0, len(action_ids), batch_size):
+                fanout_actions.delay(action_ids[start:start + batch_size])
+
+        if hasattr(connection, 'on_commit'):
+            connection.on_commit(queue)
+        else:
+            queue()
+        return actions
+
+    def _keyset_order(self, ascending):
+        clone = self.order_by(*(('created', 'pk') if ascending else ('-created', '-pk')))
+        clone._ascending = ascending
+        return clone
+
+    def before(self, cursor):
+        """
+        Return actions older than the given cursor, newest first
+        """
+        return self.filter(keyset_filter(cursor, 'lt'))._keyset_order(self._ascending)
+
+    def after(self, cursor):
+        """
+        Return actions newer than the given cursor, oldest first, so that
+        a slice holds the actions right after the cursor
+        """
+        return self.filter(keyset_filter(cursor, 'gt'))._keyset_order(True)
+
+    def keyset(self, before=None, after=None):
+        """
+        Order actions newest first, or oldest first after a cursor, and
+        restrict them to the given cursors
+        """
+        qs = self._keyset_order(False)
+        if before is not None:
+            qs = qs.before(before)
+        if after is not None:
+            qs = qs.after(after)
+        return qs
+
+    def replica(self, user=None):
+        """
+        Read from a database chosen by ``read_database`` for the given user,
+        unless a database was chosen already
+        """
+        if self._db is not None:
+            return self
+        return self.using(read_database(user))
+
+    def with_archive(self, **kwargs):
+        """
+        Return ``Feed`` of actions matching the given filters in both the
+        action table and the archive, newest first. Filters applied to this
+        queryset before are not used for the archive.
+        """
+        archive = apps.get_model('activity', 'ArchivedAction').objects.using(self.db).filter(**kwargs)
+        queryset = self.filter(**kwargs)
+        return Feed(queryset, [QuerySetSource(queryset), QuerySetSource(archive)], archive=archive)
+
+    def archive(self, before, batch_size=500):
+        """
+        Move at most ``batch_size`` of the oldest actions created before the
+        given time, with their stream rows, to the archive tables in one
+        transaction. Rows are copied with INSERT ... SELECT and removed
+        without loading them. Returns (actions, stream rows) moved.
+
+        Only stream rows of the Stream table are archived; other feed
+        backends keep streams short with trimming instead.
+        """
+        ArchivedAction = apps.get_model('activity', 'ArchivedAction')
+        ArchivedStream = apps.get_model('activity', 'ArchivedStream')
+        Stream = apps.get_model('activity', 'Stream')
+        FanoutCheckpoint = apps.get_model('activity', 'FanoutCheckpoint')
+        using = self._db or router.db_for_write(self.model)
+
+        with transaction.atomic(using=using):
+            ids = list(self.using(using).filter(created__lt=before).order_by('created', 'pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return 0, 0
+
+            fields = ArchivedAction._meta.concrete_fields
+            insert_select(ArchivedAction, fields, self.model.objects.using(using).filter(pk__in=ids)
+                          .values_list(*[f.attname for f in fields]))
+            fields = [f for f in ArchivedStream._meta.concrete_fields if not f.primary_key]
+            entries = insert_select(ArchivedStream, fields, Stream.objects.using(using).filter(action__in=ids)
+                                    .values_list(*[f.attname for f in fields]))
+
+            for queryset in (Stream.objects.filter(action__in=ids), FanoutCheckpoint.objects.filter(action__in=ids),
+                             self.model.objects.filter(pk__in=ids)):
+                queryset._raw_delete(using)
+        return len(ids), entries
+
     def public(self, *args, **kwargs):
         """
         Return list of public actions
@@ -40,8 +298,7 @@ class ActionQuerySet(QuerySet):
         """
         content_type = ContentType.objects.get_for_model(obj).pk
         return self.filter(target_content_type=content_type,
-                           target_object_id=obj.pk,
-                           **kwargs)
+                           **dict(_object_id_lookup('target', obj.pk), **kwargs))
 
     def action_object(self, obj, **kwargs):
         """
@@ -49,65 +306,318 @@ class ActionQuerySet(QuerySet):
         """
         content_type = ContentType.objects.get_for_model(obj).pk
         return self.filter(action_object_content_type=content_type,
-                           action_object_object_id=obj.pk,
-                           **kwargs)
+                           **dict(_object_id_lookup('action_object', obj.pk), **kwargs))
 
     def user(self, user, **kwargs):
         """
         Return list of most recent actions by objects that the given user is following
+
+        Followed objects are matched with subqueries on Follow, so nothing
+        is read before the queryset is evaluated. Paged reads are faster
+        with ``user_feed``.
         """
-        # Base filter
-        q = Q()
-        # Base QueryString
-        qs = self.public()
-
-        actors_by_content_type = defaultdict(lambda: [])
-        others_by_content_type = defaultdict(lambda: [])
-
-        following = apps.get_model('activity', 'Follow').objects.filter(user=user).values_list('content_type_id', 'object_id', 'actor_only')
-        if not following:
-            return qs.none()
-
-        for content_type_id, object_id, actor_only in following.iterator():
-            actors_by_content_type[content_type_id].append(object_id)
-            if not actor_only:
-                others_by_content_type[content_type_id].append(object_id)
-
-        for content_type_id, object_ids in actors_by_content_type.iteritems():
-            q |= Q(actor_content_type=content_type_id, actor_object_id__in=object_ids)
-
-        for content_type_id, object_ids in others_by_content_type.iteritems():
-            q = q | Q(
-                target_content_type=content_type_id,
-                target_object_id__in=object_ids,
-            ) | Q(
-                action_object_content_type=content_type_id,
-                action_object_object_id__in=object_ids,
-            )
+        follows = apps.get_model('activity', 'Follow').objects.filter(user=user)
+        q = Q(Exists(follows.filter(content_type=OuterRef('actor_content_type'),
+                                    object_id=OuterRef('actor_object_id'))))
+        object_follows = follows.filter(actor_only=False)
+        for name in ('target', 'action_object'):
+            if get_setting('INTEGER_OBJECT_IDS'):
+                matching = object_follows.filter(object_id=OuterRef('%s_int_id' % name))
+            else:
+                # Targets and action objects store IDs as strings
+                matching = object_follows.annotate(object_key=Cast('object_id', CharField(max_length=255))).filter(
+                    object_key=OuterRef('%s_object_id' % name))
+            q |= Q(Exists(matching.filter(content_type=OuterRef('%s_content_type' % name))))
+        return self.replica(user).public(q, **kwargs)
 
-        return qs.filter(q, **kwargs)
+    def user_feed(self, user, before=None, after=None, archived=False, **kwargs):
+        """
+        Return ``Feed`` of most recent actions by objects that the given
+        user is following, read a page at a time.
+
+        Every followed content type gives a branch for actors, and for
+        targets and action objects when not following actors only. Each
+        branch matches followed objects with a subquery on Follow instead of
+        a list of IDs and reads only one page, and the branches are merged
+        by (created, id). The feed is read from a replica unless the user
+        wrote recently. With ``archived`` the branches read archived
+        actions too.
+        """
+        qs = self.replica(user).public(**kwargs)
+        follows = apps.get_model('activity', 'Follow').objects.using(qs.db).filter(user=user)
+
+        branches = defaultdict(set)
+        for content_type_id, actor_only in follows.order_by().values_list(
+                'content_type', 'actor_only').distinct():
+            branches[content_type_id].add(actor_only)
+
+        lookups = []
+        for content_type_id, actor_only in branches.items():
+            object_ids = follows.filter(content_type=content_type_id).values('object_id')
+            lookups.append({'actor_content_type': content_type_id, 'actor_object_id__in': object_ids})
+            if False not in actor_only:
+                continue
+            object_follows = follows.filter(content_type=content_type_id, actor_only=False)
+            if get_setting('INTEGER_OBJECT_IDS'):
+                object_keys = object_follows.values('object_id')
+                suffix = 'int_id'
+            else:
+                # Targets and action objects store IDs as strings
+                object_keys = object_follows.annotate(
+                    object_key=Cast('object_id', CharField(max_length=255))).values('object_key')
+                suffix = 'object_id'
+            for name in ('target', 'action_object'):
+                lookups.append({
+                    '%s_content_type' % name: content_type_id,
+                    '%s_%s__in' % (name, suffix): object_keys,
+                })
+
+        archive = None
+        querysets = [qs]
+        if archived:
+            archive = apps.get_model('activity', 'ArchivedAction').objects.using(qs.db).public(**kwargs)
+            querysets.append(archive)
+        sources = [QuerySetSource(queryset.filter(**lookup)) for queryset in querysets for lookup in lookups]
+        return Feed(qs, sources, name='user', archive=archive).keyset(before, after)
+
+    def pulled(self, user):
+        """
+        Return public actions which were not fanned out because their actor
+        has too many followers, limited to actors the given user follows.
+        """
+        follows = apps.get_model('activity', 'Follow').objects.using(self.db).filter(user=user, actor_only=True)
+        q = Q()
+        for content_type_id in follows.order_by().values_list('content_type', flat=True).distinct():
+            q |= Q(actor_content_type=content_type_id,
+                   actor_object_id__in=follows.filter(content_type=content_type_id).values('object_id'))
+        if not q:
+            return self.none()
+        return self.public().filter(q, is_pulled=True)
 
     def stream(self, user, **kwargs):
         """
         Return list of actions based on user specific stream.
+
+        Matches actions of the user's entries in the Stream table, global
+        actions, and actions by followed actors with too many followers to
+        fan out. Paged reads, other feed backends and merged entries of
+        aggregating handlers need ``stream_feed``.
+        """
+        Follow = apps.get_model('activity', 'Follow')
+        Stream = apps.get_model('activity', 'Stream')
+        q = Q(pk__in=Stream.objects.filter(user=user).values('action')) | Q(is_global=True)
+        if get_setting('FANOUT_FOLLOWER_THRESHOLD') is not None:
+            q |= Q(Exists(Follow.objects.filter(
+                user=user, actor_only=True, content_type=OuterRef('actor_content_type'),
+                object_id=OuterRef('actor_object_id'))), is_pulled=True)
+        return self.replica(user).public(q, **kwargs)
+
+    def stream_feed(self, user, before=None, after=None, archived=False, **kwargs):
+        """
+        Return ``Feed`` of actions based on user specific stream.
+
+        The user's newest stream entries are read from the feed backend before
+        any actions are fetched. Global actions, and actions by actors with
+        too many followers to fan out, are merged in at read time. Keyword
+        arguments filter the merged actions, and the actions of stream
+        entries once loaded. The feed is read from a
+        replica unless the user wrote recently. With ``archived`` archived
+        stream entries and global actions are merged in too.
         """
-        qs = self.public()
-        return qs.filter(stream__user=user)
+        qs = self.replica(user)
+        backend = get_backend()
+        sources = [
+            BackendSource(backend.reading(qs.db), user.pk),
+            QuerySetSource(qs.public(is_global=True, **kwargs)),
+        ]
+        if get_setting('FANOUT_FOLLOWER_THRESHOLD') is not None:
+            sources.append(QuerySetSource(qs.pulled(user).filter(**kwargs)))
+        archive = None
+        if archived:
+            archive = apps.get_model('activity', 'ArchivedAction').objects.using(qs.db)
+            entries = apps.get_model('activity', 'ArchivedStream').objects.using(qs.db)
+            sources.append(QuerySetSource(entries.filter(user=user, public=True), 'created', 'action_id'))
+            sources.append(QuerySetSource(archive.public(is_global=True, **kwargs)))
+            archive = archive.public(**kwargs)
+        feed = Feed(qs.public(**kwargs), sources, name='stream', archive=archive).keyset(before, after)
+        if hasattr(backend, 'attach_aggregates'):
+            feed = feed.attach(partial(backend.attach_aggregates, user.pk))
+        return feed
 
 
 class StreamManager(Manager):
     def fanout(self, action, user_ids, batch_size=500):
         """
         Fan-out action to other streams based on user list.
+        Returns number of stream rows written.
         """
         if action.public:
             pre_fanout.send(sender=self.__class__, action=action)
-            streams = (self.model(user_id=user_id, action=action) for user_id in user_ids)
-            objs = self.bulk_create(streams, batch_size=batch_size)
+            objs = self.fanout_chunk(action, user_ids, batch_size)
             post_fanout.send(sender=self.__class__, action=action)
             return objs
         raise PermissionDenied('This action item is marked as private. Fan-out operation forbidden.')
 
+    def fanout_chunk(self, action, user_ids, batch_size=500, unread=True):
+        """
+        Write stream rows for the given users without sending fan-out signals.
+        Chunked fan-out sends the signals once for the whole job.
+
+        Entries are written to the configured feed backend. Existing ones are
+        skipped, so retried and duplicated fan-out tasks are safe. Actions of
+        aggregating handlers are merged into similar entries when the backend
+        supports it. Unread counters are incremented unless ``unread`` is
+        False. Returns number of entries written or merged.
+        """
+        if action.public:
+            backend = get_backend()
+            handler = activityregistry.get_handlers().get(action.handler)
+            user_ids = list(user_ids)
+            tags = {'handler': action.handler}
+            with timed('activity.fanout', tags, using=self.db, count_queries=True):
+                if getattr(handler, 'aggregate_window', None) is not None and hasattr(backend, 'aggregate'):
+                    added = backend.aggregate(action, user_ids, handler.aggregate_key(action),
+                                              handler.aggregate_window, handler.aggregate_sample_size,
+                                              batch_size=batch_size)
+                else:
+                    added = backend.insert(action, user_ids, batch_size=batch_size)
+                if unread:
+                    StreamState = apps.get_model('activity', 'StreamState')
+                    StreamState.objects.db_manager(self.db).increment(added, batch_size)
+            metrics = get_metrics()
+            metrics.incr('activity.fanout.rows', len(added), tags)
+            metrics.incr('activity.fanout.batches', -(-len(user_ids) // batch_size), tags)
+            return len(added)
+        raise PermissionDenied('This action item is marked as private. Fan-out operation forbidden.')
+
+    def rebuild(self, lower=None, upper=None, user_ids=None, since=None, until=None, batch_size=500,
+                extra_targets=False):
+        """
+        Write missing stream entries of users in the ID range (lower, upper],
+        or of the given users, for actions created in [since, until).
+
+        Entries of followed actors are computed with set-based SQL when the
+        feed backend supports it. Actions of aggregating handlers, and all
+        actions on other backends, are fanned out an action at a time, only
+        when an actor is followed by a user in range, with one follower
+        query per actor. With ``extra_targets`` only extra targets of
+        handlers are written instead, so a rebuild partitioned by user
+        computes them once rather than per partition. Existing entries are
+        kept and unread counters are not touched. Returns number of entries
+        written.
+        """
+        from activity.tasks import fanout_recipients
+
+        Action = apps.get_model('activity', 'Action')
+        Follow = apps.get_model('activity', 'Follow')
+        backend = get_backend()
+        handlers = activityregistry.get_handlers()
+        if user_ids is not None:
+            user_ids = set(user_ids)
+
+        actions = Action.objects.public(is_global=False)
+        if since is not None:
+            actions = actions.filter(created__gte=since)
+        if until is not None:
+            actions = actions.filter(created__lt=until)
+
+        written = 0
+        if extra_targets:
+            extra = [handler_id for handler_id, handler in handlers.items()
+                     if handler._overrides('fanout_extra_targets')]
+            for action in actions.filter(handler__in=extra).order_by('created', 'pk').iterator():
+                targets = set(user_id for user_id in handlers[action.handler].fanout_extra_targets(action)
+                              if (user_ids is None or user_id in user_ids) and
+                              (lower is None or user_id > lower) and (upper is None or user_id <= upper))
+                if targets:
+                    written += self.fanout_chunk(action, sorted(targets), batch_size, unread=False)
+            return written
+
+        one_by_one = actions.filter(is_pulled=False)
+        if hasattr(backend, 'rebuild'):
+            aggregating = [handler_id for handler_id, handler in handlers.items()
+                           if getattr(handler, 'aggregate_window', None) is not None]
+            written += backend.rebuild(lower, upper, user_ids, since, until, exclude_handlers=aggregating)
+            one_by_one = one_by_one.filter(handler__in=aggregating)
+
+        follows = Follow.objects.filter(content_type=OuterRef('actor_content_type'),
+                                        object_id=OuterRef('actor_object_id'), actor_only=True)
+        if lower is not None:
+            follows = follows.filter(user__gt=lower)
+        if upper is not None:
+            follows = follows.filter(user__lte=upper)
+        if user_ids is not None:
+            follows = follows.filter(user__in=user_ids)
+
+        recipients = {}
+        # Oldest first, so aggregating handlers merge entries as fan-out did
+        for action in one_by_one.filter(Exists(follows)).order_by('created', 'pk').iterator():
+            actor = (action.actor_content_type_id, action.actor_object_id)
+            if actor not in recipients:
+                recipients[actor] = list(fanout_recipients(action, lower, upper, user_ids))
+            written += self.fanout_chunk(action, recipients[actor], batch_size, unread=False)
+        return written
+
+    def unread_count(self, user):
+        """
+        Return number of stream entries added since the user last read the
+        stream. Fanned out entries are counted by a counter; global actions
+        and actions merged at read time are counted from the indexes.
+        """
+        StreamState = apps.get_model('activity', 'StreamState')
+        Action = apps.get_model('activity', 'Action')
+        state = StreamState.objects.db_manager(self.db).filter(user=user).values_list('unread', 'last_seen')
+        unread, last_seen = state[0] if state else (0, None)
+
+        merged = [Action.objects.public(is_global=True)]
+        if get_setting('FANOUT_FOLLOWER_THRESHOLD') is not None:
+            merged.append(Action.objects.pulled(user))
+        for queryset in merged:
+            if last_seen is not None:
+                queryset = queryset.filter(created__gt=last_seen)
+            unread += queryset.count()
+        return unread
+
+    def mark_seen(self, user, when=None):
+        """
+        Reset the user's unread counter
+        """
+        StreamState = apps.get_model('activity', 'StreamState')
+        values = {'unread': 0, 'last_seen': when or timezone.now()}
+        manager = StreamState.objects.db_manager(self.db)
+        if not manager.filter(user=user).update(**values):
+            bulk_insert_ignore(StreamState, [StreamState(user=user, **values)], using=self.db)
+
+    def trim(self, user_ids, length, batch_size=1000):
+        """
+        Trim streams of the given users longer than ``length`` entries.
+        Returns number of entries removed.
+        """
+        backend = get_backend()
+        removed = 0
+        for user_id, count in backend.lengths(user_ids).items():
+            if count > length:
+                removed += backend.trim(user_id, length, batch_size)
+        return removed
+
+
+class StreamStateManager(Manager):
+    """
+    Manager for StreamState model
+    """
+    def increment(self, user_ids, batch_size=500):
+        """
+        Add one to unread counters of the given users. Every batch takes an
+        insert of missing rows and an UPDATE, which is atomic per row, so
+        concurrent fan-out chunks don't lose counts.
+        """
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            bulk_insert_ignore(self.model, [self.model(user_id=user_id) for user_id in batch],
+                               batch_size=batch_size, using=self.db)
+            self.filter(user__in=batch).update(unread=F('unread') + 1)
+
 
 class FollowManager(Manager):
     """
@@ -120,32 +630,226 @@ class FollowManager(Manager):
         content_type = ContentType.objects.get_for_model(target).pk
         return self.filter(content_type=content_type, object_id=target.pk)
 
+    def follow(self, user, obj, actor_only=True):
+        """
+        Follow the given object. Recent actions of a followed actor are
+        copied to the user's stream in the background. Returns Follow.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        follow, created = self.get_or_create(user=user, content_type=content_type, object_id=obj.pk,
+                                             defaults={'actor_only': actor_only})
+        self._memo(user)[(content_type.pk, obj.pk)] = True
+        return follow
+
+    def unfollow(self, user, obj):
+        """
+        Stop following the given object. Its actions are removed from the
+        user's stream in the background. Returns number of removed follows.
+        """
+        self._memo(user)[(ContentType.objects.get_for_model(obj).pk, obj.pk)] = False
+        return self.for_object(obj).filter(user=user).delete()[0]
+
+    def follow_many(self, user, targets, actor_only=True):
+        """
+        Follow several objects with conflict-ignoring bulk inserts and queue
+        a single backfill task. Returns number of new follows.
+        """
+        from activity.tasks import backfill_stream
+
+        follows = [self.model(user=user, content_type=ContentType.objects.get_for_model(target),
+                              object_id=target.pk, actor_only=actor_only)
+                   for target in targets]
+        created = bulk_insert_ignore(self.model, follows, using=self.db)
+        actors = [(follow.content_type_id, follow.object_id) for follow in follows]
+        if created:
+            self._recount(user, actors)
+            pin(user.pk)
+        self._memo(user).update((actor, True) for actor in actors)
+        if actors and actor_only and get_setting('BACKFILL_LIMIT'):
+            transaction.on_commit(lambda: backfill_stream.delay(user.pk, actors), using=self.db)
+        return created
+
+    def unfollow_many(self, user, targets):
+        """
+        Stop following several objects with a single DELETE and queue a
+        single purge task for the actor-only follows, like ``unfollow``.
+        Returns number of removed follows.
+        """
+        from activity.tasks import purge_stream
+
+        actors = [(ContentType.objects.get_for_model(target).pk, target.pk) for target in targets]
+        q = Q()
+        for content_type_id, object_ids in self._group(actors).items():
+            q |= Q(content_type=content_type_id, object_id__in=object_ids)
+        if not q:
+            return 0
+        queryset = self.filter(q, user=user)
+        purged = list(queryset.filter(actor_only=True).values_list('content_type', 'object_id'))
+        deleted = queryset._raw_delete(queryset.db)
+        if deleted:
+            self._recount(user, actors)
+            pin(user.pk)
+        self._memo(user).update((actor, False) for actor in actors)
+        if purged:
+            transaction.on_commit(lambda: purge_stream.delay(user.pk, purged), using=self.db)
+        return deleted
+
     def is_following(self, user, target):
         """
         Is user following the target?
         """
-        if not user or user.is_anonymous():
+        if not user or user.is_anonymous:
             return False
-        queryset = self.for_object(target)
-        return queryset.filter(user=user).exists()
+        return self.is_following_many(user, [target])[target]
 
-    def followers(self, actor):
+    def is_following_many(self, user, targets):
         """
-        Return list of users who are following the given actor
+        Return dictionary telling whether the user is following each of the
+        given targets, with one query per content type. Answers are kept on
+        the user object, so repeated checks within a request are free.
+        Missing answers are read from a replica unless the user wrote
+        recently.
         """
-        return [follow.user for follow in self.filter(
+        targets = list(targets)
+        if not user or user.is_anonymous:
+            return dict((target, False) for target in targets)
+
+        memo = self._memo(user)
+        keys = dict((target, (ContentType.objects.get_for_model(target).pk, target.pk)) for target in targets)
+        missing = self._group(key for key in keys.values() if key not in memo)
+        queryset = self.using(read_database(user)).filter(user=user) if missing else None
+        for content_type_id, object_ids in missing.items():
+            followed = set(queryset.filter(content_type=content_type_id, object_id__in=object_ids)
+                           .values_list('object_id', flat=True))
+            memo.update(((content_type_id, object_id), object_id in followed) for object_id in object_ids)
+        return dict((target, memo[key]) for target, key in keys.items())
+
+    def _recount(self, user, actors):
+        FollowCount = apps.get_model('activity', 'FollowCount')
+        user_type = ContentType.objects.get_for_model(user).pk
+        FollowCount.objects.db_manager(self.db).recount(actors + [(user_type, user.pk)])
+
+    def _memo(self, user):
+        if not hasattr(user, '_activity_following'):
+            user._activity_following = {}
+        return user._activity_following
+
+    def _group(self, keys):
+        grouped = defaultdict(set)
+        for content_type_id, object_id in keys:
+            grouped[content_type_id].add(object_id)
+        return grouped
+
+    def followers(self, actor, reader=None):
+        """
+        Return list of users who are following the given actor, read from a
+        replica. Pass the reading user to see their own recent follows.
+        """
+        return [follow.user for follow in self.using(read_database(reader)).filter(
                 content_type=ContentType.objects.get_for_model(actor),
                 object_id=actor.pk).select_related('user')]
 
     def following(self, user, *models):
         """
-        Return list of actors that the given user is following.
+        Return list of actors that the given user is following, read from a
+        replica unless the user wrote recently.
         You may restrict the search by giving list of models.
         e.g. following(user, User) returns list of users the user is following
         """
-        queryset = self.filter(user=user)
+        queryset = self.using(read_database(user)).filter(user=user)
         if len(models):
             queryset = queryset.filter(content_type__in=(
                 ContentType.objects.get_for_model(model) for model in models)
             )
         return [follow.follow_object for follow in queryset.prefetch_related()]
+
+    def follower_ids(self, actor, chunk_size=2000):
+        """
+        Yield IDs of users following the given actor in user ID order. IDs
+        are read by keyset in chunks, so memory use does not grow with the
+        number of followers.
+        """
+        queryset = self.for_object(actor).order_by('user')
+        lower = 0
+        while True:
+            user_ids = list(queryset.filter(user__gt=lower).values_list('user', flat=True)[:chunk_size])
+            for user_id in user_ids:
+                yield user_id
+            if len(user_ids) < chunk_size:
+                return
+            lower = user_ids[-1]
+
+    def following_ids(self, user, chunk_size=2000):
+        """
+        Yield (content type ID, object ID) pairs of objects the given user is
+        following, read in chunks like ``follower_ids``
+        """
+        queryset = self.filter(user=user).order_by('pk')
+        lower = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=lower).values_list('pk', 'content_type', 'object_id')[:chunk_size])
+            for pk, content_type_id, object_id in rows:
+                yield content_type_id, object_id
+            if len(rows) < chunk_size:
+                return
+            lower = rows[-1][0]
+
+
+class FollowCountManager(Manager):
+    """
+    Manager for FollowCount model
+    """
+    def for_object(self, obj):
+        """
+        Return counters of the given object, unsaved and zeroed if missing
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        try:
+            return self.get(content_type=content_type, object_id=obj.pk)
+        except self.model.DoesNotExist:
+            return self.model(content_type=content_type, object_id=obj.pk)
+
+    def change(self, follow, delta):
+        """
+        Add ``delta`` to the follower counter of the followed object and to
+        the following counter of the user
+        """
+        user_key = (self._user_type(), follow.user_id)
+        object_key = (follow.content_type_id, follow.object_id)
+        self._create(set([user_key, object_key]))
+        self.filter(content_type=object_key[0], object_id=object_key[1]).update(followers=F('followers') + delta)
+        self.filter(content_type=user_key[0], object_id=user_key[1]).update(following=F('following') + delta)
+
+    def recount(self, keys):
+        """
+        Recompute counters of the given (content type ID, object ID) pairs
+        with one UPDATE per content type. Used by bulk operations, which
+        can't tell which rows they changed.
+        """
+        Follow = apps.get_model('activity', 'Follow')
+        keys = set(keys)
+        self._create(keys)
+
+        user_type = self._user_type()
+        followers = Follow.objects.filter(
+            content_type=OuterRef('content_type'), object_id=OuterRef('object_id'),
+        ).order_by().values('content_type').annotate(count=Count('pk')).values('count')
+        following = Follow.objects.filter(
+            user=OuterRef('object_id'),
+        ).order_by().values('user').annotate(count=Count('pk')).values('count')
+
+        grouped = defaultdict(set)
+        for content_type_id, object_id in keys:
+            grouped[content_type_id].add(object_id)
+        for content_type_id, object_ids in grouped.items():
+            values = {'followers': Coalesce(Subquery(followers, output_field=IntegerField()), 0)}
+            if content_type_id == user_type:
+                values['following'] = Coalesce(Subquery(following, output_field=IntegerField()), 0)
+            self.filter(content_type=content_type_id, object_id__in=object_ids).update(**values)
+
+    def _create(self, keys):
+        bulk_insert_ignore(self.model, [self.model(content_type_id=content_type_id, object_id=object_id)
+                                        for content_type_id, object_id in keys], using=self.db)
+
+    def _user_type(self):
+        return ContentType.objects.get_for_model(apps.get_model(settings.AUTH_USER_MODEL)).pk
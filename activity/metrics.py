@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from activity.conf import get_setting
+
+
+class Metrics(object):
+    """
+    Sink of activity metrics. The default sink drops everything, subclass
+    it to forward metrics to StatsD, Prometheus or similar and point
+    ``ACTIVITY_METRICS_BACKEND`` to the subclass.
+
+    Names are dotted strings such as ``activity.fanout.rows`` and tags are
+    dictionaries such as ``{'handler': 'comment'}``.
+    """
+    # Measuring is skipped entirely when False
+    enabled = False
+
+    def timing(self, name, value, tags=None):
+        """
+        Record duration in milliseconds
+        """
+
+    def incr(self, name, value=1, tags=None):
+        """
+        Add value to a counter
+        """
+
+
+class MemoryMetrics(Metrics):
+    """
+    Keep metrics in memory, for tests and local profiling
+    """
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(list)
+            self.counters = defaultdict(int)
+
+    def key(self, name, tags):
+        return (name, tuple(sorted((tags or {}).items())))
+
+    def timing(self, name, value, tags=None):
+        with self.lock:
+            self.timings[self.key(name, tags)].append(value)
+
+    def incr(self, name, value=1, tags=None):
+        with self.lock:
+            self.counters[self.key(name, tags)] += value
+
+    def count(self, name, **tags):
+        """
+        Return value of a counter summed over tags not given
+        """
+        return sum(value for (key, key_tags), value in self.counters.items()
+                   if key == name and set(tags.items()) <= set(key_tags))
+
+    def durations(self, name, **tags):
+        """
+        Return durations recorded with the given tags and any others
+        """
+        return [value for (key, key_tags), values in self.timings.items()
+                if key == name and set(tags.items()) <= set(key_tags) for value in values]
+
+
+_metrics = {}
+
+
+def get_metrics():
+    """
+    Return instance of the sink configured by ``ACTIVITY_METRICS_BACKEND``
+    """
+    path = get_setting('METRICS_BACKEND')
+    if path not in _metrics:
+        _metrics[path] = import_string(path)(**get_setting('METRICS_OPTIONS'))
+    return _metrics[path]
+
+
+@receiver(setting_changed)
+def reset_metrics(sender, setting, **kwargs):
+    if setting in ('ACTIVITY_METRICS_BACKEND', 'ACTIVITY_METRICS_OPTIONS'):
+        _metrics.clear()
+
+
+class QueryCounter(object):
+    """
+    Count queries run on a connection with ``execute_wrapper``, on Django
+    versions which have it. ``count`` stays None elsewhere.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def timed(name, tags=None, using=None, count_queries=False):
+    """
+    Report duration of the block in milliseconds as ``<name>.duration``
+    and, if asked, its number of queries as ``<name>.queries``
+    """
+    metrics = get_metrics()
+    if not metrics.enabled:
+        yield
+        return
+
+    counter = None
+    if count_queries:
+        connection = connections[using or 'default']
+        if hasattr(connection, 'execute_wrapper'):
+            counter = QueryCounter()
+    start = time.time()
+    if counter is not None:
+        with connection.execute_wrapper(counter):
+            yield
+    else:
+        yield
+    metrics.timing('%s.duration' % name, (time.time() - start) * 1000, tags)
+    if counter is not None:
+        metrics.incr('%s.queries' % name, counter.count, tags)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import activity.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    # Fresh databases get named indexes without index_together, which
+    # Django 5.1 no longer creates
+    replaces = [
+        ('activity', '0001_initial'),
+        ('activity', '0002_auto_20170504_1348'),
+        ('activity', '0003_action_created_id_index'),
+        ('activity', '0004_stream_denormalized_fields'),
+        ('activity', '0005_follow_object_user_index'),
+        ('activity', '0006_fanoutcheckpoint'),
+        ('activity', '0007_action_is_pulled'),
+        ('activity', '0008_action_global_index'),
+        ('activity', '0009_action_object_indexes'),
+        ('activity', '0010_followcount'),
+        ('activity', '0011_streamstate'),
+        ('activity', '0012_stream_aggregation'),
+        ('activity', '0013_archive'),
+        ('activity', '0014_stream_action_detach'),
+        ('activity', '0015_named_indexes'),
+    ]
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Action',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handler', models.CharField(max_length=255)),
+                ('actor_object_id', models.PositiveIntegerField()),
+                ('action_object_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('action_object_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('target_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('target_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('public', models.BooleanField(default=True)),
+                ('is_global', models.BooleanField(default=False)),
+                ('is_pulled', models.BooleanField(default=False)),
+                ('action_object_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='action_object', to='contenttypes.contenttype')),
+                ('actor_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actor', to='contenttypes.contenttype')),
+                ('target_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='target', to='contenttypes.contenttype')),
+            ],
+            options={
+                'ordering': ('-created',),
+                'indexes': [models.Index(fields=['created', 'id'], name='activity_action_created_id'), models.Index(fields=['is_pulled', 'created'], name='activity_action_pulled'), models.Index(fields=['is_global', 'created'], name='activity_action_global'), models.Index(fields=['actor_content_type', 'actor_object_id', 'created'], name='activity_action_actor'), models.Index(fields=['action_object_content_type', 'action_object_object_id', 'created'], name='activity_action_object'), models.Index(fields=['target_content_type', 'target_object_id', 'created'], name='activity_action_target'), models.Index(fields=['action_object_content_type', 'action_object_int_id', 'created'], name='activity_action_object_int'), models.Index(fields=['target_content_type', 'target_int_id', 'created'], name='activity_action_target_int')],
+            },
+            bases=(activity.models.ActionMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='ArchivedAction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('handler', models.CharField(max_length=255)),
+                ('actor_object_id', models.PositiveIntegerField()),
+                ('action_object_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('action_object_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('target_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('target_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField()),
+                ('public', models.BooleanField(default=True)),
+                ('is_global', models.BooleanField(default=False)),
+                ('is_pulled', models.BooleanField(default=False)),
+                ('action_object_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+                ('actor_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+                ('target_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'ordering': ('-created',),
+                'indexes': [models.Index(fields=['created', 'id'], name='activity_archived_created_id'), models.Index(fields=['actor_content_type', 'actor_object_id', 'created'], name='activity_archived_actor'), models.Index(fields=['action_object_content_type', 'action_object_object_id', 'created'], name='activity_archived_object'), models.Index(fields=['target_content_type', 'target_object_id', 'created'], name='activity_archived_target'), models.Index(fields=['action_object_content_type', 'action_object_int_id', 'created'], name='activity_archived_object_int'), models.Index(fields=['target_content_type', 'target_int_id', 'created'], name='activity_archived_target_int')],
+            },
+            bases=(activity.models.ActionMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='StreamState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('unread', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Stream',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('public', models.BooleanField(default=True)),
+                ('handler', models.CharField(max_length=255)),
+                ('group_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('group_size', models.IntegerField(default=1)),
+                ('group_sample', models.CharField(blank=True, default='', max_length=255)),
+                ('action', models.ForeignKey(on_delete=activity.models.detach_or_cascade, to='activity.action')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created', 'action'], name='activity_stream_user_created'), models.Index(fields=['user', 'group_key', 'created'], name='activity_stream_user_group')],
+                'unique_together': {('user', 'action')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FollowCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('followers', models.IntegerField(default=0)),
+                ('following', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('actor_only', models.BooleanField(default=True, verbose_name='Only follow actions where the object is the actor')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_type', 'object_id', 'user'], name='activity_follow_object_user')],
+                'unique_together': {('user', 'content_type', 'object_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FanoutCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lower', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('completed', models.BooleanField(default=False)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='activity.action')),
+            ],
+            options={
+                'unique_together': {('action', 'lower')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedStream',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('public', models.BooleanField(default=True)),
+                ('handler', models.CharField(max_length=255)),
+                ('group_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('group_size', models.IntegerField(default=1)),
+                ('group_sample', models.CharField(blank=True, default='', max_length=255)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='activity.archivedaction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created', 'action'], name='activity_archived_stream_user')],
+                'unique_together': {('user', 'action')},
+            },
+        ),
+    ]
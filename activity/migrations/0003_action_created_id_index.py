@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0002_auto_20170504_1348'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([('created', 'id')]),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+BATCH_SIZE = 10000
+
+
+def backfill_streams(apps, schema_editor):
+    """
+    Copy creation time, public flag and handler from actions to existing
+    stream rows in bounded id ranges.
+    """
+    Stream = apps.get_model('activity', 'Stream')
+    Action = apps.get_model('activity', 'Action')
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+
+    last = Stream.objects.using(connection.alias).order_by('-pk').values_list('pk', flat=True).first()
+    if last is None:
+        return
+
+    stream, action = qn(Stream._meta.db_table), qn(Action._meta.db_table)
+    assignments = ', '.join(
+        '%(column)s = (SELECT %(action)s.%(column)s FROM %(action)s '
+        'WHERE %(action)s.%(id)s = %(stream)s.%(action_id)s)' % {
+            'column': qn(column), 'action': action, 'stream': stream,
+            'id': qn('id'), 'action_id': qn('action_id'),
+        } for column in ('created', 'public', 'handler'))
+    sql = 'UPDATE %s SET %s WHERE %s > %%s AND %s <= %%s' % (stream, assignments, qn('id'), qn('id'))
+    with connection.cursor() as cursor:
+        for lower in range(0, last, BATCH_SIZE):
+            cursor.execute(sql, [lower, lower + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    # Backfill runs in batches outside of one long transaction
+    atomic = False
+
+    dependencies = [
+        ('activity', '0003_action_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='created',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='public',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='handler',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_streams, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='stream',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterIndexTogether(
+            name='stream',
+            index_together=set([('user', 'created', 'action')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0004_stream_denormalized_fields'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='follow',
+            index_together=set([('content_type', 'object_id', 'user')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0005_follow_object_user_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FanoutCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lower', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('completed', models.BooleanField(default=False)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='activity.Action')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='fanoutcheckpoint',
+            unique_together=set([('action', 'lower')]),
+        ),
+    ]
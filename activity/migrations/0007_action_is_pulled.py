@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0006_fanoutcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='is_pulled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([('created', 'id'), ('is_pulled', 'created')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0007_action_is_pulled'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([('created', 'id'), ('is_pulled', 'created'), ('is_global', 'created')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('activity', '0008_action_global_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='action_object_int_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='action',
+            name='target_int_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='action',
+            index_together=set([
+                ('created', 'id'),
+                ('is_pulled', 'created'),
+                ('is_global', 'created'),
+                ('actor_content_type', 'actor_object_id', 'created'),
+                ('action_object_content_type', 'action_object_object_id', 'created'),
+                ('target_content_type', 'target_object_id', 'created'),
+                ('action_object_content_type', 'action_object_int_id', 'created'),
+                ('target_content_type', 'target_int_id', 'created'),
+            ]),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_follows(apps, schema_editor):
+    Follow = apps.get_model('activity', 'Follow')
+    FollowCount = apps.get_model('activity', 'FollowCount')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    db_alias = schema_editor.connection.alias
+
+    counts = {}
+    follows = Follow.objects.using(db_alias).order_by()
+    for content_type_id, object_id, count in follows.values_list(
+            'content_type', 'object_id').annotate(count=Count('pk')).iterator():
+        counts[(content_type_id, object_id)] = [count, 0]
+
+    app_label, model = settings.AUTH_USER_MODEL.lower().split('.')
+    user_type = ContentType.objects.using(db_alias).filter(app_label=app_label, model=model).first()
+    if user_type is not None:
+        for user_id, count in follows.values_list('user').annotate(count=Count('pk')).iterator():
+            counts.setdefault((user_type.pk, user_id), [0, 0])[1] = count
+
+    FollowCount.objects.using(db_alias).bulk_create([
+        FollowCount(content_type_id=content_type_id, object_id=object_id, followers=followers, following=following)
+        for (content_type_id, object_id), (followers, following) in counts.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('activity', '0009_action_object_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('followers', models.IntegerField(default=0)),
+                ('following', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='followcount',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+        migrations.RunPython(count_follows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('activity', '0011_streamstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='group_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='group_sample',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='group_size',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AlterIndexTogether(
+            name='stream',
+            index_together=set([('user', 'created', 'action'), ('user', 'group_key', 'created')]),
+        ),
+    ]
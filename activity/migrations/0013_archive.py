@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import activity.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('activity', '0012_stream_aggregation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('handler', models.CharField(max_length=255)),
+                ('actor_object_id', models.PositiveIntegerField()),
+                ('action_object_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('action_object_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('target_object_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('target_int_id', models.BigIntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField()),
+                ('public', models.BooleanField(default=True)),
+                ('is_global', models.BooleanField(default=False)),
+                ('is_pulled', models.BooleanField(default=False)),
+                ('action_object_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('actor_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('target_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'ordering': ('-created',),
+            },
+            bases=(activity.models.ActionMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='ArchivedStream',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('public', models.BooleanField(default=True)),
+                ('handler', models.CharField(max_length=255)),
+                ('group_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('group_size', models.IntegerField(default=1)),
+                ('group_sample', models.CharField(blank=True, default='', max_length=255)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='activity.ArchivedAction')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedstream',
+            unique_together=set([('user', 'action')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedstream',
+            index_together=set([('user', 'created', 'action')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedaction',
+            index_together=set([('action_object_content_type', 'action_object_object_id', 'created'), ('actor_content_type', 'actor_object_id', 'created'), ('action_object_content_type', 'action_object_int_id', 'created'), ('target_content_type', 'target_object_id', 'created'), ('created', 'id'), ('target_content_type', 'target_int_id', 'created')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import activity.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0013_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stream',
+            name='action',
+            field=models.ForeignKey(on_delete=activity.models.detach_or_cascade, to='activity.Action'),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activity', '0014_stream_action_detach'),
+    ]
+
+    # index_together is gone in Django 5.1, the indexes keep their columns
+    operations = [
+        migrations.AlterField(
+            model_name='follow',
+            name='actor_only',
+            field=models.BooleanField(default=True, verbose_name='Only follow actions where the object is the actor'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_created_id',
+            old_fields=('created', 'id'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_pulled',
+            old_fields=('is_pulled', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_global',
+            old_fields=('is_global', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_actor',
+            old_fields=('actor_content_type', 'actor_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_object',
+            old_fields=('action_object_content_type', 'action_object_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_target',
+            old_fields=('target_content_type', 'target_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_object_int',
+            old_fields=('action_object_content_type', 'action_object_int_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='action',
+            new_name='activity_action_target_int',
+            old_fields=('target_content_type', 'target_int_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='stream',
+            new_name='activity_stream_user_created',
+            old_fields=('user', 'created', 'action'),
+        ),
+        migrations.RenameIndex(
+            model_name='stream',
+            new_name='activity_stream_user_group',
+            old_fields=('user', 'group_key', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='follow',
+            new_name='activity_follow_object_user',
+            old_fields=('content_type', 'object_id', 'user'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_created_id',
+            old_fields=('created', 'id'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_actor',
+            old_fields=('actor_content_type', 'actor_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_object',
+            old_fields=('action_object_content_type', 'action_object_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_target',
+            old_fields=('target_content_type', 'target_object_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_object_int',
+            old_fields=('action_object_content_type', 'action_object_int_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedaction',
+            new_name='activity_archived_target_int',
+            old_fields=('target_content_type', 'target_int_id', 'created'),
+        ),
+        migrations.RenameIndex(
+            model_name='archivedstream',
+            new_name='activity_archived_stream_user',
+            old_fields=('user', 'created', 'action'),
+        ),
+    ]
@@ -1,50 +1,42 @@
 from django.conf import settings
 from django.db import models, connection
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 from django.utils import timezone
 from django.utils.timesince import timesince as _timesince
-from django.utils.translation import ugettext as _
+from django.utils.translation import gettext as _
 
+from activity import cache as fragment_cache
+from activity.bulk import buffer_event, is_fanout_suppressed
 from activity.registry import activityregistry
 from activity.signals import action
-from activity.managers import ActionQuerySet, FollowManager, StreamManager
-from activity.tasks import fanout_action
+from activity.managers import ActionQuerySet, FollowCountManager, FollowManager, StreamManager, StreamStateManager
+from activity.conf import get_setting
+from activity.routers import pin, pin_actors
+from activity.tasks import backfill_stream, fanout_action, purge_stream
 
 
-class Action(models.Model):
+def integer_id(value):
     """
-    Action model is used to describe the event.
-
-    Naming convention from http://activitystrea.ms/specs/atom/1.0/
+    Return object ID as an integer or None if it is not one
     """
-    handler = models.CharField(max_length=255)
-
-    actor_content_type = models.ForeignKey(ContentType, related_name='actor', on_delete=models.CASCADE)
-    actor_object_id = models.PositiveIntegerField()
-    actor = GenericForeignKey('actor_content_type', 'actor_object_id')
-
-    action_object_content_type = models.ForeignKey(ContentType, related_name='action_object', blank=True,
-                                                   null=True, on_delete=models.CASCADE)
-    action_object_object_id = models.CharField(max_length=255, blank=True, null=True)
-    action_object = GenericForeignKey('action_object_content_type', 'action_object_object_id')
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
 
-    target_content_type = models.ForeignKey(ContentType, related_name='target', blank=True, null=True,
-                                            on_delete=models.CASCADE)
-    target_object_id = models.CharField(max_length=255, blank=True, null=True)
-    target = GenericForeignKey('target_content_type', 'target_object_id')
 
-    created = models.DateTimeField(db_index=True, default=timezone.now)
-    public = models.BooleanField(default=True)
-    is_global = models.BooleanField(default=False)
-
-    objects = ActionQuerySet.as_manager()
-
-    class Meta:
-        ordering = ('-created',)
+class ActionMixin(object):
+    """
+    Methods shared by actions and archived actions
+    """
+    # Merged stream entry info set by the stream feed, see Stream.group_size
+    group_size = 1
+    group_sample = ()
 
     def __unicode__(self):
         values = {
@@ -63,6 +55,13 @@ class Action(models.Model):
             return _('%(actor)s %(verb)s %(action_object)s %(since)s ago') % values
         return _('%(actor)s %(verb)s %(since)s ago') % values
 
+    def set_integer_ids(self):
+        """
+        Copy action object and target IDs to the integer columns
+        """
+        self.action_object_int_id = integer_id(self.action_object_object_id)
+        self.target_int_id = integer_id(self.target_object_id)
+
     @property
     def action_handler(self):
         """
@@ -85,18 +84,150 @@ class Action(models.Model):
         return _timesince(self.created, now)
 
 
+class Action(ActionMixin, models.Model):
+    """
+    Action model is used to describe the event.
+
+    Naming convention from http://activitystrea.ms/specs/atom/1.0/
+    """
+    handler = models.CharField(max_length=255)
+
+    actor_content_type = models.ForeignKey(ContentType, related_name='actor', on_delete=models.CASCADE)
+    actor_object_id = models.PositiveIntegerField()
+    actor = GenericForeignKey('actor_content_type', 'actor_object_id')
+
+    action_object_content_type = models.ForeignKey(ContentType, related_name='action_object', blank=True,
+                                                   null=True, on_delete=models.CASCADE)
+    action_object_object_id = models.CharField(max_length=255, blank=True, null=True)
+    action_object = GenericForeignKey('action_object_content_type', 'action_object_object_id')
+    # Integer copy of action_object_object_id, see ACTIVITY_INTEGER_OBJECT_IDS
+    action_object_int_id = models.BigIntegerField(blank=True, null=True)
+
+    target_content_type = models.ForeignKey(ContentType, related_name='target', blank=True, null=True,
+                                            on_delete=models.CASCADE)
+    target_object_id = models.CharField(max_length=255, blank=True, null=True)
+    target = GenericForeignKey('target_content_type', 'target_object_id')
+    # Integer copy of target_object_id, see ACTIVITY_INTEGER_OBJECT_IDS
+    target_int_id = models.BigIntegerField(blank=True, null=True)
+
+    created = models.DateTimeField(db_index=True, default=timezone.now)
+    public = models.BooleanField(default=True)
+    is_global = models.BooleanField(default=False)
+    # Not fanned out, merged into followers' streams at read time
+    is_pulled = models.BooleanField(default=False)
+
+    objects = ActionQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [
+            # Keyset pagination orders by (created, id)
+            models.Index(fields=['created', 'id'], name='activity_action_created_id'),
+            models.Index(fields=['is_pulled', 'created'], name='activity_action_pulled'),
+            models.Index(fields=['is_global', 'created'], name='activity_action_global'),
+            # Activity of an object
+            models.Index(fields=['actor_content_type', 'actor_object_id', 'created'], name='activity_action_actor'),
+            models.Index(fields=['action_object_content_type', 'action_object_object_id', 'created'],
+                         name='activity_action_object'),
+            models.Index(fields=['target_content_type', 'target_object_id', 'created'], name='activity_action_target'),
+            models.Index(fields=['action_object_content_type', 'action_object_int_id', 'created'],
+                         name='activity_action_object_int'),
+            models.Index(fields=['target_content_type', 'target_int_id', 'created'],
+                         name='activity_action_target_int'),
+        ]
+
+    @classmethod
+    def from_event(cls, handler, actor, action_object=None, target=None, is_global=False,
+                   timestamp=None, **kwargs):
+        """
+        Build unsaved action from ``action`` signal arguments
+        """
+        item = cls(
+            handler=handler,
+            actor_content_type=ContentType.objects.get_for_model(actor),
+            actor_object_id=actor.pk,
+            is_global=is_global,
+        )
+        if timestamp is not None:
+            item.created = timestamp
+        for opt, obj in (('action_object', action_object), ('target', target)):
+            if obj is not None:
+                setattr(item, '%s_object_id' % opt, obj.pk)
+                setattr(item, '%s_content_type' % opt,
+                        ContentType.objects.get_for_model(obj))
+        item.set_integer_ids()
+        return item
+
+
+def detach_or_cascade(collector, field, sub_objs, using):
+    """
+    ``on_delete`` of stream entries. Merged entries of a deleted action
+    are kept for the rest of their group, see ``SQLFeedBackend.detach``,
+    and the other entries are deleted.
+    """
+    from activity.backends.sql import SQLFeedBackend
+
+    actions = Action.objects.using(using).filter(pk__in=sub_objs.values('action'))
+    kept = SQLFeedBackend(using=using).detach(actions)
+    if kept:
+        sub_objs = sub_objs.exclude(pk__in=kept)
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class Stream(models.Model):
     """
     User's activity stream item. This is used to pre-populate activity streams
     and to avoid scans on Action table.
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    action = models.ForeignKey(Action, on_delete=models.CASCADE)
+    action = models.ForeignKey(Action, on_delete=detach_or_cascade)
+
+    # Denormalized from the action to read streams without joining actions
+    created = models.DateTimeField(default=timezone.now)
+    public = models.BooleanField(default=True)
+    handler = models.CharField(max_length=255)
+
+    # Similar actions merged into this entry, see ActionHandler.aggregate_window
+    group_key = models.CharField(max_length=255, blank=True, null=True)
+    group_size = models.IntegerField(default=1)
+    # Comma separated IDs of the newest merged actions
+    group_sample = models.CharField(max_length=255, blank=True, default='')
 
     objects = StreamManager()
 
     class Meta:
         unique_together = ('user', 'action')
+        indexes = [
+            models.Index(fields=['user', 'created', 'action'], name='activity_stream_user_created'),
+            models.Index(fields=['user', 'group_key', 'created'], name='activity_stream_user_group'),
+        ]
+
+
+class StreamState(models.Model):
+    """
+    Position of the user in their stream and number of entries added since
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    last_seen = models.DateTimeField(blank=True, null=True)
+    unread = models.IntegerField(default=0)
+
+    objects = StreamStateManager()
+
+
+class FanoutCheckpoint(models.Model):
+    """
+    Progress of a chunked fan-out job. Lets a retried or duplicated chunk
+    task resume from the last written user instead of starting over.
+    """
+    action = models.ForeignKey(Action, on_delete=models.CASCADE)
+    # Exclusive lower bound of the chunk's user ID range
+    lower = models.PositiveIntegerField()
+    # Last user ID written
+    position = models.PositiveIntegerField()
+    completed = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('action', 'lower')
 
 
 class Follow(models.Model):
@@ -118,44 +249,201 @@ class Follow(models.Model):
     class Meta:
         # User can follow an object only once
         unique_together = ('user', 'content_type', 'object_id')
+        # Followers of an object in user order for chunked fan-out
+        indexes = [models.Index(fields=['content_type', 'object_id', 'user'], name='activity_follow_object_user')]
 
     def __unicode__(self):
         return u'%s follows %s' % (self.user, self.follow_object)
 
 
+class FollowCount(models.Model):
+    """
+    Denormalized number of followers of an object, and for users also the
+    number of objects they are following
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    followers = models.IntegerField(default=0)
+    following = models.IntegerField(default=0)
+
+    objects = FollowCountManager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+
+class ArchivedAction(ActionMixin, models.Model):
+    """
+    Action moved out of the action table by the archive_activity command.
+    Keeps the ID and columns of the action.
+    """
+    id = models.IntegerField(primary_key=True)
+    handler = models.CharField(max_length=255)
+
+    actor_content_type = models.ForeignKey(ContentType, related_name='+', on_delete=models.CASCADE)
+    actor_object_id = models.PositiveIntegerField()
+    actor = GenericForeignKey('actor_content_type', 'actor_object_id')
+
+    action_object_content_type = models.ForeignKey(ContentType, related_name='+', blank=True, null=True,
+                                                   on_delete=models.CASCADE)
+    action_object_object_id = models.CharField(max_length=255, blank=True, null=True)
+    action_object = GenericForeignKey('action_object_content_type', 'action_object_object_id')
+    action_object_int_id = models.BigIntegerField(blank=True, null=True)
+
+    target_content_type = models.ForeignKey(ContentType, related_name='+', blank=True, null=True,
+                                            on_delete=models.CASCADE)
+    target_object_id = models.CharField(max_length=255, blank=True, null=True)
+    target = GenericForeignKey('target_content_type', 'target_object_id')
+    target_int_id = models.BigIntegerField(blank=True, null=True)
+
+    created = models.DateTimeField()
+    public = models.BooleanField(default=True)
+    is_global = models.BooleanField(default=False)
+    is_pulled = models.BooleanField(default=False)
+
+    objects = ActionQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-created',)
+        # Only the lookups of archive feeds
+        indexes = [
+            models.Index(fields=['created', 'id'], name='activity_archived_created_id'),
+            models.Index(fields=['actor_content_type', 'actor_object_id', 'created'], name='activity_archived_actor'),
+            models.Index(fields=['action_object_content_type', 'action_object_object_id', 'created'],
+                         name='activity_archived_object'),
+            models.Index(fields=['target_content_type', 'target_object_id', 'created'],
+                         name='activity_archived_target'),
+            models.Index(fields=['action_object_content_type', 'action_object_int_id', 'created'],
+                         name='activity_archived_object_int'),
+            models.Index(fields=['target_content_type', 'target_int_id', 'created'],
+                         name='activity_archived_target_int'),
+        ]
+
+
+class ArchivedStream(models.Model):
+    """
+    Stream entry of an archived action
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    action = models.ForeignKey(ArchivedAction, related_name='+', on_delete=models.CASCADE)
+
+    created = models.DateTimeField()
+    public = models.BooleanField(default=True)
+    handler = models.CharField(max_length=255)
+
+    group_key = models.CharField(max_length=255, blank=True, null=True)
+    group_size = models.IntegerField(default=1)
+    group_sample = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        unique_together = ('user', 'action')
+        indexes = [models.Index(fields=['user', 'created', 'action'], name='activity_archived_stream_user')]
+
+
+@receiver(pre_save, sender=Action)
+def action_pre_save_integer_ids(sender, instance, **kwargs):
+    instance.set_integer_ids()
+
+
 @receiver(post_save, sender=Action)
 def action_post_save_fanout(sender, instance, created, **kwargs):
     """
     Fanout action if new instance saved
     """
-    if created:
+    if created and not is_fanout_suppressed():
         # Fanout action (populate streams)
         if hasattr(connection, 'on_commit'):
             # Use django-transaction-hook to trigger tasks after transaction commit
             connection.on_commit(lambda: fanout_action.delay(instance.pk))
         else:
             fanout_action.delay(instance.pk)
+    elif not created:
+        # Keep denormalized stream columns in sync
+        Stream.objects.filter(action=instance).update(created=instance.created,
+                                                      public=instance.public,
+                                                      handler=instance.handler)
+
+
+@receiver(post_save, sender=Action)
+def action_post_save_pin(sender, instance, created, raw=False, **kwargs):
+    """
+    Read feeds of an acting user from the write database for a while
+    """
+    if created and not raw:
+        pin_actors([instance])
+
+
+@receiver(post_save, dispatch_uid='activity.models.invalidate_fragments')
+@receiver(post_delete, dispatch_uid='activity.models.invalidate_fragments_delete')
+def invalidate_fragments(sender, instance, created=False, raw=False, **kwargs):
+    """
+    Drop cached fragments of a changed action, or of actions referring to a
+    changed object of a model in ``fragment_models`` of their handlers,
+    when ``ACTIVITY_RENDER_CACHE`` is on
+    """
+    if created or raw or not fragment_cache.is_enabled():
+        return
+    if sender is Action:
+        fragment_cache.invalidate([(instance.pk, instance.handler)])
+        return
+    handler_ids = fragment_cache.watching(sender)
+    if handler_ids:
+        fragment_cache.invalidate_object(instance, handler_ids)
+
+
+@receiver(post_save, sender=Follow)
+def follow_post_save_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        FollowCount.objects.change(instance, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_post_delete_count(sender, instance, **kwargs):
+    FollowCount.objects.change(instance, -1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_pin(sender, instance, created=True, raw=False, **kwargs):
+    """
+    Read feeds and follows of the follower from the write database for a while
+    """
+    if created and not raw:
+        pin(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_post_save_backfill(sender, instance, created, raw=False, **kwargs):
+    """
+    Backfill the follower's stream with recent actions of a followed actor
+    """
+    if created and not raw and instance.actor_only and get_setting('BACKFILL_LIMIT'):
+        actors = [(instance.content_type_id, instance.object_id)]
+        if hasattr(connection, 'on_commit'):
+            connection.on_commit(lambda: backfill_stream.delay(instance.user_id, actors))
+        else:
+            backfill_stream.delay(instance.user_id, actors)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_post_delete_purge(sender, instance, **kwargs):
+    """
+    Remove actions of an unfollowed actor from the follower's stream
+    """
+    if instance.actor_only:
+        actors = [(instance.content_type_id, instance.object_id)]
+        if hasattr(connection, 'on_commit'):
+            connection.on_commit(lambda: purge_stream.delay(instance.user_id, actors))
+        else:
+            purge_stream.delay(instance.user_id, actors)
 
 
 def action_handler(sender, **kwargs):
     handlers = activityregistry.get_handlers()
-    handler_name = kwargs.get('handler')
-    actor = kwargs.get('actor')
-    is_global = kwargs.get('is_global', False)
-    if handler_name in handlers:
-        action = Action(
-            handler=handler_name,
-            actor_content_type=ContentType.objects.get_for_model(actor),
-            actor_object_id=actor.pk,
-            is_global=is_global,
-        )
-        for opt in ('action_object', 'target'):
-            obj = kwargs.get(opt, None)
-            if obj is not None:
-                setattr(action, '%s_object_id' % opt, obj.pk)
-                setattr(action, '%s_content_type' % opt,
-                        ContentType.objects.get_for_model(obj))
-        action.save()
+    if kwargs.get('handler') in handlers:
+        if buffer_event(kwargs):
+            return
+        Action.from_event(**kwargs).save()
 
 
 action.connect(action_handler, dispatch_uid='activity.models')
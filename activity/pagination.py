@@ -0,0 +1,109 @@
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_str
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created, pk):
+    """
+    Return an opaque token pointing to the given position of a feed
+    """
+    value = '%s|%d' % (created.isoformat(), pk)
+    return force_str(base64.urlsafe_b64encode(force_bytes(value))).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return (created, pk) tuple stored in the given token
+    """
+    try:
+        value = force_bytes(cursor)
+        value = force_str(base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4)))
+        created, pk = value.split('|')
+        created, pk = parse_datetime(created), int(pk)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor %r' % cursor)
+    if created is None:
+        raise InvalidCursor('Invalid cursor %r' % cursor)
+    return created, pk
+
+
+def keyset_filter(cursor, lookup, created='created', pk='pk'):
+    """
+    Return filter for rows before ('lt') or after ('gt') the given cursor.
+    The redundant inclusive condition lets the database bound the index scan.
+    """
+    created_value, pk_value = decode_cursor(cursor)
+    return (Q(**{'%s__%s' % (created, lookup): created_value}) |
+            Q(**{'%s__%s' % (pk, lookup): pk_value})) & Q(**{'%s__%se' % (created, lookup): created_value})
+
+
+def cursor_for(item):
+    """
+    Return token pointing to the given action
+    """
+    return encode_cursor(item.created, item.pk)
+
+
+class Page(list):
+    """
+    List of feed items, newest first, with tokens to fetch the neighbouring
+    pages.
+
+    ``next_cursor`` is passed as ``before`` to get older items and is None
+    when there are no more items. ``previous_cursor`` is passed as ``after``
+    to poll for newer items. A page read after a cursor holds the items
+    right after it, so polling until a page is empty skips nothing.
+    """
+    def __init__(self, items=(), next_cursor=None, previous_cursor=None):
+        super(Page, self).__init__(items)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+
+class PartialRows(list):
+    """
+    Rows of a feed whose reading stopped before the requested number of
+    rows was found. ``cursor`` points past the keys read, in feed order.
+    """
+    def __init__(self, rows=(), cursor=None):
+        super(PartialRows, self).__init__(rows)
+        self.cursor = cursor
+
+
+def paginate(queryset, limit):
+    """
+    Return first page of a queryset or feed ordered by ``keyset``. One
+    extra row is fetched to find out whether there is a next page.
+    """
+    if hasattr(queryset, 'fetch'):
+        rows = queryset.fetch(limit + 1)
+    else:
+        rows = list(queryset[:limit + 1])
+    return make_page(rows, limit, getattr(queryset, '_ascending', False))
+
+
+def make_page(rows, limit, ascending=False):
+    """
+    Return page of the first ``limit`` rows. Rows beyond the limit tell
+    that there is a next page.
+
+    Rows read after a cursor come oldest first. Their page is turned newest
+    first and has no ``next_cursor``, as older items precede the cursor.
+    Partial rows continue from their cursor instead of the last item.
+    """
+    resume = getattr(rows, 'cursor', None)
+    items = list(rows[:limit])
+    if ascending:
+        items.reverse()
+        next_cursor = None
+        previous_cursor = resume or (cursor_for(items[0]) if items else None)
+    else:
+        next_cursor = resume or (cursor_for(items[-1]) if len(rows) > limit else None)
+        previous_cursor = cursor_for(items[0]) if items else None
+    return Page(items, next_cursor, previous_cursor)
@@ -1,6 +1,16 @@
+from collections import OrderedDict
+
 from django.template.loader import render_to_string
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
 from django.utils.timesince import timesince as _timesince
-from django.utils.translation import ugettext as _
+from django.utils.translation import gettext as _
+
+from activity.metrics import get_metrics, timed
+
+
+# Stands in for the "since" text in cacheable fragments
+SINCE_PLACEHOLDER = '__activity_since__'
 
 
 class AlreadyRegistered(Exception):
@@ -10,26 +20,97 @@ class AlreadyRegistered(Exception):
 class ActionHandler(object):
     template_name = 'activity/item.html'
     verb = 'created'
+    # Bump to drop cached fragments after changing the template
+    template_version = 1
+    # Cache rendered fragments when ACTIVITY_RENDER_CACHE is on
+    cache_fragments = True
+    # Models shown in fragments, as classes or 'app_label.ModelName'
+    # strings. Saving or deleting one of their instances drops cached
+    # fragments of the actions referring to it. Fragments are cached only
+    # once declared, use () when they show nothing but the action.
+    fragment_models = None
+    # Merge actions with the same aggregate key into one stream entry while
+    # the entry's newest action is at most this old (a timedelta). Needs a
+    # feed backend supporting aggregation.
+    aggregate_window = None
+    # Number of newest merged actions kept in an entry
+    aggregate_sample_size = 3
 
     def render(self, item):
         context = self.get_context_data(item)
         return render_to_string(self.template_name, context)
 
+    def render_fragment(self, item):
+        """
+        Render item with a placeholder in place of the "since" text, so the
+        result stays valid over time and can be cached
+        """
+        context = self.get_context_data(item)
+        context['since'] = SINCE_PLACEHOLDER
+        return render_to_string(self.template_name, context)
+
+    def render_many(self, items):
+        """
+        Render several items at once with contexts from
+        ``get_context_data_many``. Handlers overriding ``render`` are
+        rendered item by item.
+        """
+        if self._overrides('render'):
+            return [self.render(item) for item in items]
+        return [render_to_string(self.template_name, context)
+                for context in self.get_context_data_many(items)]
+
+    def render_fragment_many(self, items):
+        """
+        Render several items like ``render_fragment``
+        """
+        if self._overrides('render_fragment'):
+            return [self.render_fragment(item) for item in items]
+        contexts = self.get_context_data_many(items)
+        for context in contexts:
+            context['since'] = SINCE_PLACEHOLDER
+        return [render_to_string(self.template_name, context) for context in contexts]
+
+    def _overrides(self, name):
+        return getattr(type(self), name) is not getattr(ActionHandler, name)
+
+    def fill_fragment(self, fragment, item, now=None):
+        """
+        Replace the placeholder of a rendered fragment with the "since" text
+        """
+        return mark_safe(fragment.replace(SINCE_PLACEHOLDER, conditional_escape(self.timesince(item.created, now))))
+
     def get_context_data(self, item):
         return {
             'actor': item.actor,
+            'actors': [action.actor for action in item.group_sample] or [item.actor],
+            'others': max(item.group_size - len(item.group_sample), 0),
             'target': item.target,
             'verb': _(self.verb),
             'since': self.timesince(item.created),
             'activity': item
         }
 
+    def get_context_data_many(self, items):
+        """
+        Return list of contexts of the given items. Override to load data
+        shared by several items with a few queries instead of one per item.
+        """
+        return [self.get_context_data(item) for item in items]
+
     def timesince(self, time, now=None):
         """
         Shortcut for ``django.utils.timesince.timesince`` function
         """
         return _timesince(time, now)
 
+    def aggregate_key(self, item):
+        """
+        Key of actions merged into one stream entry, handler and target by
+        default
+        """
+        return '%s:%s:%s' % (item.handler, item.target_content_type_id, item.target_object_id)
+
     def fanout_extra_targets(self, item):
         """
         Extra targets to use in fan-out operation. Returned values are merged
@@ -61,5 +142,23 @@ class ActivityRegistry(object):
     def get_handlers(self):
         return self.handlers
 
+    def render_many(self, items, method='render_many'):
+        """
+        Render actions calling each handler once with all of its items.
+        Returns rendered items in the given order.
+        """
+        groups = OrderedDict()
+        for index, item in enumerate(items):
+            groups.setdefault(item.handler, []).append((index, item))
+        output = [None] * len(items)
+        metrics = get_metrics()
+        for handler_id, group in groups.items():
+            with timed('activity.render', {'handler': handler_id}):
+                rendered = getattr(self.handlers[handler_id], method)([item for index, item in group])
+            metrics.incr('activity.render.items', len(group), {'handler': handler_id})
+            for (index, item), value in zip(group, rendered):
+                output[index] = value
+        return output
+
 
 activityregistry = ActivityRegistry()
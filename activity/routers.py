@@ -0,0 +1,93 @@
+import random
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+
+from activity.conf import get_setting
+
+
+def write_database():
+    """
+    Return alias of the database activity models are written to
+    """
+    return get_setting('WRITE_DATABASE')
+
+
+def pin_key(user_id):
+    return 'activity:pin:%s' % user_id
+
+
+def pin(*user_ids):
+    """
+    Read feeds and follows of the given users from the write database for
+    ``ACTIVITY_PIN_SECONDS``, so their own follows and actions show up
+    before replicas catch up
+    """
+    timeout = get_setting('PIN_SECONDS')
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if user_ids and timeout and get_setting('READ_DATABASES'):
+        caches[get_setting('PIN_CACHE_ALIAS')].set_many(
+            dict((pin_key(user_id), True) for user_id in user_ids), timeout)
+
+
+def pin_actors(actions):
+    """
+    Pin users among actors of the given actions
+    """
+    if not get_setting('READ_DATABASES'):
+        return
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    user_type = ContentType.objects.get_for_model(apps.get_model(settings.AUTH_USER_MODEL)).pk
+    pin(*set(action.actor_object_id for action in actions if action.actor_content_type_id == user_type))
+
+
+def is_pinned(user_id):
+    return bool(caches[get_setting('PIN_CACHE_ALIAS')].get(pin_key(user_id)))
+
+
+def read_database(user=None):
+    """
+    Return alias of a database to read feeds and follows from. A random
+    replica from ``ACTIVITY_READ_DATABASES`` is picked unless the given
+    user wrote recently. Returns None without replicas, leaving the choice
+    to ``DATABASE_ROUTERS``.
+    """
+    replicas = get_setting('READ_DATABASES')
+    if not replicas:
+        return None
+    if user is not None and user.pk is not None and is_pinned(user.pk):
+        return write_database()
+    return random.choice(replicas)
+
+
+class ActivityRouter(object):
+    """
+    Database router keeping activity models on ``ACTIVITY_WRITE_DATABASE``.
+
+    Fan-out, follow changes and other writes, and reads which must not lag
+    behind them, use the write database. Feed and follow reads of the
+    managers pick a replica with ``read_database`` themselves. Add it to
+    ``DATABASE_ROUTERS`` together with ``ACTIVITY_READ_DATABASES``.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'activity':
+            return write_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'activity':
+            return write_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set(get_setting('READ_DATABASES')) | set([write_database()])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their tables from the write database
+        if app_label == 'activity' and db in get_setting('READ_DATABASES'):
+            return False
+        return None
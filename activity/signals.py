@@ -1,6 +1,10 @@
 from django.dispatch import Signal
 
-action = Signal(providing_args=['handler', 'actor', 'action_object', 'target', 'is_global', 'timestamp'])
+# Arguments: handler, actor, action_object, target, is_global, timestamp
+action = Signal()
 
-pre_fanout = Signal(providing_args=['action'])
-post_fanout = Signal(providing_args=['action'])
+# Arguments: action
+pre_fanout = Signal()
+post_fanout = Signal()
+# Arguments: action, chunk, chunks, count
+fanout_progress = Signal()
@@ -1,23 +1,93 @@
-import itertools
+from collections import defaultdict
 
-from celery import task
+from celery import group, task
 from celery.utils.log import get_task_logger
 
-from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from activity.backends import get_backend
+from activity.conf import get_setting
+from activity.db import bulk_insert_ignore
+from activity.metrics import get_metrics
+from activity.registry import activityregistry
+from activity.signals import pre_fanout, post_fanout, fanout_progress
 
 
 logger = get_task_logger(__name__)
 
 
+def fanout_recipients(action, lower=None, upper=None, user_ids=None):
+    """
+    Return IDs of users following the actor of the action ordered by ID.
+    IDs can be restricted to the range (lower, upper] or to the given users.
+    """
+    from activity.models import Follow
+
+    queryset = Follow.objects.filter(
+        content_type=action.actor_content_type_id,
+        object_id=action.actor_object_id,
+        actor_only=True)
+    if lower is not None:
+        queryset = queryset.filter(user__gt=lower)
+    if upper is not None:
+        queryset = queryset.filter(user__lte=upper)
+    if user_ids is not None:
+        queryset = queryset.filter(user__in=user_ids)
+    return queryset.order_by('user').values_list('user', flat=True)
+
+
+def fanout_chunks(action, size):
+    """
+    Yield (lower, upper] user ID ranges holding at most ``size`` recipients.
+    Boundaries are found by keyset so each step reads a bounded index range.
+    Upper bound of the last range is None.
+    """
+    lower = 0
+    while True:
+        upper = list(fanout_recipients(action, lower)[size - 1:size])
+        if not upper:
+            break
+        yield lower, upper[0]
+        lower = upper[0]
+    if fanout_recipients(action, lower).exists():
+        yield lower, None
+
+
+def has_many_followers(action):
+    """
+    Does the actor have more followers than ``ACTIVITY_FANOUT_FOLLOWER_THRESHOLD``?
+    Reads the follower counter, and counts followers up to the threshold
+    only when the actor has none yet.
+    """
+    from activity.models import FollowCount
+
+    threshold = get_setting('FANOUT_FOLLOWER_THRESHOLD')
+    if threshold is None:
+        return False
+    counts = list(FollowCount.objects.filter(
+        content_type=action.actor_content_type_id, object_id=action.actor_object_id,
+    ).values_list('followers', flat=True)[:1])
+    if counts:
+        return counts[0] > threshold
+    return fanout_recipients(action)[threshold:threshold + 1].exists()
+
+
 @task
 def fanout_action(action_id):
     """
     Fan-out action to feeds. Usually called when writing an action.
+
+    Recipients are split into ID ranges of ``ACTIVITY_FANOUT_CHUNK_SIZE``
+    users. A single range is written right away, several ranges are written
+    in parallel by a group of ``fanout_chunk`` tasks. Each range has a
+    checkpoint, and the chunk completing the last one finishes the job, so
+    no result backend is needed and ``post_fanout`` is sent once.
     """
-    from activity.models import Action, Follow, Stream
+    from activity.models import Action, FanoutCheckpoint, Stream
 
-    User = get_user_model()
     logger.info('Populating feeds')
 
     try:
@@ -31,30 +101,306 @@ def fanout_action(action_id):
         return False
 
     if action.is_global:
-        logger.info('This action is global. Populating all streams.')
+        # Global actions are stored once and merged into every stream at read time
+        logger.info('This action is global, skipping')
+        return True
+
+    if has_many_followers(action):
+        # Followers read the action from the actor at read time
+        logger.info('Actor has too many followers, skipping fan-out to followers')
+        Action.objects.filter(pk=action.pk).update(is_pulled=True)
+        get_metrics().incr('activity.fanout.pulled', tags={'handler': action.handler})
+        chunks = []
+    else:
+        chunks = list(fanout_chunks(action, get_setting('FANOUT_CHUNK_SIZE')))
+
+    # Get extra targets from activity handler, skip the ones covered by chunks
+    extra = set(action.action_handler.fanout_extra_targets(action))
+    if extra:
+        extra.difference_update(fanout_recipients(action, user_ids=extra))
+
+    if not chunks and not extra:
+        logger.info('No followers, skipping')
+        return True
 
-        user_ids = User.objects.values_list('pk', flat=True)
-        Stream.objects.fanout(action, user_ids)
-        logger.info('Stream population completed')
+    if len(chunks) > 1:
+        # Resume an interrupted job, chunks written earlier are skipped
+        completed = set(FanoutCheckpoint.objects.filter(
+            action=action, completed=True).values_list('lower', flat=True))
+        pending = [(index, lower, upper) for index, (lower, upper) in enumerate(chunks, 1)
+                   if lower not in completed]
+        if not pending:
+            logger.info('Fan-out of action %d already completed' % action.pk)
+            return True
     else:
-        # Action is not global, populate followers' streams
-        user_type = ContentType.objects.get_for_model(User)
+        pending = [(1, lower, upper) for lower, upper in chunks]
 
-        followers = Follow.objects.filter(
-            content_type=user_type,
-            object_id=action.actor.pk,
-            actor_only=True).values_list('user__pk', flat=True)
+    get_metrics().incr('activity.fanout.chunks', len(pending), {'handler': action.handler})
+    pre_fanout.send(sender=Stream.objects.__class__, action=action)
+    if extra:
+        Stream.objects.fanout_chunk(action, extra, get_setting('FANOUT_BATCH_SIZE'))
 
-        # Get extra targets from activity handler
-        extra = action.action_handler.fanout_extra_targets(action)
+    if len(chunks) > 1:
+        # Checkpoints of every chunk exist before any chunk can complete
+        bulk_insert_ignore(FanoutCheckpoint, [FanoutCheckpoint(action=action, lower=lower, position=lower)
+                                              for index, lower, upper in pending])
+        logger.info('Dispatching %d fan-out chunks' % len(pending))
+        group(fanout_chunk.si(action.pk, lower, upper, index, len(chunks))
+              for index, lower, upper in pending).apply_async()
+        return True
+
+    for index, lower, upper in pending:
+        fanout_chunk(action.pk, lower, upper, index, len(chunks))
+    fanout_complete(action.pk)
+    return True
 
-        # Combine targets and remove duplicates
-        targets = list(set(itertools.chain(followers, extra)))
 
-        if len(targets):
-            Stream.objects.fanout(action, targets)
-            logger.info('Stream population completed')
+@task
+def fanout_actions(action_ids):
+    """
+    Fan-out several actions, looking up followers once per distinct actor.
+    Actions of actors with more than one chunk of followers are passed on
+    to ``fanout_action``.
+    """
+    from activity.models import Action, Stream
+
+    actions = Action.objects.filter(pk__in=action_ids, public=True, is_global=False).order_by('pk')
+    by_actor = defaultdict(list)
+    for action in actions:
+        by_actor[(action.actor_content_type_id, action.actor_object_id)].append(action)
+
+    chunk_size = get_setting('FANOUT_CHUNK_SIZE')
+    batch_size = get_setting('FANOUT_BATCH_SIZE')
+    for group in by_actor.values():
+        if has_many_followers(group[0]):
+            Action.objects.filter(pk__in=[action.pk for action in group]).update(is_pulled=True)
+            followers = []
         else:
-            logger.info('No followers, skipping')
+            followers = list(fanout_recipients(group[0])[:chunk_size + 1])
+            if len(followers) > chunk_size:
+                for action in group:
+                    fanout_action.delay(action.pk)
+                continue
 
+        for action in group:
+            targets = set(followers)
+            targets.update(action.action_handler.fanout_extra_targets(action))
+            if targets:
+                Stream.objects.fanout(action, targets, batch_size)
+    logger.info('Fan-out of %d actions completed' % len(action_ids))
     return True
+
+
+@task(bind=True, acks_late=True, max_retries=5, default_retry_delay=10)
+def fanout_chunk(self, action_id, lower, upper, chunk=1, chunks=1):
+    """
+    Fan-out action to recipients in the user ID range (lower, upper].
+
+    Jobs split into several chunks keep a checkpoint of the last written
+    user, so a retried or duplicated task continues from there. Rows are
+    inserted ignoring duplicates, which makes repeating a batch harmless.
+    The chunk completing the job's last checkpoint finishes the job.
+    """
+    from activity.models import Action, FanoutCheckpoint, Stream
+
+    try:
+        action = Action.objects.get(pk=action_id)
+    except Action.DoesNotExist:
+        logger.warning('Action %d does not exists!' % action_id)
+        return 0
+
+    batch_size = get_setting('FANOUT_BATCH_SIZE')
+    checkpoint = None
+    position = lower
+    if chunks > 1:
+        try:
+            checkpoint = FanoutCheckpoint.objects.get(action=action, lower=lower)
+        except FanoutCheckpoint.DoesNotExist:
+            # Checkpoints are removed when the job finishes
+            logger.info('Fan-out of action %d already completed' % action_id)
+            return 0
+        if checkpoint.completed:
+            logger.info('Fan-out chunk %d/%d of action %d already completed' % (chunk, chunks, action_id))
+            return 0
+        position = checkpoint.position
+
+    count = 0
+    try:
+        while True:
+            user_ids = list(fanout_recipients(action, position, upper)[:batch_size])
+            if not user_ids:
+                break
+            count += Stream.objects.fanout_chunk(action, user_ids, batch_size)
+            position = user_ids[-1]
+            if checkpoint is not None:
+                FanoutCheckpoint.objects.filter(pk=checkpoint.pk).update(position=position)
+    except OperationalError as exc:
+        raise self.retry(exc=exc)
+
+    if checkpoint is not None:
+        FanoutCheckpoint.objects.filter(pk=checkpoint.pk).update(completed=True)
+
+    logger.info('Fan-out chunk %d/%d of action %d completed (%d streams)' % (
+        chunk, chunks, action_id, count))
+    fanout_progress.send(sender=Stream.objects.__class__, action=action,
+                         chunk=chunk, chunks=chunks, count=count)
+    if checkpoint is not None and not FanoutCheckpoint.objects.filter(action=action, completed=False).exists():
+        fanout_complete(action_id, chunked=True)
+    return count
+
+
+@task
+def fanout_complete(action_id, chunked=False):
+    """
+    Finish fan-out job once all chunks have been written. Of chunks
+    completing the last checkpoints at the same time only the one removing
+    the checkpoints finishes a ``chunked`` job.
+    """
+    from activity.models import Action, FanoutCheckpoint, Stream
+
+    action = Action.objects.get(pk=action_id)
+    # Later deliveries are made harmless by conflict-ignoring inserts
+    removed = FanoutCheckpoint.objects.filter(action=action).delete()[0]
+    if chunked and not removed:
+        return False
+    post_fanout.send(sender=Stream.objects.__class__, action=action)
+    logger.info('Stream population completed')
+    return True
+
+
+def iter_user_ids(lower=0, upper=None, chunk_size=1000):
+    """
+    Yield lists of user IDs in the range (lower, upper] by keyset
+    """
+    queryset = get_user_model().objects.order_by('pk')
+    if upper is not None:
+        queryset = queryset.filter(pk__lte=upper)
+    while True:
+        user_ids = list(queryset.filter(pk__gt=lower).values_list('pk', flat=True)[:chunk_size])
+        if not user_ids:
+            break
+        yield user_ids
+        lower = user_ids[-1]
+
+
+@task
+def trim_streams(lower=0, upper=None, chunk_size=1000, batch_size=1000):
+    """
+    Trim streams of users in the ID range (lower, upper] to
+    ``ACTIVITY_STREAM_MAX_LENGTH`` entries. Meant to run periodically.
+    """
+    from activity.models import Stream
+
+    length = get_setting('STREAM_MAX_LENGTH')
+    if length is None:
+        logger.info('Stream length is not limited, skipping')
+        return 0
+
+    removed = 0
+    for user_ids in iter_user_ids(lower, upper, chunk_size):
+        removed += Stream.objects.trim(user_ids, length, batch_size)
+    logger.info('Removed %d stream entries' % removed)
+    return removed
+
+
+@task
+def rebuild_streams(lower=None, upper=None, user_ids=None, since=None, until=None, extra_targets=False):
+    """
+    Write missing stream entries of users in the ID range (lower, upper], or
+    of the given users, for actions created in [since, until). Times are
+    ISO 8601 strings. With ``extra_targets`` only extra targets of handlers
+    are written. Returns number of entries written.
+    """
+    from activity.models import Stream
+
+    count = Stream.objects.rebuild(lower, upper, user_ids, since and parse_datetime(since),
+                                   until and parse_datetime(until), get_setting('FANOUT_BATCH_SIZE'),
+                                   extra_targets)
+    logger.info('Rebuilt %d stream entries of users (%s, %s]%s' % (
+        count, lower, upper, ' for extra targets' if extra_targets else ''))
+    return count
+
+
+def group_actors(actors):
+    """
+    Return dictionary of object IDs by content type ID of the given
+    (content type ID, object ID) pairs
+    """
+    grouped = defaultdict(set)
+    for content_type_id, object_id in actors:
+        grouped[content_type_id].add(object_id)
+    return grouped
+
+
+def followed_actors(user_id, actors):
+    """
+    Return the given (content type ID, object ID) actors the user is
+    following, with one query per content type
+    """
+    from activity.models import Follow
+
+    followed = set()
+    for content_type_id, object_ids in group_actors(actors).items():
+        followed.update(Follow.objects.filter(
+            user=user_id, content_type=content_type_id, object_id__in=object_ids,
+            actor_only=True).values_list('content_type', 'object_id'))
+    return followed
+
+
+@task
+def backfill_stream(user_id, actors):
+    """
+    Copy newest ``ACTIVITY_BACKFILL_LIMIT`` actions of the given
+    (content type ID, object ID) actors to the user's stream. Actions
+    merged into streams at read time are skipped, and actions of
+    aggregating handlers are merged like fan-out does.
+    """
+    from activity.models import Action, Stream
+
+    limit = get_setting('BACKFILL_LIMIT')
+    if not limit:
+        return 0
+
+    actions = []
+    for content_type_id, object_ids in group_actors(followed_actors(user_id, actors)).items():
+        actions.extend(Action.objects.public(
+            is_global=False, is_pulled=False,
+            actor_content_type=content_type_id, actor_object_id__in=object_ids,
+        ).order_by('-created', '-pk')[:limit])
+    actions.sort(key=lambda action: (action.created, action.pk), reverse=True)
+    actions = actions[:limit]
+
+    handlers = activityregistry.get_handlers()
+    plain, aggregating = [], []
+    for action in actions:
+        if getattr(handlers.get(action.handler), 'aggregate_window', None) is not None:
+            aggregating.append(action)
+        else:
+            plain.append(action)
+    batch_size = get_setting('FANOUT_BATCH_SIZE')
+    count = get_backend().add_actions(user_id, plain, batch_size)
+    # Oldest first, so entries are merged as fan-out did
+    for action in reversed(aggregating):
+        count += Stream.objects.fanout_chunk(action, [user_id], batch_size, unread=False)
+    logger.info('Backfilled %d stream entries of user %d' % (count, user_id))
+    return count
+
+
+@task
+def purge_stream(user_id, actors):
+    """
+    Remove actions of the given (content type ID, object ID) actors from
+    the user's stream. Actors followed again in the meantime are kept.
+    """
+    from activity.models import Action
+
+    followed = followed_actors(user_id, actors)
+    q = Q()
+    for content_type_id, object_ids in group_actors(set(map(tuple, actors)) - followed).items():
+        q |= Q(actor_content_type=content_type_id, actor_object_id__in=object_ids)
+    if not q:
+        return 0
+
+    count = get_backend().purge(user_id, Action.objects.filter(q))
+    logger.info('Purged %d stream entries of user %d' % (count, user_id))
+    return count
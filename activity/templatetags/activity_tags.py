@@ -0,0 +1,26 @@
+from django import template
+
+from activity.models import Follow
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def prefetch_following(user, targets):
+    """
+    Look up whether the user is following any of the targets at once, so
+    later ``is_following`` tags on the page don't query the database.
+
+    {% prefetch_following request.user object_list %}
+    """
+    Follow.objects.is_following_many(user, targets)
+    return ''
+
+
+@register.simple_tag
+def is_following(user, target):
+    """
+    {% is_following request.user object as following %}
+    """
+    return Follow.objects.is_following(user, target)
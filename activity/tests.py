@@ -5,7 +5,38 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from celery import current_app
+from django.apps import apps
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from activity.backends.redis import RedisFeedBackend
+from activity.backends.sql import SQLFeedBackend
+from activity.bulk import buffered_actions
+from activity.feeds import Feed, QuerySetSource
+from activity.metrics import get_metrics
+from activity.models import Action, ArchivedAction, ArchivedStream, FanoutCheckpoint, Follow, FollowCount, Stream
+from activity.pagination import InvalidCursor, cursor_for, decode_cursor, encode_cursor, paginate
+from activity.registry import SINCE_PLACEHOLDER, ActionHandler, activityregistry
+from activity.routers import read_database
+from activity.signals import action as action_signal, fanout_progress, post_fanout, pre_fanout
+from activity.tasks import backfill_stream, fanout_action, fanout_chunk, fanout_chunks, purge_stream, trim_streams
+from activity.views import activities
 
 
 class SimpleTest(TestCase):
@@ -14,3 +45,871 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ObjectsMixin(object):
+    """
+    Actions with users as actors and groups as targets
+    """
+    def setUp(self):
+        user_type = ContentType.objects.get_for_model(User)
+        group_type = ContentType.objects.get_for_model(Group)
+        actions = []
+        for i in range(5):
+            user = User.objects.create(username='user%d' % i)
+            group = Group.objects.create(name='group%d' % i)
+            actions.append(Action(handler='test',
+                                  actor_content_type=user_type, actor_object_id=user.pk,
+                                  target_content_type=group_type, target_object_id=str(group.pk)))
+        Action.objects.bulk_create(actions)
+
+
+class HandlersMixin(object):
+    """
+    Handlers registered for the duration of each test
+    """
+    handlers = {'test': ActionHandler}
+
+    def setUp(self):
+        super(HandlersMixin, self).setUp()
+        for handler_id, handler_class in self.handlers.items():
+            activityregistry.handlers[handler_id] = handler_class()
+            self.addCleanup(activityregistry.handlers.pop, handler_id)
+
+
+class WithObjectsTest(ObjectsMixin, TestCase):
+    def test_generic_relations_are_loaded_in_bulk(self):
+        # One query for the actions and one per content type
+        with self.assertNumQueries(3):
+            for item in Action.objects.with_objects()[:5]:
+                self.assertTrue(item.actor.username.startswith('user'))
+                self.assertTrue(item.target.name.startswith('group'))
+
+
+class IntegerObjectIdTest(ObjectsMixin, TestCase):
+    def test_backfill_and_lookup(self):
+        group = Group.objects.get(name='group2')
+        # bulk_create skips pre_save, so existing rows have no integer IDs
+        with override_settings(ACTIVITY_INTEGER_OBJECT_IDS=True):
+            self.assertFalse(Action.objects.target(group).exists())
+            call_command('backfill_object_ids', batch_size=2, stdout=StringIO())
+            self.assertEqual(list(Action.objects.target(group).values_list('target_int_id', flat=True)),
+                             [group.pk])
+        self.assertEqual(Action.objects.target(group).count(), 1)
+
+
+class CursorTest(TestCase):
+    def setUp(self):
+        user_type = ContentType.objects.get_for_model(User)
+        user = User.objects.create(username='actor')
+        created = timezone.now()
+        Action.objects.bulk_create([
+            Action(handler='test', actor_content_type=user_type, actor_object_id=user.pk,
+                   created=created - timedelta(minutes=i // 2))
+            for i in range(7)])
+
+    def test_cursor_roundtrip(self):
+        created = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created, 42)), (created, 42))
+        self.assertRaises(InvalidCursor, decode_cursor, 'garbage')
+
+    def test_pages_do_not_overlap(self):
+        seen = []
+        page = paginate(Action.objects.keyset(), 3)
+        while True:
+            seen.extend(item.pk for item in page)
+            if page.next_cursor is None:
+                break
+            page = paginate(Action.objects.keyset(before=page.next_cursor), 3)
+        self.assertEqual(seen, list(Action.objects.order_by('-created', '-pk').values_list('pk', flat=True)))
+
+    def test_polling_after_a_cursor_skips_nothing(self):
+        ordered = list(Action.objects.order_by('-created', '-pk'))
+        feeds = (Action.objects.keyset, Feed(Action.objects.all(), [QuerySetSource(Action.objects.all())]).keyset)
+        for keyset in feeds:
+            seen = []
+            cursor = cursor_for(ordered[-1])
+            while True:
+                page = paginate(keyset(after=cursor), 2)
+                self.assertIsNone(page.next_cursor)
+                if not page:
+                    break
+                seen[:0] = page
+                cursor = page.previous_cursor
+            self.assertEqual(seen, ordered[:-1])
+
+
+class QuerySetFeedTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(QuerySetFeedTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        other = User.objects.create(username='other')
+        group = Group.objects.create(name='group')
+        Follow.objects.follow(self.user, actor)
+        Follow.objects.follow(self.user, group, actor_only=False)
+        self.by_actor = Action.objects.create(handler='test', actor=actor)
+        self.on_group = Action.objects.create(handler='test', actor=other, target=group)
+        self.everyone = Action.objects.create(handler='test', actor=other, is_global=True)
+        Action.objects.create(handler='test', actor=other)
+        Stream.objects.fanout_chunk(self.by_actor, [self.user.pk])
+
+    def test_user_and_stream_are_lazy_querysets(self):
+        with self.assertNumQueries(0):
+            user = Action.objects.user(self.user)
+            stream = Action.objects.stream(self.user)
+        self.assertEqual(set(user), set([self.by_actor, self.on_group]))
+        self.assertEqual(user.count(), 2)
+        with self.settings(ACTIVITY_INTEGER_OBJECT_IDS=True):
+            self.assertEqual(set(Action.objects.user(self.user)), set([self.by_actor, self.on_group]))
+        self.assertTrue(user.filter(target_object_id__isnull=False).exists())
+        self.assertEqual(set(stream), set([self.by_actor, self.everyone]))
+        self.assertFalse(Action.objects.user(User.objects.create(username='nobody')))
+        self.assertEqual([item.pk for item in Action.objects.stream_feed(self.user)],
+                         [item.pk for item in stream.order_by('-created', '-pk')])
+
+
+class BulkLogTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(BulkLogTest, self).setUp()
+        self.actor = User.objects.create(username='actor')
+        self.events = [{'handler': 'test', 'actor': self.actor, 'target': Group.objects.create(name='group%d' % i)}
+                       for i in range(3)]
+        self.events.append({'handler': 'unregistered', 'actor': self.actor})
+
+    def log_many(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as context:
+                actions = Action.objects.log_many(self.events)
+        inserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO "%s"' % Action._meta.db_table)]
+        return actions, len(inserts), len(callbacks)
+
+    def test_actions_are_inserted_by_a_single_statement(self):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            self.skipTest('Database cannot return IDs from bulk inserts')
+        actions, inserts, callbacks = self.log_many()
+        self.assertEqual(inserts, 1)
+        self.assertEqual(callbacks, 1)
+        self.assertEqual([item.target.name for item in actions], ['group0', 'group1', 'group2'])
+        self.assertTrue(all(item.pk for item in actions))
+
+    def test_actions_are_saved_one_by_one_without_returned_ids(self):
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            actions, inserts, callbacks = self.log_many()
+        self.assertEqual(inserts, 3)
+        # Fan-out is still queued once for all actions, not per save
+        self.assertEqual(callbacks, 1)
+        self.assertEqual(set(Action.objects.values_list('pk', flat=True)), set(item.pk for item in actions))
+
+    def test_buffered_signals_are_logged_when_the_outermost_block_exits(self):
+        with buffered_actions():
+            with buffered_actions():
+                for event in self.events:
+                    action_signal.send(sender=None, **event)
+            self.assertFalse(Action.objects.exists())
+        self.assertEqual(Action.objects.filter(actor_object_id=self.actor.pk).count(), 3)
+
+        try:
+            with buffered_actions():
+                action_signal.send(sender=None, **self.events[0])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Action.objects.count(), 3)
+
+
+class LocalFeedBackendTest(TestCase):
+    def setUp(self):
+        self.backend = RedisFeedBackend(local=True, max_length=5)
+        user_type = ContentType.objects.get_for_model(User)
+        self.user = User.objects.create(username='actor')
+        created = timezone.now()
+        Action.objects.bulk_create([
+            Action(handler='test', actor_content_type=user_type, actor_object_id=self.user.pk,
+                   created=created - timedelta(minutes=i // 2))
+            for i in range(7)])
+        self.actions = list(Action.objects.order_by('-created', '-pk'))
+
+    def test_range_is_capped_and_ordered(self):
+        for action in self.actions[:5]:
+            self.assertEqual(self.backend.add(action, [self.user.pk]), 1)
+        self.assertEqual(self.backend.add(self.actions[0], [self.user.pk]), 0)
+        # Older than the whole capped stream, trimmed right away
+        self.assertEqual(self.backend.add(self.actions[5], [self.user.pk]), 0)
+        other = User.objects.create(username='other')
+        self.assertEqual(self.backend.insert(self.actions[-1], [self.user.pk, other.pk]), [other.pk])
+
+        keys = [(item.created, item.pk) for item in self.actions[:5]]
+        self.assertEqual(self.backend.range(self.user.pk), keys)
+        self.assertEqual(self.backend.range(self.user.pk, 2, before=cursor_for(self.actions[1])), keys[2:4])
+        self.assertEqual(self.backend.range(self.user.pk, 1, after=cursor_for(self.actions[2])), keys[1:2])
+
+
+class StreamFilterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        created = timezone.now()
+        self.actions = []
+        for i in range(9):
+            item = Action.objects.create(handler='test' if i % 3 == 0 else 'other', actor=actor,
+                                         created=created - timedelta(minutes=i))
+            Stream.objects.fanout_chunk(item, [self.user.pk])
+            self.actions.append(item)
+        # Made private without updating the stream
+        Action.objects.filter(pk=self.actions[0].pk).update(public=False)
+
+    def test_filtered_pages_are_full(self):
+        page = paginate(Action.objects.stream_feed(self.user, handler='test'), 1)
+        self.assertEqual(list(page), [self.actions[3]])
+        page = paginate(Action.objects.stream_feed(self.user, handler='test', before=page.next_cursor), 1)
+        self.assertEqual(list(page), [self.actions[6]])
+        self.assertIsNone(page.next_cursor)
+
+    @override_settings(ACTIVITY_FEED_MAX_REFILLS=0)
+    def test_pages_cut_short_continue_past_the_keys_read(self):
+        pages = []
+        page = paginate(Action.objects.stream_feed(self.user, handler='test'), 1)
+        while True:
+            pages.append(list(page))
+            if page.next_cursor is None:
+                break
+            page = paginate(Action.objects.stream_feed(self.user, handler='test', before=page.next_cursor), 1)
+        # Every read covers two keys, one of three actions matches
+        self.assertEqual(pages, [[], [self.actions[3]], [], [self.actions[6]], []])
+
+
+class GlobalFeedTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(GlobalFeedTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        stranger = User.objects.create(username='stranger')
+        created = timezone.now()
+        self.actions = []
+        for i in range(6):
+            if i % 2:
+                item = Action.objects.create(handler='test', actor=stranger, is_global=True,
+                                             created=created - timedelta(minutes=i))
+            else:
+                item = Action.objects.create(handler='test', actor=actor, created=created - timedelta(minutes=i))
+                Stream.objects.fanout_chunk(item, [self.user.pk])
+            self.actions.append(item)
+        # Neither global nor in the reader's stream
+        Action.objects.create(handler='test', actor=stranger, created=created)
+
+    def test_global_actions_are_interleaved_by_creation_time(self):
+        page = paginate(Action.objects.stream_feed(self.user), 3)
+        self.assertEqual(list(page), self.actions[:3])
+        page = paginate(Action.objects.stream_feed(self.user, before=page.next_cursor), 3)
+        self.assertEqual(list(page), self.actions[3:])
+        self.assertIsNone(page.next_cursor)
+        self.assertEqual(list(Action.objects.stream(self.user).order_by('-created')), self.actions)
+
+
+@override_settings(ACTIVITY_FANOUT_FOLLOWER_THRESHOLD=1)
+class PulledFeedTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(PulledFeedTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        popular = User.objects.create(username='popular')
+        Follow.objects.follow(self.user, actor)
+        Follow.objects.follow(self.user, popular)
+        created = timezone.now()
+        self.actions = []
+        for i in range(7):
+            if i % 3 == 1:
+                item = Action.objects.create(handler='test', actor=popular, is_pulled=True,
+                                             created=created - timedelta(minutes=i))
+            else:
+                item = Action.objects.create(handler='test', actor=actor, created=created - timedelta(minutes=i))
+                Stream.objects.fanout_chunk(item, [self.user.pk])
+            self.actions.append(item)
+
+    def test_pages_merge_stream_and_pulled_actions(self):
+        seen = []
+        page = paginate(Action.objects.stream_feed(self.user), 2)
+        while True:
+            seen.extend(page)
+            if page.next_cursor is None:
+                break
+            page = paginate(Action.objects.stream_feed(self.user, before=page.next_cursor), 2)
+        self.assertEqual(seen, self.actions)
+        self.assertEqual(set(Action.objects.stream(self.user)), set(self.actions))
+
+        page = paginate(Action.objects.stream_feed(self.user, after=cursor_for(self.actions[3])), 2)
+        self.assertEqual(list(page), self.actions[1:3])
+
+
+class StreamDenormalizationTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(StreamDenormalizationTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        self.action = Action.objects.create(handler='test', actor=actor)
+        Stream.objects.fanout_chunk(self.action, [self.user.pk])
+
+    def assertStreamMatches(self, action):
+        self.assertEqual(Stream.objects.filter(action=action).values_list('created', 'public', 'handler').get(),
+                         (action.created, action.public, action.handler))
+
+    def test_stream_rows_follow_action_changes(self):
+        self.assertStreamMatches(self.action)
+        self.action.created -= timedelta(hours=1)
+        self.action.public = False
+        self.action.handler = 'other'
+        self.action.save()
+        self.assertStreamMatches(self.action)
+        # Private entries stay in the index, feeds leave out their actions
+        self.assertEqual(SQLFeedBackend().range(self.user.pk), [(self.action.created, self.action.pk)])
+        self.assertEqual(list(Action.objects.stream_feed(self.user)), [])
+
+    def test_migration_backfills_rows_in_batches(self):
+        migration = import_module('activity.migrations.0004_stream_denormalized_fields')
+        actor = User.objects.get(username='actor')
+        for i in range(2):
+            Stream.objects.fanout_chunk(Action.objects.create(handler='test', actor=actor), [self.user.pk])
+        Stream.objects.update(created=timezone.now() - timedelta(days=1), public=False, handler='')
+        batch_size = migration.BATCH_SIZE
+        migration.BATCH_SIZE = 1
+        self.addCleanup(setattr, migration, 'BATCH_SIZE', batch_size)
+        # The backfill runs plain SQL, without entering the schema editor
+        migration.backfill_streams(apps, connection.SchemaEditorClass(connection))
+        for action in Action.objects.all():
+            self.assertStreamMatches(action)
+
+
+class TrimStreamsTest(TestCase):
+    def setUp(self):
+        actor = User.objects.create(username='actor')
+        self.users = [User.objects.create(username='reader%d' % i) for i in range(2)]
+        created = timezone.now()
+        for i in range(7):
+            # Pairs share a creation time, ties are broken by action ID
+            item = Action.objects.create(handler='test', actor=actor, created=created - timedelta(minutes=i // 2))
+            Stream.objects.fanout_chunk(item, [user.pk for user in self.users])
+        self.newest = list(Action.objects.order_by('-created', '-pk').values_list('pk', flat=True)[:3])
+
+    def assertNewestKept(self):
+        for user in self.users:
+            self.assertEqual(list(Stream.objects.filter(user=user).order_by('-created', '-action')
+                                  .values_list('action', flat=True)), self.newest)
+
+    def test_streams_are_trimmed_in_batches(self):
+        with CaptureQueriesContext(connection) as context:
+            removed = Stream.objects.trim([user.pk for user in self.users], 3, batch_size=3)
+        self.assertEqual(removed, 8)
+        deletes = [query for query in context.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 4)
+        self.assertNewestKept()
+        self.assertEqual(Stream.objects.trim([user.pk for user in self.users], 3), 0)
+
+    def test_task_and_command(self):
+        self.assertEqual(trim_streams(), 0)
+        with self.settings(ACTIVITY_STREAM_MAX_LENGTH=5):
+            self.assertEqual(trim_streams(chunk_size=1, batch_size=1), 4)
+        out = StringIO()
+        call_command('trim_streams', max_length=3, chunk_size=1, batch_size=2, stdout=out)
+        self.assertIn('Removed 4 stream entries', out.getvalue())
+        self.assertNewestKept()
+
+
+class RacingFeedBackend(SQLFeedBackend):
+    """
+    Misses existing entries, as if another task wrote them after the lookup
+    """
+    def get_queryset(self):
+        return super(RacingFeedBackend, self).get_queryset().none()
+
+
+class SQLFeedBackendTest(TestCase):
+    def test_entries_written_by_others_are_not_reported(self):
+        users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        action = Action.objects.create(handler='test', actor=users[0])
+        self.assertEqual(SQLFeedBackend().insert(action, [users[1].pk]), [users[1].pk])
+        self.assertEqual(RacingFeedBackend().insert(action, [user.pk for user in users]),
+                         [users[0].pk, users[2].pk])
+        self.assertEqual(Stream.objects.filter(action=action).count(), 3)
+
+
+class CountingHandler(ActionHandler):
+    fragment_models = ('auth.Group',)
+    rendered = 0
+    batches = 0
+
+    def get_context_data_many(self, items):
+        CountingHandler.batches += 1
+        CountingHandler.rendered += len(items)
+        return super(CountingHandler, self).get_context_data_many(items)
+
+
+@override_settings(ACTIVITY_RENDER_CACHE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RenderCacheTest(HandlersMixin, TestCase):
+    handlers = {'test': CountingHandler}
+
+    def setUp(self):
+        super(RenderCacheTest, self).setUp()
+        CountingHandler.rendered = CountingHandler.batches = 0
+        self.group = Group.objects.create(name='group')
+        self.user = User.objects.create(username='actor')
+        for i in range(3):
+            Action.objects.create(handler='test', actor_content_type=ContentType.objects.get_for_model(User),
+                                  actor_object_id=self.user.pk,
+                                  target_content_type=ContentType.objects.get_for_model(Group),
+                                  target_object_id=str(self.group.pk))
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_fragments_are_cached_and_invalidated(self):
+        first = activities.public(limit=3)
+        self.assertEqual(CountingHandler.rendered, 3)
+        self.assertEqual(CountingHandler.batches, 1)
+        self.assertEqual(activities.public(limit=3), first)
+        self.assertEqual(CountingHandler.rendered, 3)
+        self.assertNotIn(SINCE_PLACEHOLDER, first[0])
+
+        # Changes of other models don't look for actions
+        with self.assertNumQueries(1):
+            self.user.save()
+        self.group.name = 'renamed'
+        self.group.save()
+        page = activities.public(limit=3)
+        self.assertEqual(CountingHandler.rendered, 6)
+        self.assertIn('renamed', page[0])
+
+    def test_handlers_without_fragment_models_are_not_cached(self):
+        activityregistry.handlers['test'].fragment_models = None
+        activities.public(limit=3)
+        self.group.name = 'renamed'
+        self.group.save()
+        self.assertIn('renamed', activities.public(limit=3)[0])
+        self.assertEqual(CountingHandler.rendered, 6)
+
+    def test_handlers_render_pages_in_batches(self):
+        with self.settings(ACTIVITY_RENDER_CACHE=False):
+            page = activities.public(limit=3)
+        self.assertEqual(page, [activityregistry.handlers['test'].render(item)
+                                for item in Action.objects.order_by('-created', '-pk')])
+        self.assertEqual(CountingHandler.batches, 1)
+
+
+class FollowBackfillTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='follower')
+        self.actor = User.objects.create(username='actor')
+        self.actors = [(ContentType.objects.get_for_model(User).pk, self.actor.pk)]
+        created = timezone.now()
+        Action.objects.bulk_create([
+            Action(handler='test', actor_content_type_id=self.actors[0][0], actor_object_id=self.actor.pk,
+                   created=created - timedelta(minutes=i))
+            for i in range(3)])
+
+    @override_settings(ACTIVITY_BACKFILL_LIMIT=2)
+    def test_backfill_and_purge(self):
+        # Only followed actors are copied
+        self.assertEqual(backfill_stream(self.user.pk, self.actors), 0)
+        Follow.objects.follow(self.user, self.actor)
+        self.assertEqual(backfill_stream(self.user.pk, self.actors), 2)
+        self.assertEqual(backfill_stream(self.user.pk, self.actors), 0)
+        self.assertEqual([item.pk for item in Action.objects.stream(self.user)],
+                         list(Action.objects.order_by('-created').values_list('pk', flat=True)[:2]))
+
+        self.assertEqual(purge_stream(self.user.pk, self.actors), 0)
+        self.assertEqual(Follow.objects.unfollow(self.user, self.actor), 1)
+        self.assertEqual(purge_stream(self.user.pk, self.actors), 2)
+        self.assertEqual(list(Action.objects.stream(self.user)), [])
+
+
+class FollowManyTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='follower')
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        self.groups = [Group.objects.create(name='group%d' % i) for i in range(2)]
+
+    def test_follow_many_and_memo(self):
+        self.assertEqual(Follow.objects.follow_many(self.user, self.users[:2] + self.groups[:1]), 3)
+        self.assertEqual(Follow.objects.follow_many(self.user, self.users[:2]), 0)
+
+        user = User.objects.get(pk=self.user.pk)
+        targets = self.users + self.groups
+        with self.assertNumQueries(2):
+            following = Follow.objects.is_following_many(user, targets)
+        self.assertEqual([following[target] for target in targets], [True, True, False, True, False])
+        with self.assertNumQueries(0):
+            self.assertTrue(Follow.objects.is_following(user, self.users[0]))
+
+        self.assertEqual(Follow.objects.unfollow_many(user, self.users), 2)
+        self.assertFalse(Follow.objects.is_following(user, self.users[0]))
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+
+
+class FollowCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='follower')
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        self.groups = [Group.objects.create(name='group%d' % i) for i in range(2)]
+
+    def test_counters_follow_single_and_bulk_changes(self):
+        Follow.objects.follow(self.user, self.users[0])
+        Follow.objects.follow_many(self.user, self.users[1:] + self.groups)
+        Follow.objects.follow(self.users[0], self.groups[0])
+        self.assertEqual(FollowCount.objects.for_object(self.user).following, 5)
+        self.assertEqual(FollowCount.objects.for_object(self.groups[0]).followers, 2)
+
+        Follow.objects.unfollow(self.user, self.groups[0])
+        Follow.objects.unfollow_many(self.user, self.users[:2])
+        self.assertEqual(FollowCount.objects.for_object(self.user).following, 2)
+        self.assertEqual(FollowCount.objects.for_object(self.groups[0]).followers, 1)
+        self.assertEqual(FollowCount.objects.for_object(self.users[0]).followers, 0)
+
+        self.assertEqual(list(Follow.objects.follower_ids(self.groups[1], chunk_size=1)), [self.user.pk])
+        self.assertEqual(len(list(Follow.objects.following_ids(self.user, chunk_size=1))), 2)
+
+
+class UnreadCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        self.actions = [Action.objects.create(handler='test', actor_content_type=ContentType.objects.get_for_model(User),
+                                              actor_object_id=actor.pk) for i in range(3)]
+
+    def test_counter_is_incremented_once_and_reset_on_read(self):
+        for action in self.actions[:2]:
+            self.assertEqual(Stream.objects.fanout_chunk(action, [self.user.pk]), 1)
+        # Repeated fan-out doesn't count again
+        self.assertEqual(Stream.objects.fanout_chunk(self.actions[0], [self.user.pk]), 0)
+        self.assertEqual(Stream.objects.unread_count(self.user), 2)
+
+        Stream.objects.mark_seen(self.user)
+        self.assertEqual(Stream.objects.unread_count(self.user), 0)
+        Action.objects.filter(pk=self.actions[2].pk).update(is_global=True, created=timezone.now() + timedelta(1))
+        self.assertEqual(Stream.objects.unread_count(self.user), 1)
+
+
+class LikeHandler(ActionHandler):
+    verb = 'liked'
+    aggregate_window = timedelta(hours=1)
+    aggregate_sample_size = 2
+
+
+class AggregationTest(HandlersMixin, TestCase):
+    handlers = {'like': LikeHandler}
+
+    def setUp(self):
+        super(AggregationTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        self.group = Group.objects.create(name='group')
+        created = timezone.now() - timedelta(minutes=10)
+        self.actions = []
+        for i in range(4):
+            actor = User.objects.create(username='fan%d' % i)
+            action = Action(handler='like', actor_content_type=ContentType.objects.get_for_model(User),
+                            actor_object_id=actor.pk, target_content_type=ContentType.objects.get_for_model(Group),
+                            target_object_id=str(self.group.pk), created=created + timedelta(minutes=i))
+            Action.objects.bulk_create([action])
+            self.actions.append(Action.objects.order_by('-pk')[0])
+
+    def test_similar_actions_share_an_entry(self):
+        for action in self.actions:
+            self.assertEqual(Stream.objects.fanout_chunk(action, [self.user.pk]), 1)
+        self.assertEqual(Stream.objects.fanout_chunk(self.actions[-1], [self.user.pk]), 0)
+        self.assertEqual(Stream.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Stream.objects.unread_count(self.user), 4)
+
+        items = list(Action.objects.stream_feed(self.user))
+        self.assertEqual([item.pk for item in items], [self.actions[-1].pk])
+        self.assertEqual(items[0].group_size, 4)
+        self.assertEqual(items[0].group_sample, [self.actions[3], self.actions[2]])
+        html = activities.render(items[0])
+        self.assertIn('fan3', html)
+        self.assertIn('and 2 others', html)
+
+    def test_late_and_replayed_actions_are_merged_once(self):
+        for action in [self.actions[1], self.actions[0]] + self.actions[2:]:
+            self.assertEqual(Stream.objects.fanout_chunk(action, [self.user.pk]), 1)
+        # Rolled out of the sample
+        self.assertEqual(Stream.objects.fanout_chunk(self.actions[0], [self.user.pk]), 0)
+        self.assertEqual(list(Stream.objects.filter(user=self.user).values_list('action', 'group_size', 'group_sample')),
+                         [(self.actions[3].pk, 4, '%d,%d' % (self.actions[3].pk, self.actions[2].pk))])
+
+    def test_backfilled_actions_are_merged(self):
+        Stream.objects.fanout_chunk(self.actions[0], [self.user.pk])
+        for action in self.actions:
+            Follow.objects.follow(self.user, action.actor)
+        backfill_stream(self.user.pk, [(action.actor_content_type_id, action.actor_object_id)
+                                       for action in self.actions])
+        call_command('rebuild_streams', stdout=StringIO())
+        self.assertEqual(list(Stream.objects.filter(user=self.user).values_list('action', 'group_size')),
+                         [(self.actions[3].pk, 4)])
+
+        # Plain entries of the action are kept as they are
+        other = User.objects.create(username='other')
+        SQLFeedBackend().add_actions(other.pk, [self.actions[3]])
+        Stream.objects.fanout_chunk(self.actions[2], [other.pk])
+        self.assertEqual(Stream.objects.fanout_chunk(self.actions[3], [other.pk]), 0)
+        self.assertEqual(sorted(Stream.objects.filter(user=other).values_list('action', 'group_size')),
+                         [(self.actions[2].pk, 1), (self.actions[3].pk, 1)])
+
+    def test_removed_heads_keep_the_rest_of_the_entry(self):
+        activityregistry.handlers['like'].aggregate_sample_size = 3
+        for action in self.actions:
+            Stream.objects.fanout_chunk(action, [self.user.pk])
+
+        def entry():
+            return Stream.objects.filter(user=self.user).values_list('action', 'group_size', 'group_sample').get()
+
+        # Unliked
+        self.actions[3].delete()
+        self.assertEqual(entry(), (self.actions[2].pk, 3, '%d,%d' % (self.actions[2].pk, self.actions[1].pk)))
+        # Unfollowed
+        purge_stream(self.user.pk, [(self.actions[2].actor_content_type_id, self.actions[2].actor_object_id)])
+        self.assertEqual(entry(), (self.actions[1].pk, 2, str(self.actions[1].pk)))
+
+
+@override_settings(ACTIVITY_FANOUT_CHUNK_SIZE=2, ACTIVITY_FANOUT_BATCH_SIZE=1)
+class ChunkedFanoutTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(ChunkedFanoutTest, self).setUp()
+        current_app.conf.task_always_eager = True
+        self.addCleanup(setattr, current_app.conf, 'task_always_eager', False)
+        self.actor = User.objects.create(username='actor')
+        self.users = [User.objects.create(username='user%d' % i) for i in range(5)]
+        for user in self.users:
+            Follow.objects.follow(user, self.actor)
+        self.action = Action.objects.create(handler='test', actor=self.actor)
+        self.sent = []
+        for signal in (pre_fanout, fanout_progress, post_fanout):
+            signal.connect(self.receiver)
+            self.addCleanup(signal.disconnect, self.receiver)
+
+    def receiver(self, signal, **kwargs):
+        self.sent.append(signal)
+
+    def test_chunks_run_without_result_backend_and_signal_once(self):
+        self.assertEqual(list(fanout_chunks(self.action, 2)), [
+            (0, self.users[1].pk), (self.users[1].pk, self.users[3].pk), (self.users[3].pk, None)])
+        fanout_action(self.action.pk)
+        self.assertEqual(self.sent, [pre_fanout] + [fanout_progress] * 3 + [post_fanout])
+        self.assertEqual(Stream.objects.filter(action=self.action).count(), 5)
+        self.assertFalse(FanoutCheckpoint.objects.exists())
+
+        # A chunk delivered again after the job finished does nothing
+        self.assertEqual(fanout_chunk(self.action.pk, 0, self.users[1].pk, 1, 3), 0)
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual([Stream.objects.unread_count(user) for user in self.users], [1] * 5)
+
+    @override_settings(ACTIVITY_FEED_BACKEND='activity.tests.InterruptedFeedBackend')
+    def test_interrupted_jobs_resume_from_checkpoints(self):
+        InterruptedFeedBackend.inserted = []
+        InterruptedFeedBackend.fail_user_id = self.users[3].pk
+        fanout_action(self.action.pk)
+        # The second chunk stopped after its first user
+        self.assertEqual(InterruptedFeedBackend.inserted, [self.users[i].pk for i in (0, 1, 2, 4)])
+        self.assertEqual(list(FanoutCheckpoint.objects.filter(completed=False).values_list('position', flat=True)),
+                         [self.users[2].pk])
+        self.assertNotIn(post_fanout, self.sent)
+
+        InterruptedFeedBackend.inserted = []
+        InterruptedFeedBackend.fail_user_id = None
+        fanout_action(self.action.pk)
+        self.assertEqual(InterruptedFeedBackend.inserted, [self.users[3].pk])
+        self.assertEqual(self.sent.count(post_fanout), 1)
+        self.assertFalse(FanoutCheckpoint.objects.exists())
+        self.assertEqual(Stream.objects.filter(action=self.action).count(), 5)
+        self.assertEqual([Stream.objects.unread_count(user) for user in self.users], [1] * 5)
+
+
+class InterruptedFeedBackend(SQLFeedBackend):
+    """
+    Fails writing the entry of ``fail_user_id`` and records written users
+    """
+    fail_user_id = None
+    inserted = []
+
+    def insert(self, action, user_ids, batch_size=500):
+        if self.fail_user_id in user_ids:
+            raise RuntimeError('Interrupted')
+        added = super(InterruptedFeedBackend, self).insert(action, user_ids, batch_size)
+        self.inserted.extend(added)
+        return added
+
+
+@override_settings(ACTIVITY_METRICS_BACKEND='activity.metrics.MemoryMetrics')
+class MetricsTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        actor = User.objects.create(username='actor')
+        self.action = Action.objects.create(handler='test', actor_object_id=actor.pk,
+                                            actor_content_type=ContentType.objects.get_for_model(User))
+        self.metrics = get_metrics()
+
+    def test_fanout_feed_and_render_are_reported(self):
+        Stream.objects.fanout_chunk(self.action, [self.user.pk], batch_size=1)
+        self.assertEqual(self.metrics.count('activity.fanout.rows', handler='test'), 1)
+        self.assertEqual(self.metrics.count('activity.fanout.batches'), 1)
+        self.assertEqual(len(self.metrics.durations('activity.fanout.duration', handler='test')), 1)
+
+        activities.stream(self.user, mark_seen=False)
+        self.assertEqual(self.metrics.count('activity.feed.items', feed='stream'), 1)
+        self.assertEqual(len(self.metrics.durations('activity.feed.duration', feed='stream')), 1)
+        self.assertEqual(self.metrics.count('activity.render.items', handler='test'), 1)
+
+
+@override_settings(ACTIVITY_READ_DATABASES=['replica'], DATABASE_ROUTERS=['activity.routers.ActivityRouter'],
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'activity-pins'}})
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.actor = User.objects.create(username='actor')
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_reads_use_replica_until_user_writes(self):
+        self.assertEqual(read_database(self.user), 'replica')
+        self.assertEqual(Action.objects.stream_feed(self.user).queryset.db, 'replica')
+
+        Follow.objects.follow(self.user, self.actor)
+        self.assertEqual(Action.objects.user_feed(self.user).queryset.db, 'default')
+        self.assertEqual(Action.objects.stream_feed(self.user).queryset.db, 'default')
+        # Others still read from the replica, writes go to the primary
+        self.assertEqual(read_database(self.actor), 'replica')
+        action = Action(handler='test', actor_content_type=ContentType.objects.get_for_model(User),
+                        actor_object_id=self.actor.pk)
+        action._state.db = 'replica'
+        action.save()
+        self.assertEqual(action._state.db, 'default')
+        self.assertEqual(read_database(self.actor), 'default')
+        self.assertEqual(list(Action.objects.user(self.user)), [action])
+
+
+class ReplicaReadRouter(object):
+    def db_for_read(self, model, **hints):
+        return 'replica'
+
+
+@override_settings(DATABASE_ROUTERS=['activity.tests.ReplicaReadRouter'])
+class ProjectRoutingTest(TestCase):
+    databases = {'default', 'replica'}
+
+    def test_reads_are_left_to_project_routers_without_replicas(self):
+        user = User.objects.create(username='reader')
+        self.assertIsNone(read_database(user))
+        self.assertEqual(Action.objects.stream_feed(user).queryset.db, 'replica')
+        self.assertEqual(Action.objects.user_feed(user).queryset.db, 'replica')
+        self.assertEqual(Action.objects.user(user).db, 'replica')
+
+
+class AsyncFeedTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(AsyncFeedTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        for i in range(5):
+            actor = User.objects.create(username='user%d' % i)
+            group = Group.objects.create(name='group%d' % i)
+            Follow.objects.follow(self.user, actor)
+            item = Action.objects.create(handler='test', actor=actor, target=group)
+            Stream.objects.fanout_chunk(item, [self.user.pk])
+
+    def test_async_pages_match_sync_pages(self):
+        # Thread sensitive calls come back to this thread and its connection
+        self.assertEqual(async_to_sync(activities.astream)(self.user, limit=3, mark_seen=False),
+                         activities.stream(self.user, limit=3, mark_seen=False))
+        self.assertEqual(async_to_sync(activities.auser)(self.user, limit=3),
+                         activities.user(self.user, limit=3))
+        page = async_to_sync(activities.apublic)(limit=3, render=False)
+        self.assertEqual(page, list(Action.objects.order_by('-created', '-pk')[:3]))
+        self.assertEqual(page.next_cursor, activities.public(limit=3, render=False).next_cursor)
+        # Generic relations were loaded with the page
+        with self.assertNumQueries(0):
+            for item in page:
+                self.assertTrue(item.actor.username.startswith('user'))
+                self.assertTrue(item.target.name.startswith('group'))
+
+
+class ArchiveTest(HandlersMixin, TestCase):
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        self.user = User.objects.create(username='reader')
+        self.actor = User.objects.create(username='actor')
+        Follow.objects.follow(self.user, self.actor)
+        now = timezone.now()
+        self.actions = []
+        for days in (0, 200, 300):
+            item = Action.objects.create(handler='test', actor=self.actor, created=now - timedelta(days))
+            Stream.objects.fanout_chunk(item, [self.user.pk])
+            self.actions.append(item)
+
+    def test_old_actions_are_moved_and_readable_on_request(self):
+        out = StringIO()
+        call_command('archive_activity', days=100, batch_size=1, stdout=out)
+        self.assertIn('Archived 2 actions and 2 stream entries', out.getvalue())
+        self.assertEqual(list(Action.objects.all()), self.actions[:1])
+        self.assertEqual(ArchivedStream.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(list(ArchivedAction.objects.values_list('pk', flat=True)),
+                         [item.pk for item in self.actions[1:]])
+
+        self.assertEqual(list(Action.objects.stream(self.user)), self.actions[:1])
+        for feed in (Action.objects.stream_feed(self.user, archived=True), Action.objects.user_feed(self.user, archived=True),
+                     Action.objects.with_archive(actor_object_id=self.actor.pk)):
+            self.assertEqual([item.pk for item in feed], [item.pk for item in self.actions])
+        page = activities.user(self.user, limit=2, archived=True)
+        self.assertEqual(len(page), 2)
+
+
+class MentionHandler(ActionHandler):
+    def fanout_extra_targets(self, item):
+        return [int(item.target_object_id)]
+
+
+class RebuildStreamsTest(HandlersMixin, TestCase):
+    handlers = {'test': ActionHandler, 'like': LikeHandler}
+
+    def setUp(self):
+        super(RebuildStreamsTest, self).setUp()
+        self.users = [User.objects.create(username='user%d' % i) for i in range(4)]
+        self.actor = User.objects.create(username='actor')
+        for user in self.users[:3]:
+            Follow.objects.follow(user, self.actor)
+        now = timezone.now()
+        self.old = Action.objects.create(handler='test', actor=self.actor, created=now - timedelta(10))
+        self.likes = [Action.objects.create(handler='like', actor=self.actor, target=self.users[3],
+                                            created=now - timedelta(minutes=i)) for i in (2, 1)]
+
+    def test_streams_are_rebuilt_by_partition_and_resumed(self):
+        Stream.objects.fanout_chunk(self.likes[0], [self.users[0].pk])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        state = os.path.join(directory, 'state.json')
+        since = (timezone.now() - timedelta(1)).isoformat()
+        out = StringIO()
+        call_command('rebuild_streams', since=since, partition_size=2, state=state, stdout=out)
+        # The liked entries are merged, the old action is out of range
+        self.assertEqual(sorted(Stream.objects.values_list('user', 'action', 'group_size')),
+                         [(user.pk, self.likes[1].pk, 2) for user in self.users[:3]])
+        self.assertIn('Rebuilt 3 partitions', out.getvalue())
+
+        call_command('rebuild_streams', since=since, partition_size=2, state=state, stdout=out)
+        self.assertIn('Nothing to rebuild', out.getvalue())
+
+        call_command('rebuild_streams', users='%d' % self.users[1].pk, stdout=out)
+        self.assertEqual(list(Stream.objects.filter(action=self.old).values_list('user', flat=True)),
+                         [self.users[1].pk])
+        self.assertEqual(Stream.objects.unread_count(self.users[1]), 0)
+
+    def test_extra_targets_are_rebuilt_once_for_all_partitions(self):
+        activityregistry.handlers['mention'] = MentionHandler()
+        self.addCleanup(activityregistry.handlers.pop, 'mention')
+        mention = Action.objects.create(handler='mention', actor=self.actor, target=self.users[3])
+        out = StringIO()
+        call_command('rebuild_streams', partition_size=2, verbosity=2, stdout=out)
+        self.assertIn('Rebuilt extra targets: 1 entries', out.getvalue())
+        self.assertIn('Rebuilt 4 partitions', out.getvalue())
+        self.assertEqual(sorted(Stream.objects.filter(action=mention).values_list('user', flat=True)),
+                         [user.pk for user in self.users])
@@ -1,13 +1,17 @@
-from activity.models import Action
+from activity import cache as fragment_cache
+from activity.aio import AsyncActivitiesMixin
+from activity.metrics import timed
+from activity.models import Action, ArchivedAction, Stream
+from activity.pagination import Page, paginate
 from activity.registry import activityregistry
 
 
-class ActivitiesView(object):
+class ActivitiesView(AsyncActivitiesMixin):
     def render(self, item):
         """
         Render activities recursively
         """
-        if not isinstance(item, Action):
+        if not isinstance(item, (Action, ArchivedAction)):
             output = []
             for value in item:
                 output.append(self.render(value))
@@ -15,38 +19,72 @@ class ActivitiesView(object):
         else:
             try:
                 handlers = activityregistry.get_handlers()
-                return handlers[item.handler].render(item)
+                handler = handlers[item.handler]
             except KeyError:
                 from django.conf import settings
                 if settings.DEBUG:
                     return 'No handler available for %s' % item.handler
                 return ''
+            with timed('activity.render', {'handler': item.handler}):
+                return handler.render(item)
 
-    def public(self, public=True, limit=10, render=True):
+    def render_page(self, items):
+        """
+        Render a page of activities calling each handler once. Fragments
+        are read from the render cache in one round trip when
+        ``ACTIVITY_RENDER_CACHE`` is on.
+        """
+        handlers = activityregistry.get_handlers()
+        known = [item for item in items if item.handler in handlers]
+        if fragment_cache.is_enabled():
+            output = fragment_cache.render_many(known)
+        else:
+            output = activityregistry.render_many(known)
+        rendered = dict(zip((item.pk for item in known), output))
+        return [rendered[item.pk] if item.pk in rendered else self.render(item) for item in items]
+
+    def paginate(self, queryset, limit=10, render=True):
+        """
+        Get a page of activities. Returned page carries ``next_cursor`` and
+        ``previous_cursor`` to fetch the neighbouring pages.
+        """
+        page = paginate(queryset.with_objects(), limit)
+        if render:
+            return Page(self.render_page(page), page.next_cursor, page.previous_cursor)
+        return page
+
+    def public(self, public=True, limit=10, render=True, before=None, after=None):
         """
         Get public activities
         """
         if public:
-            result = Action.objects.public()[:limit]
+            queryset = Action.objects.public()
         else:
-            result = Action.objects.private()[:limit]
-        if render:
-            return self.render(result)
-        return result
+            queryset = Action.objects.private()
+        return self.paginate(queryset.replica().keyset(before, after), limit, render)
 
-    def private(self, public=False, limit=10, render=True):
+    def private(self, public=False, limit=10, render=True, before=None, after=None):
         """
         Get private activities
         """
-        return self.public(public, limit, render)
+        return self.public(public, limit, render, before, after)
 
-    def user(self, user, limit=10, render=True):
+    def user(self, user, limit=10, render=True, before=None, after=None, archived=False):
         """
         Get actions from objects that the given user is following
         """
-        result = Action.objects.user(user)[:limit]
-        if render:
-            return self.render(result)
-        return result
+        queryset = Action.objects.user_feed(user, before=before, after=after, archived=archived)
+        return self.paginate(queryset, limit, render)
+
+    def stream(self, user, limit=10, render=True, before=None, after=None, mark_seen=True, archived=False):
+        """
+        Get actions from the user specific stream. Reading the newest page
+        resets the user's unread counter unless ``mark_seen`` is False.
+        """
+        queryset = Action.objects.stream_feed(user, before=before, after=after, archived=archived)
+        page = self.paginate(queryset, limit, render)
+        if mark_seen and before is None:
+            Stream.objects.mark_seen(user)
+        return page
 
 activities = ActivitiesView()
@@ -0,0 +1,9 @@
+"""
+Benchmarks of fan-out, feed reads, rendering and follow operations on a
+synthetic social graph.
+
+    python -m benchmarks [--database sqlite|postgresql] [--users 1000] [--output results.json]
+
+Results are written as JSON, so runs on different commits can be compared
+with ``python -m benchmarks.compare old.json new.json``.
+"""
@@ -0,0 +1,48 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare old.json new.json
+"""
+from __future__ import print_function
+
+import json
+import sys
+
+
+METRICS = ('median_ms', 'queries', 'actions_per_second')
+
+
+def flatten(results, prefix=''):
+    for name, value in sorted(results.items()):
+        if isinstance(value, dict):
+            for item in flatten(value, '%s%s.' % (prefix, name)):
+                yield item
+        elif name in METRICS:
+            yield '%s%s' % (prefix, name), value
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    with open(argv[0]) as f:
+        old = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+
+    print('%s -> %s' % (old['meta'].get('commit'), new['meta'].get('commit')))
+    if old['params'] != new['params']:
+        print('Warning: runs used different parameters', file=sys.stderr)
+    old_values = dict(flatten(old['results']))
+    for name, value in flatten(new['results']):
+        before = old_values.get(name)
+        change = ''
+        if before:
+            change = '%+.1f%%' % ((value - before) * 100.0 / before)
+        print('%-60s %12s %12s %9s' % (name, before if before is not None else '-', value, change))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Synthetic social graph: users follow each other with a power-law
+distribution, so a few actors have most of the followers, and post a mix
+of action types.
+"""
+import bisect
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.utils import timezone
+
+from activity.models import Action, Follow, FollowCount
+from activity.registry import ActionHandler, activityregistry
+
+
+class LikeHandler(ActionHandler):
+    verb = 'liked'
+    aggregate_window = timedelta(hours=1)
+
+
+# Handler ID, handler and share of actions
+ACTION_TYPES = (
+    ('benchmark.post', ActionHandler(), 0.6),
+    ('benchmark.like', LikeHandler(), 0.3),
+    ('benchmark.comment', ActionHandler(), 0.1),
+)
+
+
+def register_handlers():
+    for handler_id, handler, share in ACTION_TYPES:
+        activityregistry.handlers.setdefault(handler_id, handler)
+
+
+class WeightedChoice(object):
+    """
+    Choose items with the given weights in O(log n)
+    """
+    def __init__(self, items, weights, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.totals = []
+        total = 0
+        for weight in weights:
+            total += weight
+            self.totals.append(total)
+
+    def __call__(self):
+        return self.items[bisect.bisect(self.totals, self.rng.random() * self.totals[-1])]
+
+    def sample(self, count):
+        """
+        Return ``count`` distinct items
+        """
+        count = min(count, len(self.items))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.add(self())
+        return chosen
+
+
+class Graph(object):
+    """
+    Generate a graph into the database.
+
+    Popularity of the n-th user is proportional to ``n ** -alpha``, and so
+    is the chance of being followed. Follow counts of users are drawn from
+    a lognormal distribution around ``mean_follows``.
+    """
+    def __init__(self, users=1000, mean_follows=20, alpha=1.0, actions=5000, objects=100,
+                 days=7, seed=0, batch_size=500):
+        self.users = users
+        self.mean_follows = mean_follows
+        self.alpha = alpha
+        self.actions = actions
+        self.objects = objects
+        self.days = days
+        self.seed = seed
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+
+    def params(self):
+        return dict((name, getattr(self, name)) for name in (
+            'users', 'mean_follows', 'alpha', 'actions', 'objects', 'days', 'seed'))
+
+    def generate(self):
+        register_handlers()
+        self.bulk_create(User, [User(username='user%d' % i) for i in range(self.users)])
+        self.bulk_create(Group, [Group(name='object%d' % i) for i in range(self.objects)])
+        self.user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        self.object_ids = list(Group.objects.order_by('pk').values_list('pk', flat=True))
+        self.user_type = ContentType.objects.get_for_model(User)
+        self.object_type = ContentType.objects.get_for_model(Group)
+
+        weights = [(rank + 1) ** -self.alpha for rank in range(len(self.user_ids))]
+        self.popular = WeightedChoice(self.user_ids, weights, self.rng)
+        self.generate_follows()
+        self.generate_actions()
+        return self
+
+    def generate_follows(self):
+        follows = []
+        for user_id in self.user_ids:
+            # Mean of lognormvariate(0, 1) is e ** 0.5
+            count = int(self.rng.lognormvariate(0, 1) * self.mean_follows / 1.6487)
+            for object_id in self.popular.sample(count):
+                if object_id != user_id:
+                    follows.append(Follow(user_id=user_id, content_type=self.user_type, object_id=object_id))
+        self.bulk_create(Follow, follows)
+        # Counters aren't maintained by bulk_create
+        FollowCount.objects.recount([(self.user_type.pk, user_id) for user_id in self.user_ids])
+
+    def generate_actions(self):
+        handlers = WeightedChoice([handler_id for handler_id, handler, share in ACTION_TYPES],
+                                  [share for handler_id, handler, share in ACTION_TYPES], self.rng)
+        now = timezone.now()
+        span = self.days * 24 * 60 * 60
+        actions = []
+        for i in range(self.actions):
+            handler_id = handlers()
+            action = Action(handler=handler_id, actor_content_type=self.user_type,
+                            actor_object_id=self.popular(),
+                            created=now - timedelta(seconds=self.rng.random() * span))
+            if handler_id != 'benchmark.post':
+                action.target_content_type = self.object_type
+                action.target_object_id = str(self.rng.choice(self.object_ids))
+            action.set_integer_ids()
+            actions.append(action)
+        self.bulk_create(Action, actions)
+
+    def bulk_create(self, model, objs):
+        # SQLite limits the number of query parameters, Django picks a safe batch size
+        batch_size = None if connection.vendor == 'sqlite' else self.batch_size
+        model.objects.bulk_create(objs, batch_size=batch_size)
+
+    def readers(self, count):
+        """
+        Return users spread over the range of follow counts, most following first
+        """
+        users = list(User.objects.order_by('pk'))
+        following = dict(FollowCount.objects.filter(content_type=self.user_type)
+                         .values_list('object_id', 'following'))
+        users.sort(key=lambda user: following.get(user.pk, 0), reverse=True)
+        step = max(len(users) // count, 1)
+        return users[::step][:count]
@@ -0,0 +1,91 @@
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.settings import configure
+
+
+SUITES = ('fanout', 'user_feed', 'stream_feed', 'render', 'follow', 'user_feed_by_follows')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark django-activity on a synthetic social graph.')
+    parser.add_argument('--database', choices=('sqlite', 'postgresql'), default='sqlite')
+    parser.add_argument('--database-name', default=None,
+                        help='SQLite file or PostgreSQL database, a test database is created from it')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--mean-follows', type=int, default=20)
+    parser.add_argument('--alpha', type=float, default=1.0, help='Exponent of the popularity power law')
+    parser.add_argument('--actions', type=int, default=5000)
+    parser.add_argument('--objects', type=int, default=100, help='Number of like and comment targets')
+    parser.add_argument('--readers', type=int, default=10, help='Users whose feeds are read')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help='Suite to run, may be repeated. Runs all by default.')
+    parser.add_argument('--output', default=None, help='JSON file for results, stdout by default')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args.database, args.database_name)
+
+    import django
+    from django.db import connection
+
+    from benchmarks import suites
+    from benchmarks.graph import Graph
+
+    test_db = connection.creation.create_test_db(verbosity=0)
+    try:
+        graph = Graph(users=args.users, mean_follows=args.mean_follows, alpha=args.alpha,
+                      actions=args.actions, objects=args.objects, seed=args.seed)
+        start = time.time()
+        graph.generate()
+        generated = time.time() - start
+        readers = graph.readers(args.readers)
+
+        results = {}
+        # Fan-out fills the streams, so it runs first whenever streams are read
+        selected = args.suite or SUITES
+        if 'stream_feed' in selected or 'render' in selected:
+            selected = set(selected) | set(['fanout'])
+        for name in SUITES:
+            if name not in selected:
+                continue
+            print('Running %s' % name, file=sys.stderr)
+            results[name] = getattr(suites, name)(graph, readers)
+    finally:
+        connection.creation.destroy_test_db(test_db, verbosity=0)
+
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': args.database,
+            'generated_seconds': round(generated, 3),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'params': dict(graph.params(), readers=args.readers),
+        'results': results,
+    }
+    data = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
@@ -0,0 +1,38 @@
+import os
+
+import django
+from django.conf import settings
+
+
+def configure(database='sqlite', name=None):
+    """
+    Configure Django for benchmarks. PostgreSQL connection parameters are
+    read from the usual PGHOST, PGPORT, PGUSER and PGPASSWORD variables.
+    """
+    if database == 'postgresql':
+        db = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': name or os.environ.get('PGDATABASE', 'activity_benchmark'),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+        }
+    else:
+        db = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name or ':memory:'}
+
+    settings.configure(
+        DATABASES={'default': db},
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'activity'],
+        TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True}],
+        USE_TZ=True,
+        # Single fan-out chunks run inline, no broker is needed
+        ACTIVITY_FANOUT_CHUNK_SIZE=10 ** 9,
+    )
+
+    from celery import Celery
+    app = Celery('benchmarks')
+    app.conf.task_always_eager = True
+    app.set_default()
+
+    django.setup()
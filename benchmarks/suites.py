@@ -0,0 +1,160 @@
+"""
+Measurements run on a generated graph. Every suite returns a dictionary
+of results which is stored in the JSON output as is.
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from activity.models import Action, Follow, Stream
+from activity.pagination import paginate
+from activity.tasks import fanout_action
+from activity.views import ActivitiesView
+
+
+def summarize(timings, queries=None):
+    timings = sorted(timings)
+    result = {
+        'runs': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 3),
+    }
+    if queries is not None:
+        result['queries'] = queries
+    return result
+
+
+def measure(func, repeat=5):
+    """
+    Time ``func`` and count queries it runs
+    """
+    timings = []
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            func()
+            timings.append((time.time() - start) * 1000)
+    return summarize(timings, len(context.captured_queries))
+
+
+def fanout(graph, readers):
+    """
+    Fan out every action in creation order, which fills the streams read
+    by later suites
+    """
+    Stream.objects.all().delete()
+    action_ids = list(Action.objects.order_by('created', 'pk').values_list('pk', flat=True))
+    timings = []
+    start = time.time()
+    for action_id in action_ids:
+        action_start = time.time()
+        fanout_action(action_id)
+        timings.append((time.time() - action_start) * 1000)
+    elapsed = time.time() - start
+    rows = Stream.objects.count()
+    result = summarize(timings)
+    result.update({
+        'actions': len(action_ids),
+        'stream_rows': rows,
+        'seconds': round(elapsed, 3),
+        'actions_per_second': round(len(action_ids) / elapsed, 1),
+        'rows_per_second': round(rows / elapsed, 1),
+    })
+    return result
+
+
+def feed_depths(feed, readers, depths=(1, 5, 20), limit=20, repeat=5):
+    """
+    Measure reading the page at each depth of ``feed(user, before)`` for
+    every reader. Earlier pages are walked by cursor without measuring.
+    """
+    results = {}
+    for depth in depths:
+        timings = []
+        queries = []
+        for reader in readers:
+            cursor = None
+            for page in range(depth - 1):
+                cursor = paginate(feed(reader, cursor), limit).next_cursor
+                if cursor is None:
+                    break
+            if depth > 1 and cursor is None:
+                continue
+            result = measure(lambda: paginate(feed(reader, cursor), limit), repeat)
+            timings.append(result['median_ms'])
+            queries.append(result['queries'])
+        if timings:
+            results['page_%d' % depth] = dict(summarize(timings), queries=max(queries), readers=len(timings))
+    return results
+
+
+def user_feed(graph, readers):
+    return feed_depths(lambda user, before: Action.objects.user_feed(user, before=before), readers)
+
+
+def stream_feed(graph, readers):
+    return feed_depths(lambda user, before: Action.objects.stream_feed(user, before=before), readers)
+
+
+def render(graph, readers):
+    """
+    Measure rendering a stream page and the public page
+    """
+    view = ActivitiesView()
+    return {
+        'stream': measure(lambda: [view.stream(reader, limit=20, mark_seen=False) for reader in readers]),
+        'public': measure(lambda: view.public(limit=20)),
+    }
+
+
+def follow(graph, readers, count=100):
+    """
+    Measure FollowManager operations of a user following nobody yet
+    """
+    user = User.objects.create(username='benchmark-follower')
+    targets = list(User.objects.filter(pk__in=graph.popular.sample(count)))
+    single = targets[0]
+
+    def follow_one():
+        Follow.objects.follow(user, single)
+        Follow.objects.unfollow(user, single)
+
+    def follow_many():
+        Follow.objects.follow_many(user, targets)
+        Follow.objects.unfollow_many(user, targets)
+
+    results = {
+        'follow_unfollow': measure(follow_one),
+        'follow_unfollow_many_%d' % count: measure(follow_many),
+        # A fresh user object each time, answers are memoized on it
+        'is_following_many_%d' % count: measure(
+            lambda: Follow.objects.is_following_many(User.objects.get(pk=user.pk), targets)),
+    }
+    user.delete()
+    return results
+
+
+def user_feed_by_follows(graph, readers, counts=(10, 100, 1000, 10000), limit=20, repeat=5):
+    """
+    Measure the first page of ``ActionQuerySet.user_feed`` for users following
+    a growing number of actors. Counts beyond the size of the graph follow
+    every user of the graph and idle actors created to make up the rest.
+    """
+    idle_ids = []
+    missing = max(counts) - len(graph.user_ids)
+    if missing > 0:
+        graph.bulk_create(User, [User(username='benchmark-actor-%d' % i) for i in range(missing)])
+        idle_ids = list(User.objects.filter(username__startswith='benchmark-actor-')
+                        .order_by('pk').values_list('pk', flat=True))
+    results = {}
+    for count in counts:
+        reader = User.objects.create(username='benchmark-reader-%d' % count)
+        actor_ids = list(graph.popular.sample(count))
+        actor_ids += idle_ids[:count - len(actor_ids)]
+        graph.bulk_create(Follow, [Follow(user=reader, content_type=graph.user_type, object_id=object_id)
+                                   for object_id in actor_ids])
+        results['follows_%d' % count] = measure(lambda: list(Action.objects.user_feed(reader)[:limit]), repeat)
+    return results
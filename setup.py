@@ -15,7 +15,7 @@ author = 'Tomi Pajunen'
 author_email = 'tomi@madlab.fi'
 license = 'BSD'
 install_requires = [
-    'django>=1.9'
+    'django>=4.2,<6.0'
 ]
 
 
@@ -71,5 +71,6 @@ setup(
     author_email=author_email,
     packages=get_packages(package),
     package_data=get_package_data(package),
-    install_requires=install_requires
+    install_requires=install_requires,
+    python_requires='>=3.8'
 )
@@ -1,10 +1,28 @@
+SECRET_KEY = 'activity-tests'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': ':memory:',
     },
+    # Read replica for routing tests. It gets its own test database: a
+    # mirror shares the in-memory database of default, whose open test
+    # transaction locks the tables the mirror checks at teardown.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
 }
 
 INSTALLED_APPS = (
-    'myproject',
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'activity',
 )
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+    },
+]